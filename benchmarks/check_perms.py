@@ -0,0 +1,62 @@
+"""
+Compare check_perms against check_perms_legacy
+
+    python benchmarks/check_perms.py [--rules 1000] [--checks 1000]
+"""
+
+import argparse
+import os
+import random
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import django
+from django.conf import settings
+
+settings.configure(INSTALLED_APPS=[])
+django.setup()
+
+from django_namespace_perms import util
+
+SEGMENTS = ["org", "net", "user", "ix", "1", "2", "3", "name", "email", "*"]
+
+
+def random_namespace(rnd, max_depth):
+    return ".".join([rnd.choice(SEGMENTS) for i in range(rnd.randint(1, max_depth))])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--rules", type=int, default=1000)
+    parser.add_argument("--checks", type=int, default=1000)
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--seed", type=int, default=1)
+    args = parser.parse_args()
+
+    rnd = random.Random(args.seed)
+    perms = dict(
+        [(random_namespace(rnd, 5), rnd.choice([0, 1, 3])) for i in range(args.rules)]
+    )
+    namespaces = [random_namespace(rnd, 6) for i in range(args.checks)]
+
+    for ambiguous in (False, True):
+        for name, fn in (
+            ("check_perms_legacy", util.check_perms_legacy),
+            ("check_perms", util.check_perms),
+        ):
+
+            def run():
+                for ns in namespaces:
+                    fn(perms, ns, ambiguous=ambiguous)
+
+            best = min(timeit.repeat(run, number=1, repeat=args.repeat))
+            print(
+                "%-20s ambiguous=%-5s %5d rules %5d checks %9.4fs"
+                % (name, ambiguous, len(perms), len(namespaces), best)
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,386 @@
+"""
+Benchmark suite for django-namespace-perms
+
+    python benchmarks/run.py [--rules 10,1000,100000] [--wildcards 0,0.1]
+                             [--depths 4] [--cases has_perms,load_perms]
+                             [--json results.json] [--compare baseline.json]
+
+Permission sets are generated for every combination of rule count,
+wildcard density (share of namespace segments that are wildcards) and
+namespace depth, each case is timed against every permission set.
+Results can be written as JSON and compared against a previous run to
+track regressions between releases.
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import time
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+import django
+from django.conf import settings
+
+settings.configure(
+    INSTALLED_APPS=[
+        "django.contrib.auth",
+        "django.contrib.contenttypes",
+        "django_namespace_perms",
+    ],
+    DATABASES={"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": ":memory:"}},
+)
+django.setup()
+
+from django.contrib.auth.models import Group, User
+from django.core.management import call_command
+
+from django_namespace_perms import constants, util
+from django_namespace_perms.models import UserPermission
+
+APPS = ["auth", "net", "org", "ix", "fac"]
+
+MODELS = ["group", "network", "organization", "poc", "carrier"]
+
+FIELDS = ["name", "info", "email", "asn", "notes"]
+
+# namespaces checked per iteration of the has_perms and get_perms cases
+CHECKS = 1000
+
+# instances per iteration of the permissions_apply and model cases
+INSTANCES = 200
+
+
+###############################################################################
+
+
+def random_namespace(rnd, depth, wildcards):
+    """
+    Returns a namespace of 2 to depth segments, app.model.id.field...
+    """
+
+    keys = [rnd.choice(APPS), rnd.choice(MODELS)]
+    for i in range(rnd.randint(2, max(depth, 2)) - 2):
+        if i % 2:
+            keys.append(rnd.choice(FIELDS))
+        else:
+            keys.append(str(rnd.randint(1, 5000)))
+    return [k if rnd.random() >= wildcards else "*" for k in keys]
+
+
+def random_perms(rnd, count, depth, wildcards):
+    perms = {}
+    attempts = 0
+    while len(perms) < count and attempts < count * 10:
+        attempts += 1
+        ns = ".".join(random_namespace(rnd, depth, wildcards))
+        perms[ns] = rnd.choice(
+            [constants.PERM_DENY, constants.PERM_READ, constants.PERM_READ, 3]
+        )
+    return perms
+
+
+def nest(keys, value, data):
+    for k in keys[:-1]:
+        if not isinstance(data.get(k), dict):
+            data[k] = {}
+        data = data[k]
+    data[keys[-1]] = value
+
+
+def namespace_builder(**kwargs):
+    return "%s.%s" % (kwargs.get("id"), kwargs.get("name"))
+
+
+class Scenario(object):
+
+    """
+    Generated permission set and the data the cases run against
+    """
+
+    def __init__(self, rules, wildcards, depth, seed=1):
+        self.rules = rules
+        self.wildcards = wildcards
+        self.depth = depth
+
+        rnd = random.Random(seed)
+        self.perms = random_perms(rnd, rules, depth, wildcards)
+        self.struct = util.perms_structure(self.perms)
+        self.compact = util.compact_structure(self.perms)
+
+        self.user = User(id=1, username="bench")
+        util.set_perms(self.user, self.perms, self.struct)
+
+        # half of the checked namespaces are targeted by rules
+        rule_keys = [ns.split(".") for ns in self.perms]
+        self.namespaces = [
+            rnd.choice(rule_keys) + [rnd.choice(FIELDS)]
+            if i % 2
+            else random_namespace(rnd, depth, 0)
+            for i in range(CHECKS)
+        ]
+        self.namespace_strings = [".".join(keys) for keys in self.namespaces]
+
+        self.groups = [
+            Group(id=rnd.randint(1, 5000), name="group") for i in range(INSTANCES)
+        ]
+
+        self.data = {}
+        for keys in self.namespaces[:INSTANCES]:
+            nest(keys, "value", self.data)
+        self.data["auth"] = {
+            "group": {
+                "list": [
+                    {"id": group.id, "name": rnd.choice(FIELDS)}
+                    for group in self.groups
+                ]
+            }
+        }
+        self.ruleset = {
+            "require": dict(
+                [(".".join(keys), constants.PERM_READ) for keys in self.namespaces[:5]]
+            ),
+            "list-handlers": {"auth.group.list": {"namespace": namespace_builder}},
+        }
+
+    @property
+    def key(self):
+        return "rules=%d wildcards=%s depth=%d" % (
+            self.rules,
+            self.wildcards,
+            self.depth,
+        )
+
+
+###############################################################################
+
+
+def case_perms_structure(sc):
+    return lambda: util.perms_structure(sc.perms), 1
+
+
+def case_compact_structure(sc):
+    return lambda: util.compact_structure(sc.perms), 1
+
+
+def case_get_perms(sc):
+    def run():
+        for keys in sc.namespaces:
+            util.get_perms(sc.struct, keys)
+
+    return run, len(sc.namespaces)
+
+
+def case_has_perms(sc):
+    def run():
+        for ns in sc.namespace_strings:
+            util.has_perms(sc.user, ns, constants.PERM_READ)
+
+    return run, len(sc.namespace_strings)
+
+
+def case_has_perms_compact(sc):
+    def run():
+        for ns in sc.namespace_strings:
+            util.has_perms(sc.compact, ns, constants.PERM_READ)
+
+    return run, len(sc.namespace_strings)
+
+
+def case_has_perms_model(sc):
+    def run():
+        for group in sc.groups:
+            util.has_perms(sc.user, group, constants.PERM_READ)
+
+    return run, len(sc.groups)
+
+
+def case_has_perms_field(sc):
+    def run():
+        for group in sc.groups:
+            util.has_perms(sc.user, [group, "name"], constants.PERM_READ)
+
+    return run, len(sc.groups)
+
+
+def case_has_perms_many(sc):
+    def run():
+        util.has_perms_many(sc.user, sc.groups, constants.PERM_READ)
+
+    return run, len(sc.groups)
+
+
+def case_check_perms(sc):
+    # check_perms is deprecated, a smaller sample of namespaces is enough
+    namespaces = sc.namespace_strings[:100]
+
+    def run():
+        for ns in namespaces:
+            util.check_perms(sc.perms, ns)
+
+    return run, len(namespaces)
+
+
+def case_permissions_apply(sc):
+    return lambda: util.permissions_apply(sc.data, sc.struct), 1
+
+
+def case_permissions_apply_ruleset(sc):
+    return lambda: util.permissions_apply(sc.data, sc.struct, ruleset=sc.ruleset), 1
+
+
+def case_load_perms(sc):
+    user, created = User.objects.get_or_create(username="bench_%s" % id(sc))
+    if created:
+        UserPermission.objects.bulk_create(
+            [
+                UserPermission(user=user, namespace=ns, permissions=p)
+                for ns, p in sc.perms.items()
+            ]
+        )
+
+    def run():
+        util.load_perms(User(id=user.id, username=user.username))
+
+    return run, 1
+
+
+CASES = [
+    ("perms_structure", case_perms_structure),
+    ("compact_structure", case_compact_structure),
+    ("get_perms", case_get_perms),
+    ("has_perms", case_has_perms),
+    ("has_perms_compact", case_has_perms_compact),
+    ("has_perms_model", case_has_perms_model),
+    ("has_perms_field", case_has_perms_field),
+    ("has_perms_many", case_has_perms_many),
+    ("check_perms", case_check_perms),
+    ("permissions_apply", case_permissions_apply),
+    ("permissions_apply_ruleset", case_permissions_apply_ruleset),
+    ("load_perms", case_load_perms),
+]
+
+
+###############################################################################
+
+
+def measure(fn, repeat, min_time):
+    """
+    Returns the best and mean time of a single call of fn over repeat
+    rounds, each round calls fn as often as needed to take min_time
+
+    fn is called once before timing it, so one-off work like compiling
+    the user's permissions is not measured
+    """
+
+    fn()
+    timer = timeit.Timer(fn)
+    number = 1
+    while True:
+        elapsed = timer.timeit(number)
+        if elapsed >= min_time or number >= 1000000:
+            break
+        number *= 10 if elapsed < min_time / 10 else 2
+    times = [elapsed] + timer.repeat(repeat - 1, number)
+    times = [t / number for t in times]
+    return min(times), sum(times) / len(times)
+
+
+def csv_list(cast):
+    return lambda value: [cast(v) for v in value.split(",") if v]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().split("\n")[0])
+    parser.add_argument("--rules", type=csv_list(int), default=[10, 1000, 100000])
+    parser.add_argument("--wildcards", type=csv_list(float), default=[0.0, 0.1])
+    parser.add_argument("--depths", type=csv_list(int), default=[4])
+    parser.add_argument(
+        "--cases", type=csv_list(str), default=[name for name, case in CASES]
+    )
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--min-time", type=float, default=0.2)
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", help="write results to this file")
+    parser.add_argument("--compare", help="compare against results of a previous run")
+    args = parser.parse_args()
+
+    unknown = set(args.cases) - set([name for name, case in CASES])
+    if unknown:
+        parser.error("unknown cases: %s" % ", ".join(sorted(unknown)))
+
+    baseline = {}
+    if args.compare:
+        with open(args.compare) as fh:
+            for result in json.load(fh)["results"]:
+                baseline[(result["case"], result["scenario"])] = result
+
+    call_command("migrate", verbosity=0)
+
+    results = []
+    for rules in args.rules:
+        for wildcards in args.wildcards:
+            for depth in args.depths:
+                sc = Scenario(rules, wildcards, depth, seed=args.seed)
+                for name, case in CASES:
+                    if name not in args.cases:
+                        continue
+                    fn, ops = case(sc)
+                    best, mean = measure(fn, args.repeat, args.min_time)
+                    result = {
+                        "case": name,
+                        "scenario": sc.key,
+                        "rules": len(sc.perms),
+                        "wildcards": wildcards,
+                        "depth": depth,
+                        "ops": ops,
+                        "best": best,
+                        "mean": mean,
+                        "per_op": best / ops,
+                    }
+                    results.append(result)
+
+                    line = "%-26s %-36s %10.6fs %10.2fus/op" % (
+                        name,
+                        sc.key,
+                        best,
+                        result["per_op"] * 1000000,
+                    )
+                    previous = baseline.get((name, sc.key))
+                    if previous:
+                        line += " %6.2fx" % (best / previous["best"])
+                    print(line)
+                    sys.stdout.flush()
+
+    if args.json:
+        with open(args.json, "w") as fh:
+            json.dump(
+                {
+                    "meta": {
+                        "time": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+                        "python": platform.python_version(),
+                        "django": django.get_version(),
+                        "version": open(
+                            os.path.join(
+                                os.path.dirname(os.path.abspath(__file__)),
+                                "..",
+                                "Ctl",
+                                "VERSION",
+                            )
+                        )
+                        .read()
+                        .strip(),
+                    },
+                    "results": results,
+                },
+                fh,
+                indent=2,
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -1,3 +1,8 @@
+import threading
+import time
+import uuid
+
+from django.conf import settings
 from django.contrib import admin
 from django.contrib.auth import get_user_model
 from django.contrib.auth.admin import UserAdmin as DjangoUserAdmin
@@ -11,25 +16,169 @@ from django import forms
 from django.db import models
 
 
-def assign_group_to_all_users(modeladmin, request, queryset):
+# progress of group assignments running in the background, by task id
+TASKS = {}
+
+# seconds finished tasks are kept in TASKS
+TASKS_TIMEOUT = 3600
+
+
+def group_membership(group_ids, assign=True, batch_size=1000, progress=None):
+    """
+    Assigns all users to the groups or revokes the groups from all users
+
+    Memberships are inserted into / deleted from the through table in
+    batches of batch_size users, m2m_changed is sent once per group and
+    batch (same as group.user_set.add / remove) so permission caches are
+    invalidated.
+
+    progress <callable> - called with (done, total) after every batch
+    """
+
+    from django.db.models.signals import m2m_changed
+
     User = get_user_model()
-    users = User.objects.all()
-    for group in queryset:
-        # note: cant do bulk_save here since right now that doesnt trigger the save signal,
-        # revist when/if that get's fixed
-        for user in users:
-            group.user_set.add(user)
+    field = User.groups.field
+    through = field.remote_field.through
+    user_field = "%s_id" % field.m2m_field_name()
+    group_field = "%s_id" % field.m2m_reverse_field_name()
+
+    group_ids = list(group_ids)
+    if assign:
+        user_ids = list(User.objects.order_by("pk").values_list("pk", flat=True))
+        total = len(user_ids) * len(group_ids)
+    else:
+        members = through.objects.filter(**{"%s__in" % group_field: group_ids})
+        total = members.count()
+
+    if progress:
+        progress(0, total)
+
+    done = 0
+    for group in Group.objects.filter(id__in=group_ids):
+        qset = through.objects.filter(**{group_field: group.id})
+        if not assign:
+            user_ids = list(
+                qset.order_by(user_field).values_list(user_field, flat=True)
+            )
+
+        for i in range(0, len(user_ids), batch_size):
+            batch = user_ids[i : i + batch_size]
+            done += len(batch)
+
+            if assign:
+                existing = set(
+                    qset.filter(**{"%s__in" % user_field: batch}).values_list(
+                        user_field, flat=True
+                    )
+                )
+                pk_set = set(batch) - existing
+                action = "add"
+            else:
+                pk_set = set(batch)
+                action = "remove"
+
+            if pk_set:
+                m2m_changed.send(
+                    sender=through,
+                    action="pre_%s" % action,
+                    instance=group,
+                    reverse=True,
+                    model=User,
+                    pk_set=pk_set,
+                    using=qset.db,
+                )
+                if assign:
+                    # only the memberships missing from the batch, no
+                    # ignore_conflicts as it requires django 2.2
+                    through.objects.bulk_create(
+                        [
+                            through(**{user_field: user_id, group_field: group.id})
+                            for user_id in pk_set
+                        ]
+                    )
+                else:
+                    qset.filter(**{"%s__in" % user_field: pk_set}).delete()
+                m2m_changed.send(
+                    sender=through,
+                    action="post_%s" % action,
+                    instance=group,
+                    reverse=True,
+                    model=User,
+                    pk_set=pk_set,
+                    using=qset.db,
+                )
+
+            if progress:
+                progress(done, total)
+
+
+def prune_tasks():
+    """
+    Removes tasks that finished more than TASKS_TIMEOUT seconds ago from
+    TASKS
+    """
+
+    now = time.monotonic()
+    for task_id, task in list(TASKS.items()):
+        if task["finished"] and now - task["finished_at"] > TASKS_TIMEOUT:
+            TASKS.pop(task_id, None)
+
+
+def run_in_background(func, *args, **kwargs):
+    """
+    Runs func in a background thread, passing it a progress callback,
+    and returns the id of the task, its progress is kept in TASKS
+
+    The thread is not a daemon thread, the process waits for it to
+    finish on shutdown.
+    """
+
+    from django.db import connection
+
+    prune_tasks()
+
+    task_id = uuid.uuid4().hex
+    task = {"done": 0, "total": None, "finished": False, "error": None}
+    TASKS[task_id] = task
+
+    def progress(done, total):
+        task.update(done=done, total=total)
+
+    def run():
+        try:
+            func(*args, progress=progress, **kwargs)
+        except Exception as exc:
+            task["error"] = str(exc)
+        finally:
+            task["finished_at"] = time.monotonic()
+            task["finished"] = True
+            connection.close()
+
+    threading.Thread(target=run).start()
+    return task_id
+
+
+def update_group_membership(modeladmin, request, queryset, assign):
+    group_ids = list(queryset.values_list("id", flat=True))
+    if getattr(settings, "NSP_ADMIN_BACKGROUND", False):
+        task_id = run_in_background(group_membership, group_ids, assign=assign)
+        modeladmin.message_user(
+            request, "Updating group memberships in the background (task %s)" % task_id
+        )
+    else:
+        group_membership(group_ids, assign=assign)
+
+
+def assign_group_to_all_users(modeladmin, request, queryset):
+    update_group_membership(modeladmin, request, queryset, True)
 
 
 assign_group_to_all_users.short_description = "Assign selected groups to all users"
 
 
 def revoke_group_from_all_users(modeladmin, request, queryset):
-    User = get_user_model()
-    users = User.objects.all()
-    for group in queryset:
-        for user in users:
-            group.user_set.remove(user)
+    update_group_membership(modeladmin, request, queryset, False)
 
 
 revoke_group_from_all_users.short_description = "Revoke selected groups from all users"
@@ -4,3 +4,8 @@ from django.apps import AppConfig
 class NSPAppConfig(AppConfig):
     name = "django_namespace_perms"
     verbose_name = "Django Namespace Permissions"
+
+    def ready(self):
+        from django_namespace_perms.cache import connect_signals
+
+        connect_signals()
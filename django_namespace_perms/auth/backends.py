@@ -2,17 +2,19 @@ from django.contrib.auth.models import User
 from django.contrib.auth.backends import ModelBackend
 
 from django_namespace_perms.constants import *
+from django_namespace_perms.matcher import NamespaceMatcher
 from django_namespace_perms.util import (
     NAMESPACES,
+    PERMCODE_RE,
     obj_to_namespace,
     permcode_to_namespace,
     has_perms,
     load_perms,
+    perms_matcher,
 )
 
 import logging
 import re
-import collections
 
 log = logging.getLogger("django")
 
@@ -31,10 +33,39 @@ class NSPBackend(ModelBackend):
     def load_perms(self, user_obj):
         return load_perms(user_obj)
 
+    def perms(self, user_obj):
+        """
+        Returns the perms to check against, the user's compiled perms
+        unless load_perms was overridden to return something else
+        """
+        perms = self.load_perms(user_obj)
+        if perms is getattr(user_obj, "_nsp_perms", None):
+            return perms_matcher(user_obj)
+        return perms
+
+    def permcode(self, perm, obj=None):
+        """
+        Returns the (namespace, level) tuple a django permission code is
+        checked as, besides add, change and delete the operations returned
+        by obj.nsp_write_ops() require write perms
+        """
+
+        namespace, level = permcode_to_namespace(perm)
+
+        write_ops = getattr(obj, "nsp_write_ops", None)
+        if not callable(write_ops):
+            return namespace, level
+
+        label, perm_code = perm.split(".")
+        op, _, model = perm_code.partition("_")
+        if model and not PERMCODE_RE.match(perm_code) and op in write_ops():
+            return "%s.%s.%s" % (label, model, op), PERM_WRITE
+        return namespace, level
+
     def has_module_perms(self, user_obj, obj=None):
         if hasattr(obj, "nsp_namespace"):
             fn = getattr(obj, "nsp_namespace")
-            if not isinstance(fn, collections.Callable):
+            if not callable(fn):
                 raise Exception(
                     "nsp_namespace attribute needs to be callable for %s" % obj
                 )
@@ -42,11 +73,12 @@ class NSPBackend(ModelBackend):
         else:
             namespace = obj_to_namespace(obj)
 
-        log.info("Checking module perms: %s" % namespace)
+        if log.isEnabledFor(logging.INFO):
+            log.info("Checking module perms: %s", namespace)
 
-        perms = self.load_perms(user_obj)
+        perms = self.perms(user_obj)
 
-        return has_perms(perms, namespace, PERM_READ)
+        return has_perms(perms, namespace, PERM_READ, ambiguous=True)
 
     def has_perm(self, user_obj, perm, obj=None):
 
@@ -58,14 +90,40 @@ class NSPBackend(ModelBackend):
         if user_obj.is_superuser:
             return True
 
-        namespace, level = permcode_to_namespace(perm)
-
-        write_ops = ["add", "delete", "change"]
-        if hasattr(obj, "nsp_write_ops") and callable(obj, "nsp_write_ops"):
-            write_ops.extend(getattr(obj, "nsp_write_ops")())
+        namespace, level = self.permcode(perm, obj)
 
-        log.info("NSP has_perms %s %s %s" % (namespace, perm, level))
+        if log.isEnabledFor(logging.INFO):
+            log.info("NSP has_perms %s %s %s", namespace, perm, level)
 
-        perms = self.load_perms(user_obj)
+        perms = self.perms(user_obj)
 
         return has_perms(perms, namespace, level)
+
+    def has_perms_batch(self, user_obj, perm_list, obj=None):
+        """
+        Check many django permission codes at once, returns a list of
+        bools, one for each permission code
+
+        All permission codes are resolved against the user's compiled
+        perms in one go, permission codes of the same model share the
+        walk of its namespace.
+        """
+
+        if user_obj.is_superuser:
+            return [True for perm in perm_list]
+
+        checks = [self.permcode(perm, obj) for perm in perm_list]
+
+        if log.isEnabledFor(logging.INFO):
+            log.info("NSP has_perms_batch %s", ", ".join(perm_list))
+
+        perms = self.perms(user_obj)
+
+        if not isinstance(perms, NamespaceMatcher):
+            return [has_perms(perms, namespace, level) for namespace, level in checks]
+
+        values = perms.get_many([namespace.split(".") for namespace, level in checks])
+        return [
+            value is not None and (value & level) == level
+            for value, (namespace, level) in zip(values, checks)
+        ]
@@ -0,0 +1,532 @@
+"""
+Cross-request cache for loaded permissions
+
+load_perms caches two kinds of layers:
+
+    - per user: the user's group ids and UserPermission rules
+    - per set of groups: the merged group permissions and their structure,
+      shared by all users that are members of exactly these groups
+
+Cache keys contain version stamps. Version stamps are replaced whenever
+a permission or group membership changes, which orphans any cached entries
+built from the old state. Inside a transaction they are replaced right
+away and again once it commits, so entries other processes built from the
+rows before the commit are orphaned as well. Until the transaction ends,
+layers it loads are kept apart from the shared cache (see
+transaction_cache), a rollback leaves nothing behind.
+
+Configure via settings:
+
+    NSP_CACHE - None/False (default) disables caching, "lru" uses an
+    in-process LRU cache, any other value is used as a django cache alias
+    and must be configured in CACHES
+
+    NSP_CACHE_SIZE - max entries in the in-process LRU cache (1024)
+
+    NSP_CACHE_TIMEOUT - seconds cached permissions are kept (300)
+
+The in-process LRU cache is shared by all threads of the process, reads
+don't take its lock. Concurrent misses for the same layer within a process
+are loaded once (see SingleFlight), the other threads wait for and share
+the result. Cached layers are shared, they must never be mutated.
+"""
+
+import collections
+import threading
+import time
+import uuid
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+from django_namespace_perms import context
+
+CACHE_PREFIX = "nsp"
+
+SCOPE_GLOBAL = "global"
+
+_lru = None
+
+
+#############################################################################
+
+
+class LRUCache(object):
+
+    """
+    Minimal in-process least recently used cache implementing the
+    get / set / get_many / delete subset of the django cache interface
+
+    Entries expire after the timeout passed to set (None keeps them until
+    they are evicted). Reads don't block, they skip updating the recency
+    of the entry while another thread holds the lock.
+    """
+
+    def __init__(self, max_size=1024):
+        self.max_size = max_size
+        self.data = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key, default=None):
+        entry = self.data.get(key)
+        if entry is None:
+            return default
+
+        expires, value = entry
+        if expires is not None and expires <= time.monotonic():
+            with self.lock:
+                if self.data.get(key) is entry:
+                    del self.data[key]
+            return default
+
+        if self.lock.acquire(False):
+            try:
+                if key in self.data:
+                    self.data.move_to_end(key)
+            finally:
+                self.lock.release()
+        return value
+
+    def set(self, key, value, timeout=None):
+        if timeout is not None and timeout <= 0:
+            self.delete(key)
+            return
+        expires = None if timeout is None else time.monotonic() + timeout
+        with self.lock:
+            self.data[key] = (expires, value)
+            self.data.move_to_end(key)
+            while len(self.data) > self.max_size:
+                self.data.popitem(last=False)
+
+    def get_many(self, keys):
+        rv = {}
+        for key in keys:
+            value = self.get(key)
+            if value is not None:
+                rv[key] = value
+        return rv
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def clear(self):
+        with self.lock:
+            self.data.clear()
+
+
+class IdentityCache(object):
+
+    """
+    Least recently used cache for values computed from objects that are
+    neither hashable nor weakly referenceable (dicts, permission
+    structures), keyed by the identity of the object
+
+    Each entry holds a token that is checked on get, so an entry is never
+    returned for a different object that reuses the id: by default the
+    object itself, which is kept alive while it is cached. snapshot(obj)
+    can instead return a copy of the state the value is computed from,
+    then changes made to the object afterwards miss the cache too.
+    """
+
+    def __init__(self, max_size=128, snapshot=None):
+        self.lru = LRUCache(max_size)
+        self.snapshot = snapshot
+
+    def get(self, obj, default=None):
+        entry = self.lru.get(id(obj))
+        if entry is None:
+            return default
+        if self.snapshot is None:
+            valid = entry[0] is obj
+        else:
+            valid = entry[0] == self.snapshot(obj)
+        return entry[1] if valid else default
+
+    def set(self, obj, value):
+        token = obj if self.snapshot is None else self.snapshot(obj)
+        self.lru.set(id(obj), (token, value))
+
+    def clear(self):
+        self.lru.clear()
+
+
+class SingleFlight(object):
+
+    """
+    Runs a function once for concurrent callers with the same key, the
+    other callers wait for it to finish and share its result
+
+    If the function raises, the waiting callers run it themselves.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.calls = {}
+
+    def do(self, key, fn):
+        with self.lock:
+            call = self.calls.get(key)
+            leader = call is None
+            if leader:
+                call = self.calls[key] = {"done": threading.Event()}
+
+        if not leader:
+            call["done"].wait()
+            if "result" in call:
+                return call["result"]
+            return fn()
+
+        try:
+            call["result"] = fn()
+            return call["result"]
+        finally:
+            with self.lock:
+                del self.calls[key]
+            call["done"].set()
+
+
+_lru_lock = threading.Lock()
+
+_flights = SingleFlight()
+
+
+#############################################################################
+
+
+def get_backend():
+    """
+    Returns the cache backend as configured by NSP_CACHE or None if
+    caching is disabled
+    """
+
+    global _lru
+
+    name = getattr(settings, "NSP_CACHE", None)
+    if not name:
+        return None
+
+    if name != "lru":
+        if name not in getattr(settings, "CACHES", {}):
+            raise ImproperlyConfigured(
+                "NSP_CACHE '%s' is not a cache configured in CACHES" % name
+            )
+
+        from django.core.cache import caches
+
+        return caches[name]
+
+    if _lru is None:
+        with _lru_lock:
+            if _lru is None:
+                _lru = LRUCache(max_size=getattr(settings, "NSP_CACHE_SIZE", 1024))
+    return _lru
+
+
+def get_or_load(backend, key, load):
+    """
+    Returns the value cached for key, on a miss load() is called to build
+    it and the result is cached
+
+    Concurrent misses for the same key are loaded once per process.
+    """
+
+    pending = transaction_cache()
+    if pending is not None:
+        return get_or_load_pending(pending, key, load)
+
+    value = backend.get(key)
+    if value is not None:
+        context.stat("cache_hits")
+        return value
+    context.stat("cache_misses")
+
+    def fill():
+        # another thread may have filled it since our miss
+        value = backend.get(key)
+        if value is None:
+            value = load()
+            backend.set(key, value, cache_timeout())
+        return value
+
+    return _flights.do(key, fill)
+
+
+async def aget_or_load(backend, key, aload):
+    """
+    Async version of get_or_load for the in-process cache backend, on a
+    miss the coroutine returned by aload() builds the value
+
+    Concurrent misses are not coordinated, each coroutine loads the value.
+    """
+
+    pending = transaction_cache()
+    if pending is not None:
+        if key not in pending:
+            context.stat("cache_misses")
+            pending[key] = await aload()
+        else:
+            context.stat("cache_hits")
+        return pending[key]
+
+    value = backend.get(key)
+    if value is not None:
+        context.stat("cache_hits")
+        return value
+    context.stat("cache_misses")
+
+    value = await aload()
+    backend.set(key, value, cache_timeout())
+    return value
+
+
+def get_or_load_pending(pending, key, load):
+    """
+    get_or_load for the dict returned by transaction_cache
+    """
+
+    value = pending.get(key)
+    if value is not None:
+        context.stat("cache_hits")
+        return value
+    context.stat("cache_misses")
+    value = pending[key] = load()
+    return value
+
+
+def transaction_cache(using=None):
+    """
+    Returns the dict layers are cached in while the current transaction
+    has changed permissions, or None if they go to the shared cache
+
+    Every savepoint that changes permissions gets a dict of its own (see
+    bump_on_commit), a savepoint that is rolled back takes its on_commit
+    hook and with it its dict along, the enclosing savepoint's dict is
+    used again.
+    """
+
+    from django.db import transaction
+
+    connection = transaction.get_connection(using)
+    if not connection.in_atomic_block:
+        return None
+
+    pending = getattr(connection, "nsp_pending", None)
+    if not pending:
+        return None
+
+    hooks = set([id(hook[1]) for hook in connection.run_on_commit])
+    while pending and id(pending[-1][0]) not in hooks:
+        pending.pop()
+    if not pending:
+        return None
+    return pending[-1][1]
+
+
+def cache_timeout():
+    return getattr(settings, "NSP_CACHE_TIMEOUT", 300)
+
+
+#############################################################################
+
+
+def version_key(scope):
+    return "%s:v:%s" % (CACHE_PREFIX, scope)
+
+
+def get_version(backend, scope):
+    """
+    Returns the current version stamp for the specified scope, creating
+    one if it does not exist yet
+    """
+
+    key = version_key(scope)
+    version = backend.get(key)
+    if version is None:
+        version = uuid.uuid4().hex
+        backend.set(key, version, None)
+    return version
+
+
+def bump_version(scope):
+    """
+    Replace the version stamp for the specified scope, invalidating all
+    cache entries built with the old one
+    """
+
+    backend = get_backend()
+    if backend is None:
+        return
+    backend.set(version_key(scope), uuid.uuid4().hex, None)
+    bump_on_commit(scope)
+
+
+def bump_on_commit(scope, using=None):
+    """
+    Replace the version stamp for the specified scope again once the
+    current transaction commits, and keep the layers loaded until then
+    apart from the shared cache (see transaction_cache)
+    """
+
+    from django.db import transaction
+
+    connection = transaction.get_connection(using)
+    if not connection.in_atomic_block:
+        return
+
+    pending = transaction_cache(using)
+    last = getattr(connection, "nsp_pending", None)
+    sids = tuple(connection.savepoint_ids)
+    if pending is None or last[-1][2] != sids:
+        scopes = set()
+
+        def bump():
+            connection.nsp_pending = []
+            backend = get_backend()
+            if backend is not None:
+                for scope in scopes:
+                    backend.set(version_key(scope), uuid.uuid4().hex, None)
+
+        transaction.on_commit(bump, using=using)
+        # (on_commit hook, cached layers, savepoint ids, scopes to bump)
+        if pending is None:
+            last = connection.nsp_pending = []
+        last.append((bump, {}, sids, scopes))
+
+    last[-1][3].add(scope)
+
+
+def user_scope(user_id):
+    return "user:%s" % user_id
+
+
+def group_scope(group_id):
+    return "group:%s" % group_id
+
+
+def user_key(backend, user):
+    """
+    Returns the cache key for the user's permission layer
+    """
+
+    gv = get_version(backend, SCOPE_GLOBAL)
+    if not user.is_authenticated:
+        return "%s:user:guest:%s" % (CACHE_PREFIX, gv)
+    uv = get_version(backend, user_scope(user.pk))
+    return "%s:user:%s:%s:%s" % (CACHE_PREFIX, user.pk, gv, uv)
+
+
+def group_layer_key(backend, group_ids):
+    """
+    Returns the cache key for the merged permission layer of the specified
+    groups
+    """
+
+    group_ids = sorted(group_ids)
+    keys = [version_key(group_scope(group_id)) for group_id in group_ids]
+    versions = backend.get_many(keys)
+    stamps = []
+    for group_id, key in zip(group_ids, keys):
+        version = versions.get(key)
+        if version is None:
+            version = get_version(backend, group_scope(group_id))
+        stamps.append("%s-%s" % (group_id, version))
+    return "%s:groups:%s:%s" % (
+        CACHE_PREFIX,
+        get_version(backend, SCOPE_GLOBAL),
+        ",".join(stamps),
+    )
+
+
+def invalidate_user(user_id):
+    context.invalidate(user_id)
+    bump_version(user_scope(user_id))
+
+
+def invalidate_group(group_id):
+    context.invalidate()
+    bump_version(group_scope(group_id))
+
+
+def invalidate_all():
+    context.invalidate()
+    bump_version(SCOPE_GLOBAL)
+
+
+#############################################################################
+# signal handlers
+
+
+def user_permission_changed(sender, instance, **kwargs):
+    invalidate_user(instance.user_id)
+
+
+def group_permission_changed(sender, instance, **kwargs):
+    invalidate_group(instance.group_id)
+
+
+def user_group_changed(sender, instance, **kwargs):
+    invalidate_user(instance.user_id)
+
+
+def group_renamed(sender, instance, **kwargs):
+    from django_namespace_perms.util import guest_group_name
+
+    # remember if the group was the guest group before being saved, so
+    # renaming the guest group invalidates the guest layers as well
+    instance._nsp_was_guest = False
+    if instance.pk is not None:
+        name = (
+            sender.objects.filter(pk=instance.pk).values_list("name", flat=True).first()
+        )
+        instance._nsp_was_guest = name == guest_group_name()
+
+
+def group_changed(sender, instance, **kwargs):
+    from django_namespace_perms.util import guest_group_name
+
+    # guest users are resolved to the guest group by name
+    if instance.name == guest_group_name() or getattr(
+        instance, "_nsp_was_guest", False
+    ):
+        invalidate_all()
+
+
+def user_groups_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith("post_"):
+        return
+    if not reverse:
+        invalidate_user(instance.pk)
+    elif pk_set:
+        for user_id in pk_set:
+            invalidate_user(user_id)
+    else:
+        # group cleared of all its users, we dont know who was affected
+        invalidate_all()
+
+
+def connect_signals():
+    from django.contrib.auth import get_user_model
+    from django.contrib.auth.models import Group
+    from django.db.models.signals import (
+        m2m_changed,
+        post_delete,
+        post_save,
+        pre_save,
+    )
+    from django_namespace_perms.models import (
+        UserPermission,
+        GroupPermission,
+        UserGroup,
+    )
+
+    for signal in (post_save, post_delete):
+        signal.connect(user_permission_changed, sender=UserPermission)
+        signal.connect(group_permission_changed, sender=GroupPermission)
+        signal.connect(user_group_changed, sender=UserGroup)
+        signal.connect(group_changed, sender=Group)
+    pre_save.connect(group_renamed, sender=Group)
+
+    groups = getattr(get_user_model(), "groups", None)
+    if groups is not None:
+        m2m_changed.connect(user_groups_changed, sender=groups.through)
@@ -0,0 +1,226 @@
+"""
+Request scoped permission context
+
+PermissionContextMiddleware activates a PermissionContext for every
+request. While it is active the permissions of a user are loaded, built
+into a structure and compiled at most once, every entry point (backend,
+rest framework classes, serializers, template tags) resolving perms for
+the same user reuses them, even through different user objects.
+
+The context also counts loads, builds and compiles, which is useful to
+spot code paths that bypass it. Set NSP_CONTEXT_HEADER to True to add the
+counters to responses as X-NSP-Perms header.
+
+With metrics enabled (NSP_METRICS, see middleware) the context also
+records calls and cumulative time of the instrumented entry points, cache
+hits and misses and the number of rules built into structures. Without
+an active context, or with metrics disabled, instrumented functions only
+pay for a context variable lookup.
+
+The active context is kept in a context variable, so it follows a request
+across sync_to_async / async_to_sync and concurrent requests served by the
+same event loop don't share it. On python 3.6 it is kept in a thread local.
+"""
+
+import asyncio
+import functools
+import threading
+import time
+
+try:
+    import contextvars
+except ImportError:  # python 3.6
+    contextvars = None
+
+
+class Local(threading.local):
+
+    # class attribute default, avoids raising AttributeError on lookups
+    # in threads that never activated a context
+    context = None
+
+
+if contextvars is not None:
+    _var = contextvars.ContextVar("nsp_context", default=None)
+    _get = _var.get
+    _set = _var.set
+else:
+    _local = Local()
+
+    def _get():
+        return _local.context
+
+    def _set(context):
+        _local.context = context
+
+
+class PermissionContext(object):
+
+    """
+    Loaded permissions shared for the duration of a request
+
+    counters <dict> - number of "loads", "builds" and "compiles"
+
+    metrics <bool> - whether calls and stats are recorded
+
+    calls <dict> - [count, seconds] for each instrumented function
+
+    stats <dict> - "context_hits", "cache_hits", "cache_misses" and the
+    number of "rules" built into structures
+    """
+
+    def __init__(self, metrics=False):
+        self.users = {}
+        self.counters = {"loads": 0, "builds": 0, "compiles": 0}
+        self.metrics = metrics
+        self.calls = {}
+        self.stats = {}
+
+    def key(self, user):
+        if hasattr(user, "nsp_manual"):
+            # manual perms are set on the user object
+            return None
+        if not user.is_authenticated:
+            return "guest"
+        return user.pk
+
+    def store(self, user):
+        """
+        Keep the permissions loaded for the user object
+        """
+
+        key = self.key(user)
+        if key is not None:
+            self.users[key] = (
+                user._nsp_perms,
+                user._nsp_perms_struct,
+                getattr(user, "_nsp_perms_matcher", None),
+            )
+
+    def restore(self, user):
+        """
+        Set the permissions kept for the user on the user object, returns
+        False if there are none
+        """
+
+        key = self.key(user)
+        if key is None or key not in self.users:
+            return False
+        permdict, struct, matcher = self.users[key]
+        user._nsp_perms = user._nsp_perms_source = permdict
+        user._nsp_perms_struct = struct
+        user._nsp_perms_matcher = matcher
+        return True
+
+    def invalidate(self, user_id=None):
+        """
+        Drop the permissions kept for a user, or for all users if no
+        user_id is specified
+        """
+
+        if user_id is None:
+            self.users.clear()
+        else:
+            self.users.pop(user_id, None)
+
+    def header(self):
+        return "; ".join(["%s=%d" % item for item in sorted(self.counters.items())])
+
+    def record(self, name, seconds):
+        call = self.calls.get(name)
+        if call is None:
+            self.calls[name] = [1, seconds]
+        else:
+            call[0] += 1
+            call[1] += seconds
+
+    def report(self):
+        """
+        Returns the recorded metrics as a dict
+        """
+
+        return {
+            "counters": dict(self.counters),
+            "stats": dict(self.stats),
+            "calls": dict(
+                [
+                    (name, {"count": count, "time": seconds})
+                    for name, (count, seconds) in self.calls.items()
+                ]
+            ),
+        }
+
+
+#############################################################################
+
+
+def current():
+    """
+    Returns the active PermissionContext or None
+    """
+
+    return _get()
+
+
+def activate(context):
+    _set(context)
+
+
+def deactivate():
+    _set(None)
+
+
+def count(name):
+    context = current()
+    if context is not None:
+        context.counters[name] += 1
+
+
+def stat(name, value=1):
+    context = current()
+    if context is not None and context.metrics:
+        context.stats[name] = context.stats.get(name, 0) + value
+
+
+def invalidate(user_id=None):
+    context = current()
+    if context is not None:
+        context.invalidate(user_id)
+
+
+def instrumented(name):
+    """
+    Decorator recording calls and cumulative time of the decorated
+    function in the active context, if it has metrics enabled
+    """
+
+    def decorator(fn):
+        if asyncio.iscoroutinefunction(fn):
+
+            @functools.wraps(fn)
+            async def async_wrapper(*args, **kwargs):
+                context = _get()
+                if context is None or not context.metrics:
+                    return await fn(*args, **kwargs)
+                start = time.perf_counter()
+                try:
+                    return await fn(*args, **kwargs)
+                finally:
+                    context.record(name, time.perf_counter() - start)
+
+            return async_wrapper
+
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            context = _get()
+            if context is None or not context.metrics:
+                return fn(*args, **kwargs)
+            start = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                context.record(name, time.perf_counter() - start)
+
+        return wrapper
+
+    return decorator
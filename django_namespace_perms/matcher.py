@@ -0,0 +1,352 @@
+"""
+Compiled namespace matcher
+
+A NamespaceMatcher resolves namespaces against a set of permission rules
+with the same semantics as util.get_perms, but walks a precompiled node
+tree iteratively instead of recursing through the nested dicts produced by
+util.perms_structure.
+"""
+
+WILDCARD = "*"
+
+
+class PermissionNode(object):
+
+    """
+    Node in a compiled permission tree
+
+    children <dict> - child nodes by namespace segment, includes the
+    wildcard child
+
+    wildcard <PermissionNode|None> - the wildcard child
+
+    value <int|None> - permissions set by a rule targeting this node
+
+    subtree <frozenset|None> - permission values set by the rules at or
+    below this node, computed by NamespaceMatcher.aggregate
+    """
+
+    __slots__ = ("children", "wildcard", "value", "subtree")
+
+    def __init__(self):
+        self.children = {}
+        self.wildcard = None
+        self.value = None
+        self.subtree = None
+
+    def child(self, key):
+        node = self.children.get(key)
+        if node is None:
+            node = self.children[key] = PermissionNode()
+            if key == WILDCARD:
+                self.wildcard = node
+        return node
+
+
+class NamespaceMatcher(object):
+
+    """
+    Resolves namespaces against a compiled permission tree, use
+    compile_perms to create one
+    """
+
+    __slots__ = ("root", "aggregated")
+
+    def __init__(self, root):
+        self.root = root
+        self.aggregated = False
+
+    def get(self, keys, explicit=False):
+        """
+        Returns the permission value for the namespace or None if no
+        rule matches it
+
+        keys <list|str> - the namespace, either as string or already split
+        into segments
+
+        explicit <bool=False> - if true, only rules targeting the full
+        namespace will match
+        """
+
+        if type(keys) == str:
+            keys = keys.split(".")
+        return self.resolve(self.root, keys, 0, explicit)
+
+    def resolve(self, node, keys, depth, explicit=False):
+        """
+        Resolve keys[depth:] starting at node, which is assumed to have
+        been reached by matching keys[:depth]
+        """
+
+        n = len(keys)
+        if depth >= n:
+            return None
+
+        # depth first search, exact matches before wildcard matches and
+        # deeper matches before shallower ones. stack entries are
+        # (node, depth, is_value) where value entries sit below the
+        # node's subtree so they are only reached once it is exhausted.
+        stack = [(node, depth, False)]
+        pop = stack.pop
+        push = stack.append
+
+        while stack:
+            node, depth, is_value = pop()
+            if is_value:
+                return node.value
+
+            k = keys[depth]
+            depth += 1
+            exact = node.children.get(k)
+            wildcard = node.wildcard
+
+            if wildcard is not None and wildcard is not exact:
+                # the value of a wildcard node that has children is only
+                # matched by a literal "*" segment, same as get_perms
+                if (
+                    wildcard.value is not None
+                    and not wildcard.children
+                    and (not explicit or depth == n)
+                ):
+                    push((wildcard, depth, True))
+                if wildcard.children and depth < n:
+                    push((wildcard, depth, False))
+
+            if exact is not None:
+                if exact.value is not None and (not explicit or depth == n):
+                    push((exact, depth, True))
+                if exact.children and depth < n:
+                    push((exact, depth, False))
+
+        return None
+
+    def plan(self, prefix, explicit=False):
+        """
+        Walk a namespace prefix and return the search plan for namespaces
+        that extend it by at least one segment
+
+        The plan is a list of (node, value) tuples in match order: a node
+        entry means the rest of the namespace needs to be resolved from
+        that node, a value entry (node is None) is a match.
+        """
+
+        m = len(prefix)
+        rv = []
+        stack = [(self.root, 0, False)]
+        pop = stack.pop
+        push = stack.append
+
+        while stack:
+            node, depth, is_value = pop()
+            if is_value:
+                rv.append((None, node.value))
+                continue
+            if depth == m:
+                rv.append((node, None))
+                continue
+
+            k = prefix[depth]
+            depth += 1
+            exact = node.children.get(k)
+            wildcard = node.wildcard
+
+            # namespaces are longer than the prefix, so values along the
+            # prefix only ever match in non-explicit mode
+            if wildcard is not None and wildcard is not exact:
+                if wildcard.value is not None and not wildcard.children:
+                    if not explicit:
+                        push((wildcard, depth, True))
+                if wildcard.children:
+                    push((wildcard, depth, False))
+
+            if exact is not None:
+                if exact.value is not None and not explicit:
+                    push((exact, depth, True))
+                if exact.children:
+                    push((exact, depth, False))
+
+        return rv
+
+    def get_many(self, namespaces, explicit=False):
+        """
+        Returns a list of permission values (or None) for the namespaces
+
+        The walk of the shared prefix (all but the last segment) is done
+        once per distinct prefix, so namespaces like app.model.<id> only
+        each resolve their last segment.
+
+        namespaces <list> - namespaces, either as strings or already split
+        into segments
+
+        explicit <bool|list> - explicit flag for all namespaces or a list
+        holding a flag for each namespace
+        """
+
+        plans = {}
+        rv = []
+        for i, keys in enumerate(namespaces):
+            if type(keys) == str:
+                keys = keys.split(".")
+            if type(explicit) == list:
+                _explicit = explicit[i]
+            else:
+                _explicit = explicit
+
+            m = len(keys) - 1
+            if m < 0:
+                rv.append(None)
+                continue
+
+            plan_key = (tuple(keys[:m]), _explicit)
+            plan = plans.get(plan_key)
+            if plan is None:
+                plan = plans[plan_key] = self.plan(keys[:m], explicit=_explicit)
+
+            value = None
+            for node, _value in plan:
+                if node is None:
+                    value = _value
+                    break
+                value = self.resolve(node, keys, m, _explicit)
+                if value is not None:
+                    break
+            rv.append(value)
+
+        return rv
+
+    def node_keys(self, node):
+        """
+        Returns the segments of the children of node
+        """
+
+        return node.children.keys()
+
+    def check(self, keys, level, explicit=False):
+        """
+        Returns whether the namespace resolves to permissions that contain
+        all the flags in level
+        """
+
+        value = self.get(keys, explicit=explicit)
+        if value is None:
+            return False
+        return (value & level) == level
+
+    def aggregate(self):
+        """
+        Compute the subtree aggregates of all nodes, this is done once on
+        the first ambiguous check
+        """
+
+        if self.aggregated:
+            return
+
+        # identical sets of values are shared between nodes
+        interned = {}
+        stack = [(self.root, False)]
+        while stack:
+            node, visited = stack.pop()
+            if not visited:
+                stack.append((node, True))
+                stack.extend([(child, False) for child in node.children.values()])
+                continue
+            values = set()
+            if node.value is not None:
+                values.add(node.value)
+            for child in node.children.values():
+                values.update(child.subtree)
+            values = frozenset(values)
+            node.subtree = interned.setdefault(values, values)
+
+        self.aggregated = True
+
+    def check_ambiguous(self, keys, level, explicit=False):
+        """
+        Returns whether the namespace resolves to permissions that contain
+        all the flags in level or any rule at or below the namespace does,
+        "*" segments in the namespace match any segment
+
+        This answers whether the user has any perms under a namespace (e.g.
+        to anything in an app or model), rules below the namespace are not
+        resolved against rules overriding them.
+        """
+
+        if type(keys) == str:
+            keys = keys.split(".")
+
+        if self.check(keys, level, explicit=explicit):
+            return True
+
+        self.aggregate()
+
+        # the nodes that the namespace, and namespaces below it, can be
+        # resolved through
+        nodes = [self.root]
+        for k in keys:
+            matched = []
+            for node in nodes:
+                if k == WILDCARD:
+                    matched.extend(node.children.values())
+                    continue
+                exact = node.children.get(k)
+                if exact is not None:
+                    matched.append(exact)
+                if node.wildcard is not None and node.wildcard is not exact:
+                    matched.append(node.wildcard)
+            nodes = matched
+
+        for node in nodes:
+            for value in node.subtree:
+                if (value & level) == level:
+                    return True
+        return False
+
+
+#############################################################################
+
+
+def iter_structure(struct, prefix=None):
+    """
+    Yields (keys, value) tuples for every rule in a structure produced
+    by util.perms_structure
+    """
+
+    if prefix is None:
+        prefix = []
+
+    for k, v in list(struct.items()):
+        if k == "__ps":
+            continue
+        if k[:1] == "@":
+            yield prefix + [k[1:]], v
+        elif type(v) == dict:
+            for item in iter_structure(v, prefix + [k]):
+                yield item
+        else:
+            yield prefix + [k], v
+
+
+def compile_perms(perms):
+    """
+    Compile permissions into a NamespaceMatcher
+
+    perms <dict|NamespaceMatcher> - permissions dict as returned by
+    util.load_perms or a structure as returned by util.perms_structure
+    """
+
+    if isinstance(perms, NamespaceMatcher):
+        return perms
+
+    if "__ps" in perms:
+        rules = iter_structure(perms)
+    else:
+        rules = ((ns.split("."), p) for ns, p in list(perms.items()))
+
+    root = PermissionNode()
+    for keys, p in rules:
+        node = root
+        for k in keys:
+            node = node.child(k)
+        node.value = p
+
+    return NamespaceMatcher(root)
@@ -0,0 +1,119 @@
+import asyncio
+import logging
+
+from django.conf import settings
+from django.utils.module_loading import import_string
+
+from django_namespace_perms import context
+
+log = logging.getLogger(__name__)
+
+
+def metrics_enabled():
+    return bool(getattr(settings, "NSP_METRICS", False))
+
+
+def metrics_sink():
+    """
+    Returns the callable metrics are reported to as configured by
+    NSP_METRICS_SINK: "logging" (default), None to only keep them on the
+    request, a callable or the dotted path to one
+
+    The callable is passed the request and the metrics as returned by
+    PermissionContext.report
+    """
+
+    sink = getattr(settings, "NSP_METRICS_SINK", "logging")
+    if sink == "logging":
+        return log_metrics
+    if isinstance(sink, str):
+        return import_string(sink)
+    return sink
+
+
+def format_metrics(metrics):
+    """
+    Returns the metrics as a single line of text
+    """
+
+    parts = ["%s=%d" % item for item in sorted(metrics["counters"].items())]
+    parts.extend(["%s=%d" % item for item in sorted(metrics["stats"].items())])
+    parts.extend(
+        [
+            "%s=%d/%.6fs" % (name, call["count"], call["time"])
+            for name, call in sorted(metrics["calls"].items())
+        ]
+    )
+    return " ".join(parts)
+
+
+def log_metrics(request, metrics):
+    if log.isEnabledFor(logging.INFO):
+        log.info(
+            "NSP metrics %s %s %s",
+            request.method,
+            request.path,
+            format_metrics(metrics),
+        )
+
+
+class PermissionContextMiddleware(object):
+
+    """
+    Activates a PermissionContext (see context) for every request, it
+    is available as request.nsp_context
+
+    If NSP_METRICS is True, the metrics recorded for the request are
+    reported to the NSP_METRICS_SINK (see metrics_sink), the sink is
+    resolved once when the middleware is created
+
+    Supports both sync and async requests (django >= 3.1)
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sink = metrics_sink()
+        if asyncio.iscoroutinefunction(get_response):
+            # mark the instance as a coroutine function for django
+            try:
+                from asgiref.sync import markcoroutinefunction
+
+                markcoroutinefunction(self)
+            except ImportError:
+                self._is_coroutine = asyncio.coroutines._is_coroutine
+
+    def __call__(self, request):
+        if asyncio.iscoroutinefunction(self.get_response):
+            return self.__acall__(request)
+
+        ctx = self.activate(request)
+        try:
+            response = self.get_response(request)
+        finally:
+            context.deactivate()
+        return self.finish(request, response, ctx)
+
+    async def __acall__(self, request):
+        ctx = self.activate(request)
+        try:
+            response = await self.get_response(request)
+        finally:
+            context.deactivate()
+        return self.finish(request, response, ctx)
+
+    def activate(self, request):
+        ctx = context.PermissionContext(metrics=metrics_enabled())
+        request.nsp_context = ctx
+        context.activate(ctx)
+        return ctx
+
+    def finish(self, request, response, ctx):
+        if getattr(settings, "NSP_CONTEXT_HEADER", False):
+            response["X-NSP-Perms"] = ctx.header()
+
+        if ctx.metrics and self.sink is not None:
+            self.sink(request, ctx.report())
+        return response
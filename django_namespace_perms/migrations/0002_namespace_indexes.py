@@ -0,0 +1,29 @@
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [("django_namespace_perms", "0001_initial")]
+
+    operations = [
+        migrations.AlterField(
+            model_name="grouppermission",
+            name="namespace",
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+        migrations.AlterField(
+            model_name="userpermission",
+            name="namespace",
+            field=models.CharField(db_index=True, max_length=255),
+        ),
+        migrations.AddIndex(
+            model_name="grouppermission",
+            index=models.Index(
+                fields=["group", "namespace"], name="nsp_gp_group_ns_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="userpermission",
+            index=models.Index(fields=["user", "namespace"], name="nsp_up_user_ns_idx"),
+        ),
+    ]
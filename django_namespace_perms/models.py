@@ -1,9 +1,10 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.contrib.auth.models import Group
 
 from django_namespace_perms.constants import *
 from django_namespace_perms.util import NAMESPACES, obj_to_namespace
+from django_namespace_perms.query import PermissionQuerySet
 from django.db.models.signals import post_save, pre_delete
 
 #############################################################################
@@ -30,24 +31,188 @@ def managed_perms_remove(sender, **kwargs):
 
     user_field_name, perms = inst.nsp_managed
 
-    perms = UserPermission.objects.filter(
+    UserPermission.objects.filter(
         user=getattr(inst, user_field_name), namespace=obj_to_namespace(inst)
-    ).all()
+    ).delete()
 
-    for p in perms:
-        p.delete()
+
+def managed_perms_create_deferred(sender, **kwargs):
+    inst = kwargs.get("instance")
+    if not hasattr(inst, "nsp_managed"):
+        return
+    rules = managed_rules([inst])
+    queue = managed_perms_queue(kwargs.get("using"))
+    if queue is None:
+        create_managed_rules(rules)
+    else:
+        queue.add("create", rules)
+
+
+def managed_perms_remove_deferred(sender, **kwargs):
+    inst = kwargs.get("instance")
+    if not hasattr(inst, "nsp_managed"):
+        return
+    rules = managed_rules([inst])
+    queue = managed_perms_queue(kwargs.get("using"))
+    if queue is None:
+        remove_managed_rules(rules)
+    else:
+        queue.add("remove", rules)
 
 
-def managed_perms(model):
+def managed_perms(model, defer=False):
     """
     Sets up a model to have automatically managed permissions. The only requirement
     is that the model has a foreignkey field linked to a user model and a
     nsp_managed property that returns the field name of the user foreignkey
     as well as what perms to set in a tuple
+
+    If defer is True permissions are created and removed in bulk once the
+    transaction the instances were saved or deleted in commits, instead of
+    one statement per instance.
+    """
+
+    if defer:
+        post_save.connect(managed_perms_create_deferred, sender=model)
+        pre_delete.connect(managed_perms_remove_deferred, sender=model)
+    else:
+        post_save.connect(managed_perms_create, sender=model)
+        pre_delete.connect(managed_perms_remove, sender=model)
+
+
+def managed_rules(instances):
+    """
+    Returns (user_id, namespace, perms) tuples for the managed permissions
+    of the instances
+    """
+
+    rv = []
+    for inst in instances:
+        if not hasattr(inst, "nsp_managed"):
+            continue
+        user_field_name, perms = inst.nsp_managed
+        user_id = getattr(inst, "%s_id" % user_field_name, None)
+        if user_id is None:
+            user_id = getattr(inst, user_field_name).pk
+        rv.append((user_id, obj_to_namespace(inst), perms))
+    return rv
+
+
+def create_managed_rules(rules, batch_size=500):
+    from django_namespace_perms import cache
+
+    UserPermission.objects.bulk_create(
+        [
+            UserPermission(user_id=user_id, namespace=namespace, permissions=perms)
+            for user_id, namespace, perms in rules
+        ],
+        batch_size=batch_size,
+    )
+
+    # bulk_create does not send post_save
+    for user_id in set([rule[0] for rule in rules]):
+        cache.invalidate_user(user_id)
+
+
+def remove_managed_rules(rules, batch_size=500):
+    for i in range(0, len(rules), batch_size):
+        namespaces = {}
+        for user_id, namespace, perms in rules[i : i + batch_size]:
+            namespaces.setdefault(user_id, set()).add(namespace)
+        q = models.Q()
+        for user_id, ns in namespaces.items():
+            q |= models.Q(user_id=user_id, namespace__in=ns)
+        UserPermission.objects.filter(q).delete()
+
+
+def managed_perms_bulk_create(instances, batch_size=500):
+    """
+    Creates the managed permissions of the instances with a single
+    bulk_create (batches of batch_size), use after bulk creating managed
+    instances
+
+    Instances need to have their primary keys set.
     """
 
-    post_save.connect(managed_perms_create, sender=model)
-    pre_delete.connect(managed_perms_remove, sender=model)
+    rules = managed_rules(instances)
+    if rules:
+        create_managed_rules(rules, batch_size=batch_size)
+
+
+def managed_perms_bulk_remove(instances, batch_size=500):
+    """
+    Removes the managed permissions of the instances with a single
+    filtered delete (batches of batch_size)
+    """
+
+    rules = managed_rules(instances)
+    if rules:
+        remove_managed_rules(rules, batch_size=batch_size)
+
+
+class ManagedPermsQueue(object):
+
+    """
+    Managed permission changes deferred to the commit of the transaction
+    (or savepoint) they were made in, applied in bulk in the order they
+    were made
+    """
+
+    def __init__(self):
+        self.changes = []
+
+    def add(self, action, rules):
+        if self.changes and self.changes[-1][0] == action:
+            self.changes[-1][1].extend(rules)
+        else:
+            self.changes.append((action, list(rules)))
+
+    def __call__(self):
+        for action, rules in self.changes:
+            if action == "create":
+                create_managed_rules(rules)
+            else:
+                remove_managed_rules(rules)
+
+
+def managed_perms_queue(using=None):
+    """
+    Returns the ManagedPermsQueue of the current transaction, or None
+    outside of transactions
+    """
+
+    connection = transaction.get_connection(using)
+    if not connection.in_atomic_block:
+        return None
+
+    # on_commit callbacks are discarded along with the savepoint they
+    # were registered in, so a queue is only added to while it is the
+    # last queue registered and the savepoint it was registered in is the
+    # current one, which also keeps changes in order. The commit hooks are
+    # replaced when the transaction or a savepoint ends, a queue is not
+    # reused after that.
+    sids = tuple(connection.savepoint_ids)
+    last = getattr(connection, "nsp_managed_queue", None)
+    if last is not None and last[0] == sids and last[1] is connection.run_on_commit:
+        return last[2]
+
+    queue = ManagedPermsQueue()
+    transaction.on_commit(queue, using=using)
+    connection.nsp_managed_queue = (sids, connection.run_on_commit, queue)
+    return queue
+
+
+class ManagedPermsQuerySet(models.QuerySet):
+
+    """
+    QuerySet for models with managed permissions that creates them on
+    bulk_create, use as manager with ManagedPermsQuerySet.as_manager()
+    """
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = super(ManagedPermsQuerySet, self).bulk_create(objs, *args, **kwargs)
+        managed_perms_bulk_create([obj for obj in objs if obj.pk is not None])
+        return objs
 
 
 #############################################################################
@@ -65,11 +230,16 @@ def perm_choices():
 
 class GroupPermission(models.Model):
     group = models.ForeignKey(Group, blank=False, on_delete=models.CASCADE)
-    namespace = models.CharField(max_length=255, blank=False)
+    namespace = models.CharField(max_length=255, blank=False, db_index=True)
     permissions = models.IntegerField(blank=False, default=PERM_READ)
 
+    objects = PermissionQuerySet.as_manager()
+
     class Meta:
         db_table = "nsp_group_permission"
+        indexes = [
+            models.Index(fields=["group", "namespace"], name="nsp_gp_group_ns_idx")
+        ]
 
     def __unicode__(self):
         return "%s: %s" % (self.group.name, self.namespace)
@@ -88,11 +258,16 @@ class UserPermission(models.Model):
     user = models.ForeignKey(
         settings.AUTH_USER_MODEL, blank=False, on_delete=models.CASCADE
     )
-    namespace = models.CharField(max_length=255, blank=False)
+    namespace = models.CharField(max_length=255, blank=False, db_index=True)
     permissions = models.IntegerField(blank=False, default=PERM_READ)
 
+    objects = PermissionQuerySet.as_manager()
+
     class Meta:
         db_table = "nsp_user_permission"
+        indexes = [
+            models.Index(fields=["user", "namespace"], name="nsp_up_user_ns_idx")
+        ]
 
     def __unicode__(self):
         return "%s: %s" % (self.user.username, self.namespace)
@@ -0,0 +1,45 @@
+"""
+django-debug-toolbar panel showing the permission metrics of a request
+
+Requires django-debug-toolbar, NSP_METRICS and PermissionContextMiddleware
+placed after the toolbar middleware:
+
+    DEBUG_TOOLBAR_PANELS = [
+        ...
+        "django_namespace_perms.panels.PermissionsPanel",
+    ]
+"""
+
+from debug_toolbar.panels import Panel
+
+from django_namespace_perms.middleware import format_metrics
+
+
+class PermissionsPanel(Panel):
+
+    title = "Permissions"
+
+    template = "django_namespace_perms/panel.html"
+
+    @property
+    def nav_subtitle(self):
+        metrics = self.get_stats().get("metrics")
+        if not metrics:
+            return ""
+        return "%d loads, %.2fms" % (
+            metrics["counters"]["loads"],
+            sum([call["time"] for call in metrics["calls"].values()]) * 1000,
+        )
+
+    def generate_stats(self, request, response):
+        ctx = getattr(request, "nsp_context", None)
+        metrics = None
+        if ctx is not None and ctx.metrics:
+            metrics = ctx.report()
+        self.record_stats(
+            {
+                "metrics": metrics,
+                "summary": format_metrics(metrics) if metrics else "",
+                "calls": sorted(metrics["calls"].items()) if metrics else [],
+            }
+        )
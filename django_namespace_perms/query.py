@@ -0,0 +1,338 @@
+"""
+Permission checks translated into database queries
+"""
+
+from django.core.exceptions import ValidationError
+from django.db import models
+
+from django_namespace_perms import constants
+from django_namespace_perms.matcher import compile_perms
+from django_namespace_perms.util import (
+    STR_TYPES,
+    get_permission_flag,
+    has_perms_many,
+    is_superuser,
+    merge_rules,
+    perms_matcher,
+    resolve_namespace,
+    rules_query,
+)
+
+# sentinel segment that never matches a literal rule, used to resolve the
+# permissions for instances that are not targeted by any id specific rule
+UNMATCHED = object()
+
+#############################################################################
+
+
+def class_explicit(model, level):
+    """
+    Returns whether instances of model require explicit permissions for
+    level, same as has_perms would resolve it for an instance, or None if
+    that depends on the instance
+    """
+
+    if level == constants.PERM_READ:
+        check_attr = read_attr = "nsp_require_explicit_read"
+    elif level == constants.PERM_WRITE:
+        check_attr = "nsp_required_explicit_write"
+        read_attr = "nsp_require_explicit_write"
+    else:
+        return False
+
+    if not hasattr(model, check_attr):
+        return False
+
+    value = getattr(model, read_attr)
+    if isinstance(value, property) or callable(value):
+        return None
+    return value
+
+
+def nsp_filter(queryset, user, level):
+    """
+    Restrict a queryset to the instances the user has perms to
+
+    The user's permissions for the model's namespace (app_label.model_name)
+    are translated into an id filter or exclusion, so pagination and counts
+    happen in the database.
+
+    Models that build their own instance namespaces (nsp_namespace) or
+    require explicit permissions depending on the instance cannot be
+    translated, for those every instance is checked in python and the
+    queryset is filtered by the resulting primary keys.
+
+    user <dict|NamespaceMatcher|CompactStructure|AUTH_USER_MODEL> - same as
+    for has_perms
+
+    level <int|str> - same as for has_perms
+    """
+
+    if type(level) in STR_TYPES:
+        level = get_permission_flag(level)
+
+    if is_superuser(user):
+        return queryset
+
+    model = queryset.model
+    explicit = class_explicit(model, level)
+
+    if explicit is None or hasattr(model, "nsp_namespace"):
+        instances = list(queryset)
+        allowed = has_perms_many(user, instances, level)
+        return queryset.filter(
+            pk__in=[inst.pk for inst, ok in zip(instances, allowed) if ok]
+        )
+
+    matcher = perms_matcher(user)
+    explicit = bool(explicit)
+    prefix = [model._meta.app_label.lower(), model._meta.model_name.lower()]
+
+    def check(value):
+        return value is not None and (value & level) == level
+
+    if not hasattr(model, "id"):
+        # instance namespaces dont contain an id, so all instances share
+        # the model namespace
+        if check(matcher.get(prefix, explicit=explicit)):
+            return queryset
+        return queryset.none()
+
+    # the model namespace is resolved once into a plan, the last segment
+    # (the instance id) then only needs to be resolved for ids that are
+    # targeted by rules and for the default
+    plan = matcher.plan(prefix, explicit=explicit)
+
+    def resolve(key):
+        keys = prefix + [key]
+        for node, value in plan:
+            if node is None:
+                return value
+            value = matcher.resolve(node, keys, 2, explicit)
+            if value is not None:
+                return value
+        return None
+
+    default = check(resolve(UNMATCHED))
+
+    id_field = model._meta.get_field("id")
+    exceptions = []
+    candidates = set()
+    for node, value in plan:
+        if node is not None:
+            candidates.update(matcher.node_keys(node))
+    candidates.discard("*")
+
+    for key in candidates:
+        if check(resolve(key)) == default:
+            continue
+        try:
+            value = id_field.to_python(key)
+        except ValidationError:
+            continue
+        # obj_to_namespace lowercases the id, only keep ids that produce
+        # this exact namespace segment
+        if value is None or str(value).lower() != key:
+            continue
+        exceptions.append(value)
+
+    if default:
+        if exceptions:
+            return queryset.exclude(id__in=exceptions)
+        return queryset
+    if exceptions:
+        return queryset.filter(id__in=exceptions)
+    return queryset.none()
+
+
+#############################################################################
+
+
+def namespace_filter(queryset, namespace):
+    """
+    Restrict a UserPermission or GroupPermission queryset to the rules
+    at or under namespace (namespace itself and namespace.*)
+
+    Rules are matched by their literal namespace, wildcard rules that
+    would also apply to namespace (e.g. a.*.c for a.b) are not
+    included. The match is a prefix match on the namespace column, which
+    does not depend on the database collation (on postgresql the pattern
+    index django creates for the namespace column is used).
+
+    namespace <str> - namespace prefix
+    """
+
+    namespace = namespace.lower()
+    return queryset.filter(
+        models.Q(namespace=namespace)
+        | models.Q(namespace__startswith="%s." % namespace)
+    )
+
+
+# namespaces are matched by the patterns of at most this many of their
+# segments, see rules_filter
+NAMESPACE_PATTERNS_DEPTH = 5
+
+
+def namespace_patterns(keys, depth=None):
+    """
+    Returns the rule namespaces that can match the namespace (split into
+    segments): all of its prefixes, with any of their segments replaced
+    by a wildcard
+
+    depth <int=None> - only return prefixes up to this many segments
+    """
+
+    rv = []
+    prefixes = [[]]
+    for k in keys[:depth]:
+        if k == "*":
+            prefixes = [p + [k] for p in prefixes]
+        else:
+            prefixes = [p + [s] for p in prefixes for s in (k, "*")]
+        rv.extend(prefixes)
+    return [".".join(p) for p in rv]
+
+
+def rules_filter(queryset, keys):
+    """
+    Restrict a UserPermission or GroupPermission queryset to the rules
+    that decide the permissions to the namespace (split into segments)
+
+    Those are the rules matching it and the rules below its wildcard
+    matches, since a wildcard rule with rules below it only matches a
+    literal "*" segment.
+
+    The number of patterns doubles with every segment, for namespaces
+    deeper than NAMESPACE_PATTERNS_DEPTH all rules below the patterns of
+    the first segments are included, rules that don't match the namespace
+    don't change how it resolves.
+    """
+
+    patterns = namespace_patterns(keys, NAMESPACE_PATTERNS_DEPTH)
+    q = models.Q(namespace__in=patterns)
+    for pattern in patterns:
+        if (
+            pattern == "*"
+            or pattern.endswith(".*")
+            or pattern.count(".") + 1 == NAMESPACE_PATTERNS_DEPTH < len(keys)
+        ):
+            q |= models.Q(namespace__startswith="%s." % pattern)
+    return queryset.filter(q)
+
+
+def groups_with_perms(namespace, level, explicit=False):
+    """
+    Returns a queryset of the groups whose own rules grant level to
+    namespace
+
+    Only the rules that can decide the permissions to namespace are
+    fetched (see rules_filter), precedence is resolved for the groups
+    holding them.
+
+    namespace <string|ModelInstance|list> - same as for has_perms
+
+    level <int|str> - same as for has_perms
+
+    explicit <bool=False> - same as for has_perms
+    """
+
+    from django.contrib.auth.models import Group
+    from django_namespace_perms.models import GroupPermission
+
+    if type(level) in STR_TYPES:
+        level = get_permission_flag(level)
+    namespace, explicit = resolve_namespace(namespace, level, explicit)
+    keys = namespace.split(".")
+
+    rules = {}
+    qset = rules_filter(GroupPermission.objects.all(), keys)
+    for group_id, ns, p in qset.values_list("group_id", "namespace", "permissions"):
+        rules.setdefault(group_id, {})[ns] = p
+
+    ids = [
+        group_id
+        for group_id, permdict in rules.items()
+        if compile_perms(permdict).check(keys, level, explicit=explicit)
+    ]
+    return Group.objects.filter(id__in=ids)
+
+
+def users_with_perms(namespace, level, explicit=False):
+    """
+    Returns a queryset of the users that have level perms to namespace,
+    through their own or their groups' rules, superusers included
+
+    Only the rules that can decide the permissions to namespace are
+    fetched (see rules_filter), in a single query, precedence is
+    resolved for the users holding them or being members of the groups
+    holding them. nsp_manual rules are not taken into account.
+
+    namespace <string|ModelInstance|list> - same as for has_perms
+
+    level <int|str> - same as for has_perms
+
+    explicit <bool=False> - same as for has_perms
+    """
+
+    from django.contrib.auth import get_user_model
+    from django.contrib.auth.models import Group
+    from django_namespace_perms.models import UserPermission, GroupPermission
+
+    if type(level) in STR_TYPES:
+        level = get_permission_flag(level)
+    namespace, explicit = resolve_namespace(namespace, level, explicit)
+    keys = namespace.split(".")
+
+    group_rules = {}
+    user_rules = {}
+    qset = rules_query(
+        rules_filter(UserPermission.objects.all(), keys),
+        rules_filter(GroupPermission.objects.all(), keys),
+    )
+    for rule in qset:
+        if rule[2] is None:
+            user_rules.setdefault(rule[3], []).append(rule)
+        else:
+            group_rules.setdefault(rule[2], []).append(rule)
+
+    memberships = dict([(user_id, []) for user_id in user_rules])
+    if group_rules:
+        qset = Group.objects.filter(id__in=list(group_rules.keys()), user__isnull=False)
+        for user_id, group_id in qset.values_list("user", "id"):
+            memberships.setdefault(user_id, []).append(group_id)
+
+    ids = []
+    for user_id, group_ids in memberships.items():
+        rules = []
+        for group_id in group_ids:
+            rules.extend(group_rules[group_id])
+        rules.extend(user_rules.get(user_id, []))
+        permdict = merge_rules({}, rules)
+        if compile_perms(permdict).check(keys, level, explicit=explicit):
+            ids.append(user_id)
+
+    return get_user_model().objects.filter(
+        models.Q(pk__in=ids) | models.Q(is_superuser=True)
+    )
+
+
+class PermissionQuerySet(models.QuerySet):
+
+    """
+    QuerySet for UserPermission and GroupPermission
+    """
+
+    def under(self, namespace):
+        return namespace_filter(self, namespace)
+
+
+class NSPQuerySet(models.QuerySet):
+
+    """
+    QuerySet that can filter itself by a user's permissions, use as
+    manager with NSPQuerySet.as_manager()
+    """
+
+    def nsp_filter(self, user, level):
+        return nsp_filter(self, user, level)
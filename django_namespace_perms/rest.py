@@ -1,12 +1,22 @@
-from rest_framework import permissions, serializers
+import asyncio
+import functools
 
+from django.core.exceptions import ImproperlyConfigured
+from django.db import models
+from rest_framework import filters, permissions, serializers
+
+from django_namespace_perms.context import instrumented
 from django_namespace_perms.util import (
+    aperms_loaded,
     has_perms,
+    has_perms_many,
     get_permission_flag,
     obj_to_namespace,
     permissions_apply_to_serialized_model,
+    permissions_apply_to_serialized_models,
 )
 
+from django_namespace_perms.query import nsp_filter
 from django_namespace_perms.constants import PERM_READ, PERM_WRITE
 import logging
 from .exceptions import PermissionDenied
@@ -45,6 +55,7 @@ class BasePermission(permissions.BasePermission):
         # PermissionedModelSerializer.create - always return true here.
         return True
 
+    @instrumented("rest.BasePermission.has_object_permission")
     def has_object_permission(self, request, view, obj):
         self.debug(
             "Check Object permissions %s, %s, %s"
@@ -59,11 +70,112 @@ class BasePermission(permissions.BasePermission):
                 func = getattr(obj, func_name)
                 return func(request.user, request)
             else:
-                return has_perms(
-                    request.user,
-                    obj,
-                    get_permission_flag(method_to_permcode(request.method)),
-                )
+                return self.check_object_perms(request, obj)
+
+    def check_object_perms(self, request, obj):
+        """
+        Checks the user's permissions to obj for the request method, without
+        the object's nsp_has_perms_<method> override
+        """
+
+        if request.method in permissions.SAFE_METHODS:
+            level = PERM_READ
+        else:
+            level = get_permission_flag(method_to_permcode(request.method))
+        return has_perms(request.user, obj, level)
+
+
+class AsyncCheck(object):
+
+    """
+    Awaitable result of the async methods of a permission class
+
+    A sync view tests the result instead of awaiting it, which would grant
+    access for a (truthy) coroutine - testing it raises
+    ImproperlyConfigured instead.
+    """
+
+    def __init__(self, coro, name):
+        self.coro = coro
+        self.name = name
+
+    def __await__(self):
+        return self.coro.__await__()
+
+    def __bool__(self):
+        self.coro.close()
+        raise ImproperlyConfigured(
+            "%s requires an async view (e.g., adrf), use BasePermission for "
+            "sync views" % self.name
+        )
+
+
+def async_only(fn):
+    """
+    Decorator for the async methods of a permission class, they return an
+    AsyncCheck and are still marked as coroutine functions so async views
+    await them
+    """
+
+    @functools.wraps(fn)
+    def wrapper(self, *args, **kwargs):
+        return AsyncCheck(fn(self, *args, **kwargs), type(self).__name__)
+
+    try:
+        from asgiref.sync import markcoroutinefunction
+
+        markcoroutinefunction(wrapper)
+    except ImportError:
+        wrapper._is_coroutine = asyncio.coroutines._is_coroutine
+    return wrapper
+
+
+class AsyncBasePermission(BasePermission):
+
+    """
+    BasePermission for async views, the user's permissions are loaded
+    without blocking the event loop (see util.aload_perms)
+
+    Only use it with views that await async permission methods (e.g.,
+    adrf), sync rest framework views raise ImproperlyConfigured when
+    checking it.
+    """
+
+    @async_only
+    async def has_permission(self, request, view):
+        return True
+
+    @async_only
+    @instrumented("rest.AsyncBasePermission.has_object_permission")
+    async def has_object_permission(self, request, view, obj):
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug(
+                "Check Object permissions %s, %s, %s"
+                % (request.method, request.user, obj_to_namespace(obj))
+            )
+
+        await aperms_loaded(request.user)
+
+        func_name = "nsp_has_perms_%s" % request.method
+        if request.method not in permissions.SAFE_METHODS and hasattr(obj, func_name):
+            from asgiref.sync import sync_to_async
+
+            return await sync_to_async(getattr(obj, func_name))(request.user, request)
+
+        return self.check_object_perms(request, obj)
+
+
+class PermissionFilterBackend(filters.BaseFilterBackend):
+
+    """
+    Restricts querysets to the instances the user has read perms to, the
+    check is translated into a database filter where possible (see
+    query.nsp_filter)
+    """
+
+    @instrumented("rest.PermissionFilterBackend.filter_queryset")
+    def filter_queryset(self, request, queryset, view):
+        return nsp_filter(queryset, request.user, PERM_READ)
 
 
 class PermissionedModelSerializer(serializers.ModelSerializer):
@@ -92,18 +204,38 @@ class PermissionedModelSerializer(serializers.ModelSerializer):
                 % "nsp_namespace_create"
             )
 
-    def to_representation(self, instance):
+    @classmethod
+    def many_init(cls, *args, **kwargs):
         """
-        Apply permissions to serialized data before sending it out for
-        good
+        Use PermissionedListSerializer with many=True, unless the
+        serializer specifies its own list_serializer_class
         """
-        r = super(serializers.ModelSerializer, self).to_representation(instance)
+        rv = super(PermissionedModelSerializer, cls).many_init(*args, **kwargs)
+        if type(rv) == serializers.ListSerializer:
+            rv.__class__ = PermissionedListSerializer
+        return rv
 
+    def nsp_user(self):
+        """
+        Returns the user permissions are applied for, either the user
+        in context or the request's user
+        """
         req = self.context.get("request", None)
         user = self.context.get("user")
 
         if not user and req:
             user = req.user
+        return user
+
+    @instrumented("rest.PermissionedModelSerializer.to_representation")
+    def to_representation(self, instance):
+        """
+        Apply permissions to serialized data before sending it out for
+        good
+        """
+        r = super(serializers.ModelSerializer, self).to_representation(instance)
+
+        user = self.nsp_user()
 
         if user:
 
@@ -117,3 +249,57 @@ class PermissionedModelSerializer(serializers.ModelSerializer):
 
             r = permissions_apply_to_serialized_model(instance, user, data=r)
         return r
+
+
+class PermissionedListSerializer(serializers.ListSerializer):
+
+    """
+    ListSerializer for PermissionedModelSerializer that applies
+    permissions to all instances at once: the user and its permissions
+    are resolved once and field visibility is shared by instances of
+    the same model (see util.permissions_apply_to_serialized_models)
+    """
+
+    @instrumented("rest.PermissionedListSerializer.to_representation")
+    def to_representation(self, data):
+        iterable = data.all() if isinstance(data, models.Manager) else data
+        child = self.child
+
+        # serializers customizing to_representation are applied per
+        # instance
+        if (
+            type(child).to_representation
+            is not PermissionedModelSerializer.to_representation
+        ):
+            return [child.to_representation(item) for item in iterable]
+
+        instances = list(iterable)
+        rows = [
+            super(serializers.ModelSerializer, child).to_representation(item)
+            for item in instances
+        ]
+
+        user = child.nsp_user()
+
+        # superusers can see everything
+        if not user or user.is_superuser:
+            return rows
+
+        explicit = [
+            i
+            for i, item in enumerate(instances)
+            if getattr(item, "nsp_require_explicit_read", False)
+        ]
+        denied = set()
+        if explicit:
+            allowed = has_perms_many(user, [instances[i] for i in explicit], 0x01)
+            denied = set([i for i, ok in zip(explicit, allowed) if not ok])
+
+        rv = [None] * len(rows)
+        indexes = [i for i in range(len(rows)) if i not in denied]
+        results = permissions_apply_to_serialized_models(
+            [instances[i] for i in indexes], user, [rows[i] for i in indexes]
+        )
+        for i, r in zip(indexes, results):
+            rv[i] = r
+        return rv
@@ -0,0 +1,417 @@
+"""
+Compact permission structure
+
+A CompactStructure holds the same rules as the nested dicts produced by
+util.perms_structure in a few flat arrays:
+
+    - segments: every distinct namespace segment once, interned
+    - keys: for every node, the id of the segment leading to it
+    - values: for every node, the permissions set by a rule targeting it
+    - first: for every node, the id of its first child
+    - order: the ids of the nodes targeted by a rule, in the order the
+      rules were added
+
+Nodes are numbered breadth first, so the children of a node are numbered
+consecutively and sorted by segment id, a child is found by bisecting
+them. The arrays use the smallest item types that fit, for up to 65535
+segments and nodes and permission values below 128 a node takes 5 bytes
+and a rule 2 more.
+
+Structures are immutable and are resolved with the same semantics as
+util.get_perms and matcher.NamespaceMatcher, whose interface they
+implement. The order of the rules is kept, since permissions_apply
+depends on it. They pickle to their arrays, which makes them cheap to keep
+in shared caches, and compare and hash by their contents.
+"""
+
+import array
+import bisect
+import sys
+
+from django_namespace_perms.matcher import WILDCARD, iter_structure
+
+# value of nodes that are not targeted by a rule, by array type
+NO_VALUE = {"b": -(2**7), "q": -(2**63)}
+
+
+class CompactStructure(object):
+
+    """
+    Immutable array backed permission structure, use compact_structure to
+    create one
+
+    Node ids are ints, the root node is 0.
+    """
+
+    __slots__ = (
+        "segments",
+        "keys",
+        "values",
+        "first",
+        "order",
+        "ids",
+        "none",
+        "digest",
+        "wildcard",
+    )
+
+    def __init__(self, segments, keys, values, first, order):
+        self.segments = segments
+        self.keys = keys
+        self.values = values
+        self.first = first
+        self.order = order
+        self.ids = dict([(seg, i) for i, seg in enumerate(segments)])
+        self.none = NO_VALUE[values.typecode]
+        self.digest = hash(
+            (segments, values.typecode)
+            + tuple([arr.tobytes() for arr in (keys, values, first, order)])
+        )
+        self.wildcard = self.ids.get(WILDCARD)
+
+    def __getstate__(self):
+        return (self.segments, self.keys, self.values, self.first, self.order)
+
+    def __setstate__(self, state):
+        segments, keys, values, first, order = state
+        self.__init__(
+            tuple([sys.intern(seg) for seg in segments]), keys, values, first, order
+        )
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __hash__(self):
+        return self.digest
+
+    def __eq__(self, other):
+        if self is other:
+            return True
+        if not isinstance(other, CompactStructure) or self.digest != other.digest:
+            return False
+        return self.__getstate__() == other.__getstate__()
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __setattr__(self, name, value):
+        if hasattr(self, "wildcard"):
+            raise AttributeError("CompactStructure is immutable")
+        object.__setattr__(self, name, value)
+
+    def nbytes(self):
+        """
+        Returns the size of the node and rule arrays in bytes, segments and
+        their lookup table not included
+        """
+
+        return sum(
+            [
+                len(arr) * arr.itemsize
+                for arr in (self.keys, self.values, self.first, self.order)
+            ]
+        )
+
+    def child(self, node, segment_id):
+        """
+        Returns the id of the child of node reached through segment_id or
+        None
+        """
+
+        lo = self.first[node]
+        hi = self.first[node + 1]
+        if lo == hi or segment_id is None:
+            return None
+        i = bisect.bisect_left(self.keys, segment_id, lo, hi)
+        if i < hi and self.keys[i] == segment_id:
+            return i
+        return None
+
+    def children(self, node):
+        return range(self.first[node], self.first[node + 1])
+
+    def value(self, node):
+        value = self.values[node]
+        if value == self.none:
+            return None
+        return value
+
+    def node_keys(self, node):
+        """
+        Returns the segments of the children of node
+        """
+
+        return [self.segments[self.keys[i]] for i in self.children(node)]
+
+    def rules(self):
+        """
+        Yields (keys, value) tuples for every rule, in the order the rules
+        were added
+        """
+
+        paths = {0: []}
+        for node in range(len(self.keys)):
+            for child in self.children(node):
+                paths[child] = paths[node] + [self.segments[self.keys[child]]]
+
+        for node in self.order:
+            yield paths[node], self.values[node]
+
+    ###########################################################################
+    # NamespaceMatcher interface
+
+    def get(self, keys, explicit=False):
+        """
+        Returns the permission value for the namespace or None if no
+        rule matches it, see NamespaceMatcher.get
+        """
+
+        if type(keys) == str:
+            keys = keys.split(".")
+        return self.resolve(0, keys, 0, explicit)
+
+    def resolve(self, node, keys, depth, explicit=False):
+        """
+        Resolve keys[depth:] starting at node, same as
+        NamespaceMatcher.resolve
+        """
+
+        n = len(keys)
+        if depth >= n:
+            return None
+
+        first = self.first
+        values = self.values
+        none = self.none
+        ids = self.ids
+        segs = self.keys
+        wc = self.wildcard
+        bisect_left = bisect.bisect_left
+        stack = [(node, depth, False)]
+        pop = stack.pop
+        push = stack.append
+
+        while stack:
+            node, depth, is_value = pop()
+            if is_value:
+                return values[node]
+
+            lo = first[node]
+            hi = first[node + 1]
+            if lo == hi:
+                continue
+
+            seg_id = ids.get(keys[depth])
+            depth += 1
+
+            exact = None
+            if seg_id is not None:
+                i = bisect_left(segs, seg_id, lo, hi)
+                if i < hi and segs[i] == seg_id:
+                    exact = i
+
+            # "*" sorts before most segments, so the wildcard child is
+            # usually the first one
+            wildcard = None
+            if wc is not None and segs[lo] <= wc and seg_id != wc:
+                i = lo if segs[lo] == wc else bisect_left(segs, wc, lo, hi)
+                if i < hi and segs[i] == wc:
+                    wildcard = i
+
+            if wildcard is not None:
+                has_children = first[wildcard] != first[wildcard + 1]
+                if (
+                    values[wildcard] != none
+                    and not has_children
+                    and (not explicit or depth == n)
+                ):
+                    push((wildcard, depth, True))
+                if has_children and depth < n:
+                    push((wildcard, depth, False))
+
+            if exact is not None:
+                if values[exact] != none and (not explicit or depth == n):
+                    push((exact, depth, True))
+                if first[exact] != first[exact + 1] and depth < n:
+                    push((exact, depth, False))
+
+        return None
+
+    def plan(self, prefix, explicit=False):
+        """
+        Walk a namespace prefix and return the search plan for namespaces
+        that extend it, see NamespaceMatcher.plan
+        """
+
+        m = len(prefix)
+        first = self.first
+        values = self.values
+        none = self.none
+        rv = []
+        stack = [(0, 0, False)]
+        pop = stack.pop
+        push = stack.append
+
+        while stack:
+            node, depth, is_value = pop()
+            if is_value:
+                rv.append((None, values[node]))
+                continue
+            if depth == m:
+                rv.append((node, None))
+                continue
+
+            depth += 1
+            exact = self.child(node, self.ids.get(prefix[depth - 1]))
+            wildcard = self.child(node, self.wildcard)
+
+            if wildcard is not None and wildcard != exact:
+                has_children = first[wildcard] != first[wildcard + 1]
+                if values[wildcard] != none and not has_children:
+                    if not explicit:
+                        push((wildcard, depth, True))
+                if has_children:
+                    push((wildcard, depth, False))
+
+            if exact is not None:
+                if values[exact] != none and not explicit:
+                    push((exact, depth, True))
+                if first[exact] != first[exact + 1]:
+                    push((exact, depth, False))
+
+        return rv
+
+    def get_many(self, namespaces, explicit=False):
+        """
+        Returns a list of permission values (or None) for the namespaces,
+        see NamespaceMatcher.get_many
+        """
+
+        rv = []
+        for i, keys in enumerate(namespaces):
+            if type(explicit) == list:
+                rv.append(self.get(keys, explicit=explicit[i]))
+            else:
+                rv.append(self.get(keys, explicit=explicit))
+        return rv
+
+    def check(self, keys, level, explicit=False):
+        """
+        Returns whether the namespace resolves to permissions that contain
+        all the flags in level
+        """
+
+        value = self.get(keys, explicit=explicit)
+        if value is None:
+            return False
+        return (value & level) == level
+
+    def check_ambiguous(self, keys, level, explicit=False):
+        """
+        Returns whether the namespace or any rule at or below it grants
+        level, see NamespaceMatcher.check_ambiguous
+
+        Rules below the namespace are searched on every call, there are no
+        precomputed subtree aggregates.
+        """
+
+        if type(keys) == str:
+            keys = keys.split(".")
+
+        if self.check(keys, level, explicit=explicit):
+            return True
+
+        nodes = [0]
+        for k in keys:
+            matched = []
+            for node in nodes:
+                if k == WILDCARD:
+                    matched.extend(self.children(node))
+                    continue
+                exact = self.child(node, self.ids.get(k))
+                if exact is not None:
+                    matched.append(exact)
+                wildcard = self.child(node, self.wildcard)
+                if wildcard is not None and wildcard != exact:
+                    matched.append(wildcard)
+            nodes = matched
+
+        values = self.values
+        while nodes:
+            node = nodes.pop()
+            value = values[node]
+            if value != self.none and (value & level) == level:
+                return True
+            nodes.extend(self.children(node))
+        return False
+
+
+def compact_structure(perms):
+    """
+    Returns a CompactStructure for the permissions
+
+    perms <dict|CompactStructure> - permissions dict as returned by
+    util.load_perms or a structure as returned by util.perms_structure
+
+    Rules are kept in the order of the permissions dict or, for a
+    structure, in the order they are found in it, which rebuilds the same
+    structure.
+    """
+
+    if isinstance(perms, CompactStructure):
+        return perms
+
+    if "__ps" in perms:
+        rules = iter_structure(perms)
+    else:
+        rules = ((ns.split("."), p) for ns, p in list(perms.items()))
+
+    # build a trie of [value, children, rule index] lists, then number it
+    # breadth first
+    root = [None, {}, None]
+    segments = {}
+    small = True
+    count = 0
+    for keys, p in rules:
+        node = root
+        for k in keys:
+            if k not in segments:
+                segments[k] = sys.intern(k)
+            node = node[1].setdefault(segments[k], [None, {}, None])
+        node[0] = p
+        node[2] = count
+        count += 1
+        small = small and NO_VALUE["b"] < p < 2**7
+
+    segments = tuple(sorted(segments.values()))
+    ids = dict([(seg, i) for i, seg in enumerate(segments)])
+
+    none = NO_VALUE["b" if small else "q"]
+    keys = [0]
+    values = [none]
+    first = []
+    order = [None] * count
+    level = [root]
+    while level:
+        following = []
+        for node in level:
+            first.append(len(keys))
+            # segment ids are in the order of the segments
+            for k, child in sorted(node[1].items()):
+                following.append(child)
+                if child[2] is not None:
+                    order[child[2]] = len(keys)
+                keys.append(ids[k])
+                values.append(none if child[0] is None else child[0])
+        level = following
+    first.append(len(keys))
+
+    nodes = "H" if len(keys) < 2**16 else "I"
+    return CompactStructure(
+        segments,
+        array.array("H" if len(segments) < 2**16 else "I", keys),
+        array.array("b" if small else "q", values),
+        array.array(nodes, first),
+        # a rule added again for the same namespace replaces the earlier one
+        array.array(nodes, [node for node in order if node is not None]),
+    )
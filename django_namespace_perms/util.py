@@ -1,15 +1,23 @@
+import bisect
 import re
-from . import constants
+from . import constants, context
 import json
 import inspect
 
 from django.db.models.query import QuerySet
+from .cache import IdentityCache, LRUCache
+from .matcher import NamespaceMatcher, compile_perms
+from .structure import CompactStructure, compact_structure
 from django.conf import settings
 import collections
+import threading
+import warnings
 
 
 APP_NAMESPACES = []
 
+NAMESPACES_LOCK = threading.Lock()
+
 NAMESPACES = []
 
 WRITE_OPS = ["update", "change", "delete", "create", "add"]
@@ -75,7 +83,7 @@ class PermissionFrame(object):
 
 
 def dict_valid(v):
-    return hasattr(v, "items") and isinstance(v.items, collections.Callable)
+    return hasattr(v, "items") and callable(v.items)
 
 
 def dict_from_namespace(keys, data):
@@ -112,70 +120,563 @@ def dict_get_path(data, keys):
 
 
 def autodiscover_namespaces(*models):
-    for model in models:
-        ns = "%s.%s" % (model._meta.app_label, model._meta.model_name)
-        NAMESPACES.append((ns, ns))
-        if model._meta.app_label not in APP_NAMESPACES:
-            APP_NAMESPACES.append(model._meta.app_label)
-        for field in model._meta.fields:
-            fld = field.name
-            ns_ = "%s.*.%s" % (ns, fld)
-            NAMESPACES.append((ns_, ns_))
-    for app_ns in APP_NAMESPACES:
-        NAMESPACES.append((app_ns, app_ns))
-    NAMESPACES.sort()
+    """
+    Add the namespaces of the models, their fields and apps to NAMESPACES
+
+    The lists are rebuilt under a lock and swapped in with a single slice
+    assignment, threads reading them never see a partial update.
+    """
+
+    with NAMESPACES_LOCK:
+        namespaces = list(NAMESPACES)
+        app_namespaces = list(APP_NAMESPACES)
+        for model in models:
+            ns = "%s.%s" % (model._meta.app_label, model._meta.model_name)
+            namespaces.append((ns, ns))
+            if model._meta.app_label not in app_namespaces:
+                app_namespaces.append(model._meta.app_label)
+            for field in model._meta.fields:
+                fld = field.name
+                ns_ = "%s.*.%s" % (ns, fld)
+                namespaces.append((ns_, ns_))
+        for app_ns in app_namespaces:
+            namespaces.append((app_ns, app_ns))
+        namespaces.sort()
+        APP_NAMESPACES[:] = app_namespaces
+        NAMESPACES[:] = namespaces
 
 
 #############################################################################
 
 
+def guest_group_name():
+    return getattr(settings, "NSP_GUEST_GROUP", "Guest")
+
+
+@context.instrumented("load_perms")
 def load_perms(user):
+    """
+    Loads the user's permissions and builds their structure, both are
+    kept on the user object (_nsp_perms, _nsp_perms_struct) and the
+    permissions dict is returned
+
+    Permissions already loaded for the user object are not loaded again,
+    the structure is only rebuilt if _nsp_perms was replaced. While a
+    request context is active (see context) permissions are also shared
+    between user objects of the same user.
+    """
 
     if hasattr(user, "_nsp_perms"):
-        user._nsp_perms_struct = perms_structure(user._nsp_perms)
+        if getattr(user, "_nsp_perms_source", None) is not user._nsp_perms:
+            set_perms(user, user._nsp_perms, perms_structure(user._nsp_perms))
         return user._nsp_perms
 
-    from django_namespace_perms.models import UserPermission, GroupPermission
-    from django.core.exceptions import ObjectDoesNotExist
-    from django.contrib.auth.models import Group
+    ctx = context.current()
+    if ctx is not None and ctx.restore(user):
+        context.stat("context_hits")
+        return user._nsp_perms
 
-    if user.is_authenticated:
-        perms = UserPermission.objects.filter(user=user)
-        group_perms = GroupPermission.objects.filter(group__in=user.groups.all())
+    from django_namespace_perms import cache
+
+    context.count("loads")
+
+    backend = cache.get_backend()
+    if backend is not None:
+        permdict, struct = load_perms_layered(user, backend)
+        set_perms(user, permdict, struct, built=False)
     else:
-        # guest user
-        if hasattr(settings, "NSP_GUEST_GROUP"):
-            guest_group = settings.NSP_GUEST_GROUP
-        else:
-            guest_group = "Guest"
-        try:
-            group = Group.objects.get(name=guest_group)
-            group_perms = GroupPermission.objects.filter(group=group)
-        except ObjectDoesNotExist:
-            group_perms = []
-        perms = []
+        permdict = set_rules(user, list(perms_rules(user)))
+
+    if ctx is not None:
+        ctx.store(user)
+    return permdict
+
+
+@context.instrumented("aload_perms")
+async def aload_perms(user):
+    """
+    Async version of load_perms
+
+    Permissions already loaded for the user object or held by the active
+    request context are returned without leaving the event loop. With the
+    in-process NSP_CACHE ("lru") the cached layers are looked up in the
+    event loop as well (see aload_perms_layered). Rules that are not cached
+    are fetched through the async ORM (django >= 4.1) or in a worker thread
+    through asgiref's sync_to_async, as is everything with a django cache
+    backend.
+    """
+
+    if hasattr(user, "_nsp_perms"):
+        return load_perms(user)
+
+    ctx = context.current()
+    if ctx is not None and ctx.restore(user):
+        context.stat("context_hits")
+        return user._nsp_perms
+
+    from django_namespace_perms import cache
+
+    backend = cache.get_backend()
+    if backend is not None and not isinstance(backend, cache.LRUCache):
+        from asgiref.sync import sync_to_async
+
+        return await sync_to_async(load_perms)(user)
+
+    context.count("loads")
+    if backend is not None:
+        permdict, struct = await aload_perms_layered(user, backend)
+        set_perms(user, permdict, struct, built=False)
+    elif async_orm():
+        permdict = set_rules(user, [rule async for rule in perms_rules(user)])
+    else:
+        from asgiref.sync import sync_to_async
+
+        rules = await sync_to_async(lambda: list(perms_rules(user)))()
+        permdict = set_rules(user, rules)
+
+    if ctx is not None:
+        ctx.store(user)
+    return permdict
+
+
+def async_orm():
+    """
+    Returns whether querysets can be iterated asynchronously (django >= 4.1)
+    """
+
+    return hasattr(QuerySet, "__aiter__")
+
+
+async def aload_layer(load, aload):
+    """
+    Runs the async loader aload if the async ORM is available, otherwise
+    the sync loader load is run in a worker thread
+    """
+
+    if async_orm():
+        return await aload()
+
+    from asgiref.sync import sync_to_async
+
+    return await sync_to_async(load)()
+
+
+def set_rules(user, rules):
+    """
+    Merge the user's nsp_manual permissions and rules as returned by
+    perms_rules into a new permissions dict and keep it and its structure
+    on the user object
+
+    Returns the permissions dict
+    """
 
     permdict = {}
     if hasattr(user, "nsp_manual"):
         for ns, p in list(user.nsp_manual.items()):
             permdict[ns] = p
-    for perm in group_perms:
-        permdict[perm.namespace] = perm.permissions
-    for perm in perms:
-        permdict[perm.namespace] = perm.permissions
+    merge_rules(permdict, rules)
+    set_perms(user, permdict, perms_structure(permdict))
+    return permdict
+
+
+def set_perms(user, permdict, struct, built=True):
+    """
+    Keep the permissions dict and its structure on the user object
+
+    built <bool> - whether struct was just built from permdict, as
+    opposed to coming from a cache
+    """
+
+    if built:
+        context.count("builds")
+    user._nsp_perms = user._nsp_perms_source = permdict
+    user._nsp_perms_struct = struct
+    user._nsp_perms_matcher = None
+
+
+def rules_query(user_rules, group_rules):
+    """
+    Returns a single query for the rules in the UserPermission and
+    GroupPermission querysets as (namespace, permissions, group_id,
+    user_id, id) tuples ordered by id, group rules have no user_id and
+    user rules no group_id
+    """
+
+    from django.db.models import F, IntegerField, Value
+
+    none = Value(None, output_field=IntegerField())
+    fields = ("namespace", "permissions", "source", "owner", "id")
 
-    user._nsp_perms = permdict
-    user._nsp_perms_struct = perms_structure(permdict)
+    group_rules = group_rules.annotate(source=F("group_id"), owner=none)
+    if user_rules is None:
+        return group_rules.values_list(*fields).order_by("id")
 
+    user_rules = user_rules.annotate(source=none, owner=F("user_id"))
+    return (
+        group_rules.values_list(*fields)
+        .union(user_rules.values_list(*fields), all=True)
+        .order_by("id")
+    )
+
+
+def perms_rules(user):
+    """
+    Returns the user's own and group permission rules as (namespace,
+    permissions, group_id, user_id, id) tuples, fetched in a single query
+    without creating model instances
+    """
+
+    from django_namespace_perms.models import UserPermission, GroupPermission
+
+    if user.is_authenticated:
+        return rules_query(
+            UserPermission.objects.filter(user=user),
+            GroupPermission.objects.filter(group__in=user.groups.all()),
+        )
+
+    # guest user
+    return rules_query(
+        None, GroupPermission.objects.filter(group__name=guest_group_name())
+    )
+
+
+def merge_rules(permdict, rules):
+    """
+    Merges rules as returned by perms_rules into permdict, group rules
+    first in order of their GroupPermission id, then the user's own rules
+    """
+
+    user_rules = [rule for rule in rules if rule[2] is None]
+    group_rules = [rule for rule in rules if rule[2] is not None]
+    group_rules.sort(key=lambda rule: rule[4])
+
+    for ns, p, group_id, user_id, pk in group_rules:
+        permdict[ns] = p
+    for ns, p, group_id, user_id, pk in user_rules:
+        permdict[ns] = p
     return permdict
 
 
+def load_perms_bulk(users):
+    """
+    Same as calling load_perms for each of the users, but the rules of
+    all of them are fetched at once, in two queries regardless of the
+    number of users
+
+    Permission caches (NSP_CACHE) are neither read nor filled, this is
+    meant for batch jobs and exports that touch many users once.
+
+    Returns a list holding the permissions dict of each user
+    """
+
+    from django.contrib.auth.models import Group
+    from django.db.models import Q
+    from django_namespace_perms.models import UserPermission, GroupPermission
+
+    users = list(users)
+    pending = [user for user in users if not hasattr(user, "_nsp_perms")]
+    ids = set([user.pk for user in pending if user.is_authenticated])
+    guests = len(ids) < len(pending)
+
+    memberships = {}
+    guest_ids = []
+    if pending:
+        groups = Q(user__in=ids)
+        if guests:
+            groups |= Q(name=guest_group_name())
+        qset = Group.objects.filter(groups).values_list("user", "id", "name")
+        for user_id, group_id, name in qset.distinct():
+            if user_id in ids:
+                memberships.setdefault(user_id, []).append(group_id)
+            if guests and name == guest_group_name() and group_id not in guest_ids:
+                guest_ids.append(group_id)
+
+    group_rules = {}
+    user_rules = {}
+    group_ids = set(guest_ids)
+    for user_group_ids in memberships.values():
+        group_ids.update(user_group_ids)
+
+    if group_ids or ids:
+        rules = rules_query(
+            UserPermission.objects.filter(user__in=ids),
+            GroupPermission.objects.filter(group__in=group_ids),
+        )
+        for rule in rules:
+            if rule[2] is None:
+                user_rules.setdefault(rule[3], []).append(rule)
+            else:
+                group_rules.setdefault(rule[2], []).append(rule)
+
+    rv = []
+    for user in users:
+        if hasattr(user, "_nsp_perms"):
+            rv.append(load_perms(user))
+            continue
+
+        rules = []
+        if user.is_authenticated:
+            for group_id in memberships.get(user.pk, []):
+                rules.extend(group_rules.get(group_id, []))
+            rules.extend(user_rules.get(user.pk, []))
+        else:
+            for group_id in guest_ids:
+                rules.extend(group_rules.get(group_id, []))
+
+        permdict = {}
+        if hasattr(user, "nsp_manual"):
+            for ns, p in list(user.nsp_manual.items()):
+                permdict[ns] = p
+        merge_rules(permdict, rules)
+
+        set_perms(user, permdict, perms_structure(permdict))
+        rv.append(permdict)
+
+    return rv
+
+
+def user_layer(user):
+    """
+    Returns a (group_ids, permdict) tuple holding the ids of the user's
+    groups and the user's own permission rules, fetched from the database
+    """
+
+    group_ids, rules = user_layer_queries(user)
+    if rules is None:
+        return (tuple(group_ids), {})
+    return (tuple(group_ids), dict(rules))
+
+
+async def auser_layer(user):
+    """
+    Async version of user_layer, using the async ORM
+    """
+
+    group_ids, rules = user_layer_queries(user)
+    group_ids = tuple([group_id async for group_id in group_ids])
+    if rules is None:
+        return (group_ids, {})
+    return (group_ids, dict([rule async for rule in rules]))
+
+
+def user_layer_queries(user):
+    """
+    Returns the querysets for the ids of the user's groups and the user's
+    own (namespace, permissions) rules, guests have no rules of their own
+    """
+
+    from django_namespace_perms.models import UserPermission
+    from django.contrib.auth.models import Group
+
+    if not user.is_authenticated:
+        group_ids = Group.objects.filter(name=guest_group_name())
+        return (group_ids.values_list("id", flat=True), None)
+
+    rules = UserPermission.objects.filter(user=user)
+    return (
+        user.groups.values_list("id", flat=True),
+        rules.values_list("namespace", "permissions"),
+    )
+
+
+def group_layer(group_ids):
+    """
+    Returns a (permdict, CompactStructure) tuple holding the merged
+    permissions of the specified groups, fetched from the database
+    """
+
+    rules = []
+    if group_ids:
+        rules = list(group_layer_rules(group_ids))
+    return build_group_layer(rules)
+
+
+async def agroup_layer(group_ids):
+    """
+    Async version of group_layer, using the async ORM
+    """
+
+    rules = []
+    if group_ids:
+        rules = [rule async for rule in group_layer_rules(group_ids)]
+    return build_group_layer(rules)
+
+
+def group_layer_rules(group_ids):
+    """
+    Returns the (namespace, permissions) rules of the specified groups in
+    the order they are merged in
+    """
+
+    from django_namespace_perms.models import GroupPermission
+
+    qset = GroupPermission.objects.filter(group_id__in=group_ids)
+    return qset.order_by("id").values_list("namespace", "permissions")
+
+
+def build_group_layer(rules):
+    permdict = {}
+    for ns, p in rules:
+        permdict[ns] = p
+
+    context.count("builds")
+    return (permdict, compact_structure(permdict))
+
+
+def load_user_layer(user, backend):
+    """
+    Returns a (group_ids, permdict) tuple holding the ids of the user's
+    groups and the user's own permission rules
+    """
+
+    from django_namespace_perms import cache
+
+    return cache.get_or_load(
+        backend, cache.user_key(backend, user), lambda: user_layer(user)
+    )
+
+
+async def aload_user_layer(user, backend):
+    """
+    Async version of load_user_layer, see aload_layer
+    """
+
+    from django_namespace_perms import cache
+
+    return await cache.aget_or_load(
+        backend,
+        cache.user_key(backend, user),
+        lambda: aload_layer(lambda: user_layer(user), lambda: auser_layer(user)),
+    )
+
+
+def load_group_layer(group_ids, backend):
+    """
+    Returns a (permdict, CompactStructure) tuple holding the merged
+    permissions of the specified groups
+
+    Group layers are cached per set of groups and shared by all users that
+    are members of exactly these groups, so they must never be mutated.
+    Their structure is kept compact (see structure) and is immutable.
+    """
+
+    from django_namespace_perms import cache
+
+    return cache.get_or_load(
+        backend,
+        cache.group_layer_key(backend, group_ids),
+        lambda: group_layer(group_ids),
+    )
+
+
+async def aload_group_layer(group_ids, backend):
+    """
+    Async version of load_group_layer, see aload_layer
+    """
+
+    from django_namespace_perms import cache
+
+    return await cache.aget_or_load(
+        backend,
+        cache.group_layer_key(backend, group_ids),
+        lambda: aload_layer(
+            lambda: group_layer(group_ids), lambda: agroup_layer(group_ids)
+        ),
+    )
+
+
+def load_perms_layered(user, backend):
+    """
+    Load the user's permissions from cached layers, the user's own rules and
+    any nsp_manual rules are layered over the shared group layer
+
+    Returns a (permdict, perms_structure) tuple, see layer_perms
+    """
+
+    group_ids, user_perms = load_user_layer(user, backend)
+    return layer_perms(user, user_perms, load_group_layer(group_ids, backend))
+
+
+async def aload_perms_layered(user, backend):
+    """
+    Async version of load_perms_layered, cache lookups run in the event loop
+    so this is only used with the in-process cache backend
+    """
+
+    group_ids, user_perms = await aload_user_layer(user, backend)
+    return layer_perms(user, user_perms, await aload_group_layer(group_ids, backend))
+
+
+def layer_perms(user, user_perms, layer):
+    """
+    Layers the user's own rules and any nsp_manual rules over the group
+    layer as returned by load_group_layer
+
+    Returns a (permdict, perms_structure) tuple. The permissions dict is
+    always a copy, the cached group layer is never handed out to be
+    modified. If the user has no rules of their own the structure is the
+    shared, immutable CompactStructure of the group layer, otherwise the
+    user's rules are layered over its expanded structure (see
+    expanded_structure).
+
+    nsp_manual rules come first, like they do when loading without the
+    cache (see set_rules), permissions_apply depends on the order of the
+    rules so the structure is built from scratch for them.
+    """
+
+    group_permdict, group_struct = layer
+
+    manual = getattr(user, "nsp_manual", None)
+    if manual:
+        # manual perms have the lowest priority
+        permdict = dict(manual)
+        permdict.update(group_permdict)
+        permdict.update(user_perms)
+        context.count("builds")
+        return permdict, perms_structure(permdict)
+
+    if not user_perms:
+        return dict(group_permdict), group_struct
+
+    context.count("builds")
+    permdict = dict(group_permdict)
+    permdict.update(user_perms)
+    return permdict, perms_structure_layer(expanded_structure(group_struct), user_perms)
+
+
 #############################################################################
 
 
+PERMCODE_RE = re.compile("(add|delete|change|view)_(.+)")
+
+# translated django permission codes by (permcode, NSP_MODE)
+PERMCODES = {}
+
+# max number of translations kept, the memo is cleared once it is full
+# (e.g. with permission codes built from user input)
+PERMCODES_SIZE = 4096
+
+
 def permcode_to_namespace(perm):
+    """
+    Returns a (namespace, level) tuple for a django permission code, e.g.
+    "app.change_model" -> ("app.model.change", PERM_WRITE)
+
+    Translations are memoized per permission code and NSP_MODE.
+    """
+
+    key = (perm, getattr(settings, "NSP_MODE", "rw"))
+    rv = PERMCODES.get(key)
+    if rv is None:
+        if len(PERMCODES) >= PERMCODES_SIZE:
+            PERMCODES.clear()
+        rv = PERMCODES[key] = _permcode_to_namespace(perm)
+    return rv
+
+
+def _permcode_to_namespace(perm):
     label, perm_code = tuple(perm.split("."))
-    a = re.match("(add|delete|change|view)_(.+)", perm_code)
+    a = PERMCODE_RE.match(perm_code)
 
     if a:
         return (
@@ -189,7 +690,94 @@ def permcode_to_namespace(perm):
 #############################################################################
 
 
+# namespace resolution strategy by class, see namespace_strategy
+NAMESPACE_STRATEGIES = {}
+
+# max number of classes strategies are kept for, the cache is cleared once
+# it is full (e.g. with classes created at runtime)
+NAMESPACE_STRATEGIES_SIZE = 1024
+
+
 def obj_to_namespace(obj):
+    cls = type(obj)
+    if cls is str:
+        return obj.lower()
+    strategy = NAMESPACE_STRATEGIES.get(cls)
+    if strategy is None:
+        strategy = namespace_strategy(cls)
+    return strategy(obj)
+
+
+def namespace_strategy(cls):
+    """
+    Returns the function that builds namespaces for instances of cls,
+    strategies are determined once per class and cached
+
+    Models that define a custom nsp_namespace can set nsp_namespace_memoize
+    to True to have it memoized on the instance (keyed by id), only do so if
+    the namespace does not depend on fields that may change during the
+    lifetime of the instance.
+    """
+
+    if issubclass(cls, type):
+        # classes (models) are passed
+        strategy = obj_to_namespace_generic
+    elif cls is list:
+        strategy = obj_to_namespace_list
+    elif hasattr(cls, "nsp_namespace"):
+        if getattr(cls, "nsp_namespace_memoize", False):
+            strategy = obj_to_namespace_memoized
+        else:
+            strategy = obj_to_namespace_custom
+    elif (
+        hasattr(cls, "_meta")
+        and hasattr(cls, "id")
+        and not (hasattr(cls, "db_column") and hasattr(cls, "model"))
+    ):
+        strategy = namespace_template(cls)
+    else:
+        strategy = obj_to_namespace_generic
+
+    if len(NAMESPACE_STRATEGIES) >= NAMESPACE_STRATEGIES_SIZE:
+        NAMESPACE_STRATEGIES.clear()
+    NAMESPACE_STRATEGIES[cls] = strategy
+    return strategy
+
+
+def namespace_template(cls):
+    base = ("%s.%s" % (cls._meta.app_label, cls._meta.model_name)).lower()
+
+    def strategy(obj):
+        return "%s.%s" % (base, str(obj.id).lower())
+
+    return strategy
+
+
+def obj_to_namespace_custom(obj):
+    return obj.nsp_namespace.lower()
+
+
+def obj_to_namespace_memoized(obj):
+    ident = getattr(obj, "id", None)
+    memo = getattr(obj, "__dict__", None)
+    if ident is None or memo is None:
+        return obj.nsp_namespace.lower()
+    if "_nsp_namespace" in memo and memo["_nsp_namespace"][0] == ident:
+        return memo["_nsp_namespace"][1]
+    namespace = obj.nsp_namespace.lower()
+    memo["_nsp_namespace"] = (ident, namespace)
+    return namespace
+
+
+def obj_to_namespace_list(obj):
+    if len(obj) != 2:
+        raise Exception(
+            "When passing a list to obj_to_namespace it is expected to have two items: The model instance and the field name"
+        )
+    return "%s.%s" % (obj_to_namespace(obj[0]), obj[1].lower())
+
+
+def obj_to_namespace_generic(obj):
     if inspect.isclass(obj):
         # class passed check existance of possible class methods
         if hasattr(obj, "nsp_namespace_create"):
@@ -201,12 +789,7 @@ def obj_to_namespace(obj):
         return obj.nsp_namespace.lower()
 
     if type(obj) == list:
-        if len(obj) != 2:
-            raise Exception(
-                "When passing a list to obj_to_namespace it is expected to have two items: The model instance and the field name"
-            )
-        ns = "%s.%s" % (obj_to_namespace(obj[0]), obj[1].lower())
-        return ns
+        return obj_to_namespace_list(obj)
 
     if hasattr(obj, "db_column") and hasattr(obj, "model"):
         namespace = "%s.%s.%s" % (
@@ -227,6 +810,7 @@ def obj_to_namespace(obj):
 #############################################################################
 
 
+@context.instrumented("has_perms")
 def has_perms(user, namespace, level, ambiguous=False, explicit=False):
     """
     Check if a user has perms to the specified name space.
@@ -234,9 +818,10 @@ def has_perms(user, namespace, level, ambiguous=False, explicit=False):
     This should be the primary function you call to check if a user has access to
     something.
 
-    user <dict|AUTH_USER_MODEL> - the user's permissions, can be a perm_structure dict
-    a load_perms dict or the User model itself. Passing the user model may force a call
-    of load_perms if they had not been loade yet.
+    user <dict|NamespaceMatcher|CompactStructure|AUTH_USER_MODEL> - the user's
+    permissions, can be a perm_structure dict, a load_perms dict, a compiled
+    NamespaceMatcher, a compact_structure or the User model itself. Passing the user model may force a call of load_perms if they had
+    not been loade yet.
 
     namespace <string|ModelInstance|list> - the namespace to check, can be the namespace
     string itself, the instance of a django model or a list holding the instance of a
@@ -245,6 +830,10 @@ def has_perms(user, namespace, level, ambiguous=False, explicit=False):
     level <int|str> - permission level to check, if passed as string any value that
     is valid to be passed to get_permission_flag is ok
 
+    ambiguous <bool=False> - if true, also check if any rule below namespace grants
+    level, e.g. to find out if the user has perms to anything in an app or model,
+    "*" segments in namespace match any segment (see NamespaceMatcher.check_ambiguous)
+
     explicit <bool=False> - if true, explicit permissions are required to the
     full path provided in namespace, partial namespace matches will be ignored.
     """
@@ -252,108 +841,1537 @@ def has_perms(user, namespace, level, ambiguous=False, explicit=False):
     if type(level) in STR_TYPES:
         level = get_permission_flag(level)
 
-    if type(namespace) not in STR_TYPES:
+    namespace, explicit = resolve_namespace(namespace, level, explicit)
 
-        if level == constants.PERM_READ and hasattr(
-            namespace, "nsp_require_explicit_read"
-        ):
-            explicit = namespace.nsp_require_explicit_read
-        elif level == constants.PERM_WRITE and hasattr(
-            namespace, "nsp_required_explicit_write"
-        ):
-            explicit = namespace.nsp_require_explicit_write
+    if type(user) == dict and "__ps" in user and not ambiguous:
+        return get_perms(user, namespace.split("."), explicit=explicit).check(level)
 
-        namespace = obj_to_namespace(namespace)
+    if is_superuser(user):
+        return True
 
-    if type(user) != dict:
-        if user.is_superuser:
-            return True
-        perms = load_perms(user)
-        permstruct = user._nsp_perms_struct
-    else:
-        perms = user
-        if "__ps" not in perms:
-            permstruct = perms_structure(perms)
-        else:
-            permstruct = perms
+    if ambiguous:
+        return perms_matcher(user).check_ambiguous(
+            namespace.split("."), level, explicit=explicit
+        )
 
-    return get_perms(permstruct, namespace.split("."), explicit=explicit).check(level)
+    return perms_matcher(user).check(namespace.split("."), level, explicit=explicit)
 
 
-#############################################################################
+@context.instrumented("has_perms_many")
+def has_perms_many(user, namespaces, level, explicit=False):
+    """
+    Check if a user has perms to each of the specified namespaces.
 
+    Use this instead of calling has_perms in a loop when checking a batch of
+    namespaces or objects, all of them are resolved against the same
+    compiled permissions and namespaces sharing a prefix (e.g., instances of
+    the same model) share the walk of that prefix.
 
-def check_perms(perms, prefix, ambiguous=False):
+    Arguments are the same as for has_perms, except for
+
+    namespaces <list> - list of namespaces, each one can be anything that
+    is valid to be passed as namespace to has_perms
+
+    Returns a list of bools, one for each namespace
     """
-    DEPRECATED - replaced by get_perms
 
-    Return the user's perms for the specified prefix
+    if type(level) in STR_TYPES:
+        level = get_permission_flag(level)
 
-    perms <dict> permissions dict
-    prefix <string> namespace to check for perms
+    if is_superuser(user):
+        return [True for namespace in namespaces]
+
+    matcher = perms_matcher(user)
+
+    keys = []
+    flags = []
+    for namespace in namespaces:
+        namespace, _explicit = resolve_namespace(namespace, level, explicit)
+        keys.append(namespace.split("."))
+        flags.append(bool(_explicit))
+
+    return [
+        value is not None and (value & level) == level
+        for value in matcher.get_many(keys, explicit=flags)
+    ]
+
+
+async def aperms_loaded(user):
+    """
+    Make sure the permissions of a user object are loaded, without
+    blocking the event loop (see aload_perms)
+
+    user can be anything that is valid to be passed as user to has_perms
+    """
+
+    if not is_superuser(user) and not isinstance(
+        user, (dict, NamespaceMatcher, CompactStructure)
+    ):
+        await aload_perms(user)
+
+
+@context.instrumented("ahas_perms")
+async def ahas_perms(user, namespace, level, ambiguous=False, explicit=False):
+    """
+    Async version of has_perms, for use in async views and consumers
+
+    The user's permissions are loaded through aload_perms if they had not
+    been loaded yet, the check itself runs in the event loop.
+    """
+
+    await aperms_loaded(user)
+    return has_perms(user, namespace, level, ambiguous=ambiguous, explicit=explicit)
+
+
+@context.instrumented("ahas_perms_many")
+async def ahas_perms_many(user, namespaces, level, explicit=False):
+    """
+    Async version of has_perms_many, see ahas_perms
+    """
+
+    await aperms_loaded(user)
+    return has_perms_many(user, namespaces, level, explicit=explicit)
+
+
+def resolve_namespace(namespace, level, explicit=False):
+    """
+    Returns a (namespace, explicit) tuple for anything that is valid to be
+    passed as namespace to has_perms
+
+    Objects may require explicit permissions through their
+    nsp_require_explicit_read and nsp_require_explicit_write properties.
+    """
+
+    if type(namespace) in STR_TYPES:
+        return namespace, explicit
+
+    if level == constants.PERM_READ and hasattr(namespace, "nsp_require_explicit_read"):
+        explicit = namespace.nsp_require_explicit_read
+    elif level == constants.PERM_WRITE and hasattr(
+        namespace, "nsp_required_explicit_write"
+    ):
+        explicit = namespace.nsp_require_explicit_write
+
+    return obj_to_namespace(namespace), explicit
+
+
+def is_superuser(user):
+    """
+    Returns whether user is a superuser, user can be anything that is valid to
+    be passed as user to has_perms
+    """
+
+    if type(user) == dict or isinstance(user, (NamespaceMatcher, CompactStructure)):
+        return False
+    return user.is_superuser
+
+
+def perms_matcher(user):
+    """
+    Returns the compiled NamespaceMatcher for the user, loading and compiling
+    the user's permissions if they have not been compiled yet
+
+    user can be anything that is valid to be passed as user to has_perms
+    """
+
+    if isinstance(user, CompactStructure):
+        return user
+
+    if type(user) == dict or isinstance(user, NamespaceMatcher):
+        return compile_perms(user)
+
+    load_perms(user)
+    matcher = getattr(user, "_nsp_perms_matcher", None)
+    if matcher is None:
+        struct = user._nsp_perms_struct
+        if isinstance(struct, CompactStructure):
+            # cached group layers are compact structures, which resolve
+            # checks themselves
+            matcher = struct
+        else:
+            context.count("compiles")
+            matcher = compile_perms(struct)
+        user._nsp_perms_matcher = matcher
+        ctx = context.current()
+        if ctx is not None:
+            ctx.store(user)
+    return matcher
+
+
+#############################################################################
+
+
+# compiled permission dicts for check_perms, see perms_automaton
+PERMS_AUTOMATA_SIZE = 128
+
+_perms_automata = IdentityCache(
+    PERMS_AUTOMATA_SIZE, snapshot=lambda perms: tuple(perms.items())
+)
+
+
+class PermsAutomaton(object):
+
+    """
+    Permissions dict compiled for check_perms, use perms_automaton to
+    get the automaton for a permissions dict
+
+    Wildcard rules are compiled into a tree of namespace segments, segments
+    containing a wildcard are matched by a precompiled pattern. Rules are
+    also kept sorted by namespace so ambiguous matching only looks at the
+    rules starting with the checked namespace.
+    """
+
+    def __init__(self, items):
+        self.perms = dict(items)
+        self.items = items
+        self.sorted = sorted(
+            [(ns, index, p) for index, (ns, p) in enumerate(items)],
+            key=lambda rule: rule[0],
+        )
+        self.ambiguous_patterns = {}
+
+        # nodes are (children, patterns, rules) tuples, patterns hold
+        # (segment, compiled pattern, node) for segments containing a
+        # wildcard, the pattern is None for a plain wildcard segment
+        self.root = ({}, [], [])
+        self.wildcards = False
+        for index, (ns, p) in enumerate(items):
+            if ns.find("*") == -1:
+                continue
+            self.wildcards = True
+            node = self.root
+            for k in ns.split("."):
+                node = self.child(node, k)
+
+            # check_perms prefers the longest pattern, keep the length of
+            # the pattern it would match the rule with
+            pattern = r"^%s$" % re.escape(ns).replace(r"\*", r"[^\.]+")
+            node[2].append((len(pattern), index, p))
+
+    def child(self, node, k):
+        if k.find("*") == -1:
+            if k not in node[0]:
+                node[0][k] = ({}, [], [])
+            return node[0][k]
+        for segment, pattern, child in node[1]:
+            if segment == k:
+                return child
+        if k == "*":
+            pattern = None
+        else:
+            pattern = re.compile(r"%s$" % re.escape(k).replace(r"\*", r"[^\.]+"))
+        child = ({}, [], [])
+        node[1].append((k, pattern, child))
+        return child
+
+    def wildcard_rules(self, keys):
+        """
+        Returns (depth, length, index, value) tuples for the wildcard
+        rules matching keys[:depth]
+        """
+
+        rv = []
+        n = len(keys)
+        stack = [(self.root, 0)]
+        while stack:
+            node, depth = stack.pop()
+            children, patterns, rules = node
+            for length, index, p in rules:
+                rv.append((depth, length, index, p))
+            if depth == n:
+                continue
+            k = keys[depth]
+            if k in children:
+                stack.append((children[k], depth + 1))
+            for segment, pattern, child in patterns:
+                if (pattern is None and k) or (pattern and pattern.match(k)):
+                    stack.append((child, depth + 1))
+        return rv
+
+    def ambiguous(self, prefix, r):
+        """
+        Returns the value of the first rule starting with prefix that
+        exceeds r, or r if there is none
+        """
+
+        if prefix.find("*") > -1 or prefix.find("\\") > -1:
+            pattern = self.ambiguous_patterns.get(prefix)
+            if pattern is None:
+                pattern = self.ambiguous_patterns[prefix] = re.compile(
+                    "^%s" % re.escape(prefix).replace(r"\*", r"[^\.]+")
+                )
+            for ns, p in self.items:
+                if pattern.match(ns) and p > r:
+                    return p
+            return r
+
+        rules = self.sorted
+        first = None
+        i = bisect.bisect_left(rules, (prefix,))
+        while i < len(rules) and rules[i][0].startswith(prefix):
+            ns, index, p = rules[i]
+            if p > r and (first is None or index < first[0]):
+                first = (index, p)
+            i += 1
+        if first is None:
+            return r
+        return first[1]
+
+    def check(self, keys, ambiguous=False):
+        if self.wildcards:
+            wildcard_rules = self.wildcard_rules(keys)
+        else:
+            wildcard_rules = []
+
+        r = 0
+        # best wildcard match for rules ending above the current depth, those
+        # match as prefix, their pattern plus a trailing "\."
+        above = None
+        for i in range(1, len(keys) + 1):
+            k = ".".join(keys[:i])
+            matched = False
+
+            if k in self.perms:
+                r = self.perms[k]
+            elif wildcard_rules:
+                best = above
+                for depth, length, index, p in wildcard_rules:
+                    if depth == i and (best is None or (length, -index) > best[:2]):
+                        best = (length, -index, p)
+                if best is not None:
+                    r = best[2]
+                    matched = True
+
+            for depth, length, index, p in wildcard_rules:
+                if depth == i and (above is None or (length + 1, -index) > above[:2]):
+                    above = (length + 1, -index, p)
+
+            if not matched and ambiguous:
+                r = self.ambiguous(k, r)
+
+        return r
+
+
+def perms_automaton(perms):
+    """
+    Returns the PermsAutomaton for a permissions dict
+
+    Automata are cached by the identity of the dict and checked against a
+    snapshot of its rules, a dict that was changed since it was compiled
+    is compiled again.
+    """
+
+    automaton = _perms_automata.get(perms)
+    if automaton is None:
+        automaton = PermsAutomaton(tuple(perms.items()))
+        _perms_automata.set(perms, automaton)
+    return automaton
+
+
+def check_perms(perms, prefix, ambiguous=False):
+    """
+    DEPRECATED - replaced by get_perms
+
+    Return the user's perms for the specified prefix
+
+    perms <dict> permissions dict
+    prefix <string> namespace to check for perms
+
+    ambiguous <bool=False> if True reverse wildcard matching is active and a perm check for a.b.* will
+    be matched by the user having perms to a.b.c or a.b.d - only use this if you know what 
+    you are doing.
+
+    The permissions dict is compiled once (see perms_automaton), the
+    previous implementation is kept as check_perms_legacy.
+    """
+
+    return perms_automaton(perms).check(prefix.split("."), ambiguous=ambiguous)
+
+
+def check_perms_legacy(perms, prefix, ambiguous=False):
+    """
+    DEPRECATED - replaced by get_perms
+
+    Return the user's perms for the specified prefix
+
+    perms <dict> permissions dict
+    prefix <string> namespace to check for perms
+
+    ambiguous <bool=False> if True reverse wildcard matching is active and a perm check for a.b.* will
+    be matched by the user having perms to a.b.c or a.b.d - only use this if you know what 
+    you are doing.
+    """
+
+    try:
+
+        token = prefix.split(".")
+
+        i = 1
+        l = len(token)
+        r = 0
+
+        # collect permission rules with a wildcard in them, so we dont do unecessary
+        # regex searches later on
+        perms_wc = {}
+        for ns, p in list(perms.items()):
+            if ns.find("*") > -1:
+                perms_wc[re.escape(ns).replace(r"\*", r"[^\.]+")] = p
+
+        while i <= l:
+            k = ".".join(token[:i])
+            matched = False
+
+            # check for exact match
+            if k in perms:
+                r = perms.get(k)
+
+            # check for wildcard matches (if any wildcard rules exist)
+            elif perms_wc:
+                for ns, p in list(perms_wc.items()):
+                    a = r"^%s$" % ns
+                    b = r"^%s\." % ns
+                    j = len(a)
+                    u = len(b)
+                    if j > matched and re.match(a, k):
+                        r = p
+                        matched = j
+                    elif u > matched and re.match(b, k):
+                        r = p
+                        matched = u
+
+            # if not matched at all and ambiguous flag is true, do ambiguous
+            # matching
+            if not matched and ambiguous:
+                m = "^%s" % re.escape(k).replace(r"\*", r"[^\.]+")
+                for ns, p in list(perms.items()):
+                    if re.match(m, ns) and p > r:
+                        r = p
+                        break
+
+            i += 1
+
+        return r
+    except:
+        raise
+
+
+###############################################################################
+
+
+def get_perms(d, keys, explicit=False):
+    t = type(d)
+
+    # print "checking for",keys,"in",d,explicit
+
+    if t == int or t == int:
+        if explicit and keys:
+            return PermissionFrame(None)
+        return PermissionFrame(d)
+    if t is CompactStructure:
+        return PermissionFrame(d.get(keys, explicit=explicit))
+    if not keys:
+        return PermissionFrame(None)
+
+    r_a = 0
+    r_b = 0
+    k = keys[0]
+    if k in d:
+        r_a = get_perms(d[k], keys[1:], explicit=explicit)
+        if r_a.has_value():
+            return r_a
+
+    if "@%s" % k in d:
+        r_c = get_perms(d["@%s" % k], keys[1:], explicit=explicit)
+        if r_c.has_value():
+            return r_c
+
+    if "*" in d:
+        r_b = get_perms(d["*"], keys[1:], explicit=explicit)
+        if r_b.has_value():
+            return r_b
+
+    return PermissionFrame(None)
+
+
+def perms_struct_has_explicit_rule(d, keys, level):
+    return get_perms(d, keys, explicit=True).check(level)
+
+
+#############################################################################
+
+
+# operations the subtractive pass applies to a data node, see
+# PermissionsFilter
+OP_ROOT = 0
+OP_LITERAL = 1
+OP_WILDCARD = 2
+
+# sources for data that is granted as is
+GRANTED = (True,)
+
+# marks a child removed by PermissionsFilter
+REMOVED = object()
+
+# stands in for the dicts along a namespace PermissionsFilter.path walks
+CHAIN = {}
+
+
+# annotations of structures built with perms_structure(annotate=True),
+# see structure_annotations
+ANNOTATED_STRUCTURES_SIZE = 128
+
+_structure_annotations = IdentityCache(ANNOTATED_STRUCTURES_SIZE)
+
+
+class StructureAnnotations(object):
+
+    """
+    Subtree aggregates for the nodes of a permission structure, kept
+    apart from the structure by perms_structure(perms, annotate=True) so
+    they are computed once per structure
+
+    Aggregates of nodes that are not annotated yet are added as they
+    are computed.
+    """
+
+    def __init__(self):
+        self.nodes = {}
+
+    def get(self, node):
+        entry = self.nodes.get(id(node))
+        if entry is not None and entry[0] is node:
+            return entry[1]
+        return None
+
+    def set(self, node, aggregate):
+        self.nodes[id(node)] = (node, aggregate)
+
+
+def structure_annotations(perms_struct):
+    """
+    Returns the StructureAnnotations kept for a structure built with
+    perms_structure(perms, annotate=True) or None
+
+    Annotations are cached by the identity of the structure, copies of it
+    (e.g. unpickled from a cache) are not annotated.
+    """
+
+    return _structure_annotations.get(perms_struct)
+
+
+def annotate_structure(perms_struct):
+    """
+    Computes the subtree aggregates of all nodes of a permission structure
+    and keeps them for structure_annotations
+    """
+
+    annotations = StructureAnnotations()
+    structure_denies(perms_struct, annotations)
+    _structure_annotations.set(perms_struct, annotations)
+    return annotations
+
+
+def structure_denies(node, annotations=None):
+    """
+    Returns whether a rule at or below a node of a permission structure
+    as returned by perms_structure denies access
+
+    annotations <StructureAnnotations> - aggregates computed so far,
+    the aggregates computed for the node and its children are added
+    """
+
+    if annotations is not None:
+        rv = annotations.get(node)
+        if rv is not None:
+            return rv
+
+    rv = not node
+    for k, v in list(node.items()):
+        if k == "__ps":
+            continue
+        if dict_valid(v):
+            rv = structure_denies(v, annotations) or rv
+        elif not v:
+            rv = True
+
+    if annotations is not None:
+        annotations.set(node, rv)
+    return rv
+
+
+class CompiledRuleset(object):
+
+    """
+    Ruleset for permissions_apply compiled into the form PermissionsFilter
+    uses, rule namespaces are split once and list handler rulesets are
+    compiled along with it
+
+    Rules are relative to the namespace the ruleset is applied at, so the
+    same compiled ruleset can be applied to any instance of a model.
+
+    require <list> - (keys, perms) tuples
+
+    handlers <list> - (keys, handler, CompiledRuleset) tuples
+    """
+
+    def __init__(self, ruleset=None):
+        if not ruleset:
+            ruleset = {}
+
+        self.has_require = "require" in ruleset
+        self.require = [
+            (path.split("."), perm)
+            for path, perm in list(ruleset.get("require", {}).items())
+        ]
+        self.handlers = [
+            (path.split("."), handler, CompiledRuleset(handler.get("ruleset")))
+            for path, handler in list(ruleset.get("list-handlers", {}).items())
+        ]
+
+    def handler_ruleset(self, i, prefix=None):
+        """
+        Returns the ruleset applied to the items of the list handler at
+        index i: the handler's own ruleset, inheriting the require rules
+        of this ruleset if it has none
+
+        prefix <list> - namespace this ruleset is applied at, items are
+        filtered from the root so inherited rules need to include it
+        """
+
+        ruleset = self.handlers[i][2]
+        if ruleset.has_require or not self.has_require:
+            return ruleset
+
+        rv = CompiledRuleset()
+        rv.has_require = True
+        rv.handlers = ruleset.handlers
+        if prefix:
+            rv.require = [(prefix + keys, perm) for keys, perm in self.require]
+        else:
+            rv.require = self.require
+        return rv
+
+
+class PermissionsFilter(object):
+
+    """
+    Applies a permission structure and ruleset to data in a single
+    traversal, producing the same output as running the additive,
+    subtractive and ruleset passes one after another.
+
+    Every data node is visited once together with
+
+        - sources: the structure nodes the additive pass would grant it
+          from, in merge order
+        - ops: the (structure node, kind, op index, position) entries the
+          subtractive pass would apply to it, in the order it would apply
+          them
+        - the require and list-handler rules that can still match below it
+
+    Subtrees that are granted as is and not targeted by any of those are
+    shared with the input instead of being copied, the input is never
+    modified.
+    """
+
+    def __init__(self, perms_struct, ruleset=None, prefix=None, parent=None):
+        self.perms_struct = perms_struct
+        self.prefix = prefix
+        self.filters = {}
+
+        if parent is None:
+            self.wildcards = {}
+            self.explicit = {}
+            self.annotations = structure_annotations(perms_struct)
+            if self.annotations is None:
+                self.annotations = StructureAnnotations()
+        else:
+            self.wildcards = parent.wildcards
+            self.explicit = parent.explicit
+            self.annotations = parent.annotations
+
+        if not isinstance(ruleset, CompiledRuleset):
+            ruleset = CompiledRuleset(ruleset)
+        self.ruleset = ruleset
+
+    def apply(self, data):
+        """
+        Returns the filtered data
+
+        If the filter has a prefix, data is treated as the value at that
+        namespace and rules as relative to it, {} is returned if the
+        namespace is not accessible
+        """
+
+        if not self.perms_struct:
+            return {}
+
+        sources, root, reqs, hdls = self.start()
+
+        if self.prefix is not None:
+            rv, removed = self.path(
+                self.prefix, 0, data, sources, root, None, None, (reqs, hdls)
+            )
+            if rv is REMOVED:
+                return {}
+            return rv
+
+        if not dict_valid(data):
+            raise Exception("Wanted a dict or dict-like object got %s" % type(data))
+
+        rv, removed = self.node(data, sources, root, reqs, hdls)
+        return rv
+
+    def start(self):
+        """
+        Returns the (sources, ops, reqs, hdls) state at the root
+        """
+
+        perms_struct = self.perms_struct
+
+        # rule states are (keys, rule, position, previous wildcard
+        # position, last wildcard position, last wildcard key)
+        reqs = [(k, perm, 0, None, None, None) for k, perm in self.ruleset.require]
+        hdls = [
+            (k, i, 0, None, None, None)
+            for i, (k, handler, rs) in enumerate(self.ruleset.handlers)
+        ]
+        return [perms_struct], [(perms_struct, OP_ROOT, 0, 0)], reqs, hdls
+
+    def get_path(self, keys, data, shared=None):
+        """
+        Same as dict_get_path(self.apply(dict_from_namespace(keys, data)),
+        keys) without building the nested dicts
+
+        shared <tuple> - (frames, state) as returned by walk() for a
+        namespace that keys continue, keys are relative to it
+        """
+
+        if not self.perms_struct:
+            return None
+
+        frames = []
+        if shared is None:
+            state = self.start()
+        else:
+            state = shared[1]
+
+        depth, state, result = self.descend(keys, 0, data, *state, frames)
+        if result is None:
+            result = self.tail(keys, depth, data, state, None)
+        rv, removed = self.bubble(frames, *result)
+        if shared is not None:
+            rv, removed = self.bubble(shared[0], rv, removed)
+
+        if rv is REMOVED:
+            return None
+        return rv
+
+    def walk(self, keys):
+        """
+        Walks down keys ahead of get_path() calls for namespaces that
+        continue them, returns (frames, state) or None if the walk
+        can't be shared
+        """
+
+        if not self.perms_struct:
+            return None
+
+        frames = []
+        depth, state, result = self.descend(keys, 0, CHAIN, *self.start(), frames)
+        if result is not None or depth < len(keys):
+            return None
+        return frames, state
+
+    def recursable(self, ops, is_dict):
+        """
+        Returns (limit, indexes) for the ops applied to a dict node, limit
+        being the index of the first op removing the node outright and
+        indexes the ops below limit that descend into the node
+        """
+
+        rec = []
+        for i, op in enumerate(ops):
+            p = op[0]
+            if not p:
+                return i, rec
+            if op[1] == OP_LITERAL:
+                if is_dict and type(p) == dict:
+                    rec.append(i)
+            elif dict_valid(p):
+                rec.append(i)
+        return len(ops), rec
+
+    def path(self, keys, depth, data, sources, ops, reqs, hdls, start):
+        """
+        Same as node() for dict_from_namespace(keys[depth:], data) without
+        building it, the value returned is the filtered value at the end
+        of keys or REMOVED if it is not accessible
+
+        start <tuple|None> - (reqs, hdls) rule states starting at the end
+        of keys
+        """
+
+        frames = []
+        depth, state, result = self.descend(
+            keys, depth, data, sources, ops, reqs, hdls, frames
+        )
+        if result is None:
+            result = self.tail(keys, depth, data, state, start)
+        return self.bubble(frames, *result)
+
+    def descend(self, keys, depth, data, sources, ops, reqs, hdls, frames):
+        """
+        Walks down keys[depth:], appending a frame for every level passed
+        to frames so bubble() can resolve them afterwards
+
+        Returns (depth, state, result), result being the (value, removed)
+        of the level the walk stopped at if that is known already,
+        otherwise state holds the (sources, ops, reqs, hdls) to continue
+        from at depth, which is short of the end of keys if a list
+        handler targets a dict along the namespace.
+
+        data <*> - the value at the end of keys, CHAIN if more keys
+        follow
+        """
+
+        n = len(keys)
+        while depth < n:
+            if ops:
+                limit, rec = self.recursable(ops, True)
+                if limit == 0:
+                    return depth, None, (None, 0)
+            else:
+                limit, rec = 0, None
+
+            key = keys[depth]
+            if len(sources) == 1 and not dict_valid(sources[0]):
+                c_sources = GRANTED
+            else:
+                c_sources = self.grant_key(sources, key)
+
+            if c_sources is None:
+                removed = None
+                if ops and ops[0][1] != OP_ROOT:
+                    removed = self.removed(ops, limit, -1)
+                return depth, None, (REMOVED, removed)
+
+            if rec:
+                c_ops = self.child_ops(ops, rec, key, None)
+            else:
+                c_ops = []
+
+            if depth + 1 == n:
+                c_data = data
+            else:
+                c_data = CHAIN
+
+            checks = c_reqs = handlers = c_hdls = None
+            if reqs:
+                states = self.rules_for(self.index_rules(reqs), key)
+                if states:
+                    checks, c_reqs = self.advance_require(states, key, c_data)
+            if hdls:
+                states = self.rules_for(self.index_rules(hdls), key)
+                if states:
+                    handlers, c_hdls = self.advance_handlers(states, key, c_data)
+
+            if handlers and c_data is CHAIN:
+                return depth, (sources, ops, reqs, hdls), None
+
+            frames.append((ops, limit, key, checks, handlers, c_ops))
+            sources, ops, reqs, hdls = c_sources, c_ops, c_reqs, c_hdls
+            depth += 1
+
+        return depth, (sources, ops, reqs, hdls), None
+
+    def tail(self, keys, depth, data, state, start):
+        """
+        Returns (value, removed) for the level descend() stopped at
+        """
+
+        sources, ops, reqs, hdls = state
+
+        if depth == len(keys):
+            if start is not None:
+                reqs = (reqs or []) + start[0]
+                hdls = (hdls or []) + start[1]
+            return self.node(data, sources, ops, reqs, hdls)
+
+        # list handler targeting a dict along the namespace, it needs to
+        # be built after all
+        rv, removed = self.node(
+            dict_from_namespace(keys[depth:], data), sources, ops, reqs, hdls
+        )
+        if removed is None:
+            for k in keys[depth:]:
+                if k not in rv:
+                    return REMOVED, None
+                rv = rv[k]
+        return rv, removed
+
+    def bubble(self, frames, rv, removed):
+        """
+        Resolves the levels in frames from the (value, removed) of the
+        level below the last of them, returns (value, removed) for the
+        first
+        """
+
+        for ops, limit, key, checks, handlers, c_ops in reversed(frames):
+            if removed is not None:
+                rv = REMOVED
+                alive = c_ops[removed][2]
+            else:
+                alive = len(ops)
+                if checks and not self.check_required(checks):
+                    rv = REMOVED
+                elif handlers and rv is not REMOVED:
+                    for state in handlers:
+                        rv = self.list_handler(rv, state)
+            if not key:
+                alive = -1
+
+            removed = None
+            if ops and ops[0][1] != OP_ROOT:
+                removed = self.removed(ops, limit, alive)
+                if removed is not None:
+                    rv = None
+
+        return rv, removed
+
+    def node(self, data, sources, ops, reqs, hdls):
+        """
+        Returns a (value, index) tuple for the data node, index being the
+        position in ops of the operation that removed the node, or None if
+        the node is kept
+        """
+
+        if not dict_valid(data):
+            for i, op in enumerate(ops):
+                if not op[0]:
+                    return data, i
+            return data, None
+
+        granted = len(sources) == 1 and not dict_valid(sources[0])
+
+        # ops at or after limit are never applied since the node is
+        # removed by the op at limit
+        limit, rec = self.recursable(ops, not granted or type(data) == dict)
+        if limit == 0 and ops:
+            return None, 0
+
+        if granted and rec and self.unchanged(data, [ops[i][0] for i in rec]):
+            # the subtractive pass would descend without removing anything
+            rec = []
+
+        reqs = self.index_rules(reqs)
+        hdls = self.index_rules(hdls)
+
+        if granted and not rec:
+            # the subtractive pass does not descend into this node, only
+            # children targeted by rules can change
+            removed = self.removed(ops, limit, len(ops) if any(data) else -1)
+            if removed is not None:
+                return None, removed
+            if (reqs and reqs[1]) or (hdls and hdls[1]):
+                keys = list(data.keys())
+            else:
+                keys = set()
+                for index in (reqs, hdls):
+                    if index:
+                        keys.update([k for k in index[0] if k in data])
+            rv = data
+            for k in keys:
+                value = self.finish(
+                    self.child((k, data[k], GRANTED), ops, rec, None, reqs, hdls)
+                )
+                if value is REMOVED:
+                    if rv is data:
+                        rv = dict(data)
+                    del rv[k]
+                elif value is not data[k]:
+                    if rv is data:
+                        rv = dict(data)
+                    rv[k] = value
+            return rv, None
+
+        if granted:
+            children = [(k, v, GRANTED) for k, v in list(data.items())]
+        else:
+            children = self.grant(data, sources)
+
+        results = [None] * len(children)
+        star = None
+
+        if rec and "*" in data:
+            # a literal "*" key is targeted by the wildcard rules as long
+            # as it exists, so it needs to be resolved first
+            for n, child in enumerate(children):
+                if child[0] == "*":
+                    results[n] = r = self.child(child, ops, rec, None, reqs, hdls)
+                    if r[2] is None:
+                        star = (len(ops), 0)
+                    else:
+                        star = r[2]
+                    break
+
+        for n, child in enumerate(children):
+            if results[n] is None:
+                results[n] = self.child(child, ops, rec, star, reqs, hdls)
+
+        if ops and ops[0][1] != OP_ROOT:
+            # position of the last op that removes a child, the node is
+            # removed by the subtractive pass once it is empty
+            alive = -1
+            for k, value, removed, checks, handlers in results:
+                if not k:
+                    continue
+                if removed is None:
+                    alive = len(ops)
+                    break
+                if removed[0] > alive:
+                    alive = removed[0]
+            removed = self.removed(ops, limit, alive)
+            if removed is not None:
+                return None, removed
+
+        rv = {}
+        changed = not granted
+        for n, result in enumerate(results):
+            value = self.finish(result)
+            if value is REMOVED:
+                changed = True
+                continue
+            if value is not children[n][1]:
+                changed = True
+            rv[result[0]] = value
+
+        if not changed:
+            return data, None
+        return rv, None
+
+    def unchanged(self, data, perms):
+        """
+        Returns whether the subtractive pass leaves the children of data
+        untouched when applying the structure nodes in perms: there are
+        no deny rules below them (see structure_denies) and no empty
+        values for them to remove
+        """
+
+        for p in perms:
+            if structure_denies(p, self.annotations):
+                return False
+        return not self.has_empty(data, perms)
+
+    def has_empty(self, data, perms):
+        """
+        Returns whether the structure nodes in perms target an empty
+        dict-like value below data
+        """
+
+        for p in perms:
+            for k, sub in p.items():
+                if k[:1] == "@":
+                    k = k[1:]
+                if k in data:
+                    values = [data[k]]
+                elif k == "*":
+                    values = list(data.values())
+                else:
+                    continue
+                for v in values:
+                    if not dict_valid(v):
+                        continue
+                    if not any(v):
+                        return True
+                    if dict_valid(sub) and self.has_empty(v, [sub]):
+                        return True
+        return False
+
+    def finish(self, result):
+        """
+        Applies the require rules and list handlers targeting a child
+        returned by child(), returns its final value or REMOVED
+        """
+
+        key, value, removed, checks, handlers = result
+        if removed is not None:
+            return REMOVED
+        if checks and not self.check_required(checks):
+            return REMOVED
+        if handlers:
+            for state in handlers:
+                value = self.list_handler(value, state)
+        return value
+
+    def removed(self, ops, limit, alive):
+        """
+        Returns the index of the op that removes the node, alive being
+        the index of the op after which the node is empty
+        """
+
+        for i in range(len(ops)):
+            if i == limit or alive < i:
+                return i
+        return None
+
+    def child(self, child, ops, rec, star, reqs, hdls):
+        """
+        Resolves a child node, returns a (key, value, removed, checks,
+        handlers) tuple
+
+        removed <tuple|None> - (op index, position) of the parent op that
+        removed the child
+
+        checks <list> - require rules targeting the child
+
+        handlers <list> - list handlers targeting the child
+        """
+
+        key, data, sources = child
+        c_ops = self.child_ops(ops, rec, key, star)
+
+        checks = c_reqs = handlers = c_hdls = None
+        states = self.rules_for(reqs, key)
+        if states:
+            checks, c_reqs = self.advance_require(states, key, data)
+        states = self.rules_for(hdls, key)
+        if states:
+            handlers, c_hdls = self.advance_handlers(states, key, data)
+
+        if sources is GRANTED and not c_ops and not c_reqs and not c_hdls:
+            return (key, data, None, checks, handlers)
+
+        value, removed = self.node(data, sources, c_ops, c_reqs, c_hdls)
+        if removed is not None:
+            removed = c_ops[removed][2:]
+        return (key, value, removed, checks, handlers)
+
+    def child_ops(self, ops, rec, key, star):
+        """
+        Returns the ops the subtractive pass applies to the child at key,
+        star being the (op index, position) after which wildcard rules no
+        longer target a literal "*" child only
+        """
+
+        rv = []
+        for i in rec:
+            p = ops[i][0]
+
+            if "*" not in p:
+                if key in p:
+                    value = p[key]
+                    rv.append((value, OP_LITERAL, i, 0))
+                    # "@key" only exists next to a dict
+                    if type(value) == dict and "@%s" % key in p:
+                        rv.append((p["@%s" % key], OP_LITERAL, i, 1))
+                continue
+
+            wildcards, index = self.wildcard_rules(p)
+            entries = []
+            if key in p:
+                value = p[key]
+                entries.append((index[key], value, OP_LITERAL))
+                if type(value) == dict and "@%s" % key in p:
+                    at = "@%s" % key
+                    entries.append((index[at], p[at], OP_LITERAL))
+            if key != "*":
+                for pos, value in wildcards:
+                    if star is None or (i, pos) > star:
+                        entries.append((pos, value, OP_WILDCARD))
+            entries.sort(key=lambda entry: entry[0])
+            for pos, value, kind in entries:
+                rv.append((value, kind, i, pos))
+
+        return rv
+
+    def wildcard_rules(self, perms):
+        """
+        Returns the wildcard rules of a structure node as a list of
+        (position, value) tuples and the positions of all its keys
+        """
+
+        cached = self.wildcards.get(id(perms))
+        if cached is not None and cached[0] is perms:
+            return cached[1], cached[2]
+
+        wildcards = []
+        index = {}
+        for pos, k in enumerate(perms):
+            index[k] = pos
+            if k == "*" or k == "@*":
+                wildcards.append((pos, perms[k]))
+
+        self.wildcards[id(perms)] = (perms, wildcards, index)
+        return wildcards, index
+
+    def grant(self, data, sources):
+        """
+        Returns (key, value, sources) tuples for the children of data that
+        are granted by the structure nodes in sources
+        """
+
+        if len(sources) == 1:
+            perms = sources[0]
+            get = perms.get
+            wildcard = get("*")
+            rv = []
+            for k, v in list(data.items()):
+                if not wildcard and not get(k) and type(k) in STR_TYPES:
+                    continue
+                c_sources = self.child_sources(perms, k)
+                if c_sources is not None:
+                    rv.append((k, v, c_sources))
+            return rv
+
+        # same as merging the additive results of all sources: keys are
+        # ordered by the first source granting them, values come from the
+        # last one
+        rv = {}
+        for perms in sources:
+            if not dict_valid(perms):
+                for k, v in list(data.items()):
+                    rv[k] = (k, v, GRANTED)
+                continue
+            for k, v in list(data.items()):
+                c_sources = self.child_sources(perms, k)
+                if c_sources is not None:
+                    rv[k] = (k, v, c_sources)
+        return list(rv.values())
+
+    def grant_key(self, sources, key):
+        """
+        Returns the structure nodes that grant the child at key of a node
+        granted by sources, or None if it is not granted
+        """
+
+        # the last source granting the key provides its value
+        for perms in reversed(sources):
+            if not dict_valid(perms):
+                return GRANTED
+            c_sources = self.child_sources(perms, key)
+            if c_sources is not None:
+                return c_sources
+        return None
+
+    def child_sources(self, perms, key):
+        """
+        Returns the structure nodes that grant the child at key, in the
+        order the additive pass merges them
+        """
+
+        rv = None
+        exact = perms.get(key)
+        if exact:
+            if type(exact) == int and exact > 0:
+                return GRANTED
+            rv = [exact]
+            if type(exact) == dict or type(key) not in STR_TYPES:
+                at = perms.get("@%s" % key)
+                if at:
+                    rv.append(at)
+        elif type(key) not in STR_TYPES:
+            at = perms.get("@%s" % key)
+            if at:
+                rv = [at]
+
+        wildcard = perms.get("*")
+        if wildcard:
+            if rv is None:
+                rv = [wildcard]
+            else:
+                rv.append(wildcard)
+
+        if rv is not None and len(rv) == 1 and not dict_valid(rv[0]):
+            return GRANTED
+        return rv
+
+    def index_rules(self, states):
+        """
+        Index rule states by the key they match next, returns a
+        ({key: states}, wildcard states) tuple or None
+        """
+
+        if not states:
+            return None
+        rv = {}
+        wildcards = []
+        for state in states:
+            k = state[0][state[2]]
+            if k == "*":
+                wildcards.append(state)
+            elif k in rv:
+                rv[k].append(state)
+            else:
+                rv[k] = [state]
+        return rv, wildcards
+
+    def rules_for(self, index, key):
+        """
+        Returns the rule states in an index that match key
+        """
+
+        if index is None:
+            return None
+        states = index[0].get(key)
+        if states is None:
+            return index[1]
+        if index[1]:
+            return states + index[1]
+        return states
+
+    def advance_require(self, reqs, key, data):
+        """
+        Returns the require rules targeting the child at key and the ones
+        that continue below it
+        """
+
+        checks = []
+        rv = []
+        for keys, perm, pos, prev, last, last_key in reqs:
+            k = keys[pos]
+            if k == "*":
+                state = (keys, perm, pos + 1, last, pos, key)
+            elif k == key:
+                state = (keys, perm, pos + 1, prev, last, last_key)
+            else:
+                continue
+            if pos + 1 == len(keys):
+                # rules ending in a wildcard dont remove anything
+                if k != "*":
+                    checks.append(state)
+            elif dict_valid(data):
+                rv.append(state)
+        return checks, rv
+
+    def advance_handlers(self, hdls, key, data):
+        """
+        Returns the list handlers targeting the child at key and the ones
+        that continue below it
+        """
+
+        handlers = []
+        states = []
+        for keys, i, pos, prev, last, last_key in hdls:
+            k = keys[pos]
+            if k == "*":
+                prev, last, last_key = last, pos, key
+            elif k != key:
+                continue
+            pos += 1
+            # wildcards match a list itself
+            if type(data) is list:
+                while pos < len(keys) and keys[pos] == "*":
+                    pos += 1
+            state = (keys, i, pos, prev, last, last_key)
+            if pos == len(keys):
+                handlers.append(state)
+            else:
+                states.append(state)
+
+        if not handlers:
+            if dict_valid(data):
+                return handlers, states
+            return handlers, []
+
+        handlers.sort(key=lambda state: state[1])
+
+        # handlers applied to this node replace it with a list, handlers
+        # that come after them only match that list if the rest of their
+        # path is wildcards
+        first = handlers[0][1]
+        rv = []
+        for keys, i, pos, prev, last, last_key in states:
+            if i < first:
+                if dict_valid(data):
+                    rv.append((keys, i, pos, prev, last, last_key))
+            elif not [k for k in keys[pos:] if k != "*"]:
+                handlers.append((keys, i, len(keys), prev, last, last_key))
+        handlers.sort(key=lambda state: state[1])
+        return handlers, rv
+
+    def rule_path(self, keys, prev, last, last_key):
+        """
+        Returns the namespace a require or list handler rule resolves
+        to, same as the legacy implementation only the part of the rule
+        following the second to last wildcard is kept
+        """
+
+        if last is None:
+            if self.prefix:
+                return self.prefix + keys
+            return keys
+        if prev is None:
+            if self.prefix:
+                return self.prefix + keys[:last] + [last_key] + keys[last + 1 :]
+            start = 0
+        else:
+            start = prev + 1
+        return keys[start:last] + [last_key] + keys[last + 1 :]
+
+    def check_required(self, checks):
+        """
+        Returns whether the structure has explicit rules satisfying all
+        require rules in checks
+        """
+
+        for keys, perm, pos, prev, last, last_key in checks:
+            path = self.rule_path(keys, prev, last, last_key)
+            cache_key = (tuple(path), perm)
+            r = self.explicit.get(cache_key)
+            if r is None:
+                r = self.explicit[cache_key] = perms_struct_has_explicit_rule(
+                    self.perms_struct, path, perm
+                )
+            if not r:
+                return False
+        return True
+
+    def list_handler(self, data, state):
+        """
+        Applies a list handler to data, returns the filtered list
+        """
+
+        if not data:
+            return data
+
+        keys, i, pos, prev, last, last_key = state
+        handler = self.ruleset.handlers[i][1]
+        path = self.rule_path(keys, prev, last, last_key)
+
+        sub = self.filters.get(i)
+        if sub is None:
+            sub = self.filters[i] = PermissionsFilter(
+                self.perms_struct,
+                ruleset=self.ruleset.handler_ruleset(i, self.prefix),
+                parent=self,
+            )
+
+        # the walk down to the list is shared by all its items
+        shared = None
+        if not handler.get("absolute"):
+            shared = sub.walk(path)
+
+        rv = []
+        for item in data:
+            if dict_valid(item):
+                final_path = handler.get("namespace")(**item).lower().split(".")
+            else:
+                final_path = handler.get("namespace")(obj=item).lower().split(".")
+
+            if shared is not None:
+                r = sub.get_path(final_path, item, shared=shared)
+            else:
+                if not handler.get("absolute"):
+                    final_path = path + final_path
+                r = sub.get_path(final_path, item)
+            if r:
+                rv.append(r)
+        return rv
+
+
+#############################################################################
+
+
+@context.instrumented("permissions_apply")
+def permissions_apply(data, perms_struct, path="", debug=False, ruleset=None):
+    """
+    Returns a copy of data containing only what perms_struct grants
+    access to, data itself is left untouched
+
+    data <dict> - nested data, keys being namespace segments
+
+    perms_struct <dict|CompactStructure|AUTH_USER_MODEL> - permission
+    structure as returned by perms_structure or compact_structure or a user
+    to load it for
+
+    ruleset <dict> - optional "require" and "list-handlers" rules
+    """
+
+    perms_struct = resolve_structure(perms_struct)
+
+    rv = PermissionsFilter(perms_struct, ruleset=ruleset).apply(data)
+
+    if debug:
+        print(json.dumps(rv, indent=2))
+
+    return rv
+
+
+#############################################################################
+# multi pass implementation, replaced by PermissionsFilter
+
+
+def warn_deprecated(name):
+    warnings.warn(
+        "%s is deprecated, use permissions_apply" % name,
+        DeprecationWarning,
+        stacklevel=3,
+    )
+
+
+def permissions_apply_additive(data, perms_struct):
+    """
+    DEPRECATED - replaced by permissions_apply
 
-    ambiguous <bool=False> if True reverse wildcard matching is active and a perm check for a.b.* will
-    be matched by the user having perms to a.b.c or a.b.d - only use this if you know what 
-    you are doing.
+    Returns the parts of data perms_struct grants access to, without
+    applying deny rules
     """
 
-    try:
+    warn_deprecated("permissions_apply_additive")
+    return _permissions_apply_additive(data, perms_struct)
 
-        token = prefix.split(".")
 
-        i = 1
-        l = len(token)
-        r = 0
+def permissions_apply_subtractive(data, perms_struct, debug=False):
+    """
+    DEPRECATED - replaced by permissions_apply
 
-        # collect permission rules with a wildcard in them, so we dont do unecessary
-        # regex searches later on
-        perms_wc = {}
-        for ns, p in list(perms.items()):
-            if ns.find("*") > -1:
-                perms_wc[re.escape(ns).replace(r"\*", r"[^\.]+")] = p
+    Removes the parts of data perms_struct denies access to, data is
+    modified in place
+    """
 
-        while i <= l:
-            k = ".".join(token[:i])
-            matched = False
+    warn_deprecated("permissions_apply_subtractive")
+    return _permissions_apply_subtractive(data, perms_struct, debug=debug)
 
-            # check for exact match
-            if k in perms:
-                r = perms.get(k)
 
-            # check for wildcard matches (if any wildcard rules exist)
-            elif perms_wc:
-                for ns, p in list(perms_wc.items()):
-                    a = r"^%s$" % ns
-                    b = r"^%s\." % ns
-                    j = len(a)
-                    u = len(b)
-                    if j > matched and re.match(a, k):
-                        r = p
-                        matched = j
-                    elif u > matched and re.match(b, k):
-                        r = p
-                        matched = u
+def permissions_apply_ruleset_require_explicit(
+    data, path, perm, perms_struct, full_path=None
+):
+    """
+    DEPRECATED - replaced by permissions_apply
 
-            # if not matched at all and ambiguous flag is true, do ambiguous
-            # matching
-            if not matched and ambiguous:
-                m = "^%s" % re.escape(k).replace(r"\*", r"[^\.]+")
-                for ns, p in list(perms.items()):
-                    if re.match(m, ns) and p > r:
-                        r = p
-                        break
+    Applies a "require" rule of a ruleset to data, data is modified in
+    place
+    """
 
-            i += 1
+    warn_deprecated("permissions_apply_ruleset_require_explicit")
+    return _permissions_apply_ruleset_require_explicit(
+        data, path, perm, perms_struct, full_path=full_path
+    )
 
-        return r
-    except:
-        raise
 
+def permissions_apply_list_handler(
+    data, path, handler, perms_struct, ruleset=None, full_path=None, container=None
+):
+    """
+    DEPRECATED - replaced by permissions_apply
+
+    Applies a "list-handlers" rule of a ruleset to data, data is modified
+    in place
+    """
 
-###############################################################################
+    warn_deprecated("permissions_apply_list_handler")
+    return _permissions_apply_list_handler(
+        data,
+        path,
+        handler,
+        perms_struct,
+        ruleset=ruleset,
+        full_path=full_path,
+        container=container,
+    )
 
 
-def permissions_apply_additive(data, perms_struct):
+def _permissions_apply_additive(data, perms_struct):
     if not perms_struct:
         return {}
 
@@ -365,18 +2383,18 @@ def permissions_apply_additive(data, perms_struct):
         direct_match = False
         if perms_struct.get(k):
             pv = perms_struct.get(k)
-            rv[k] = permissions_apply_additive(v, pv)
+            rv[k] = _permissions_apply_additive(v, pv)
             if type(pv) in (int, int) and pv > 0:
                 direct_match = True
 
         if perms_struct.get("@%s" % k):
-            d = permissions_apply_additive(v, perms_struct.get("@%s" % k))
+            d = _permissions_apply_additive(v, perms_struct.get("@%s" % k))
             if dict_valid(d) and dict_valid(rv.get(k)):
                 rv[k].update(d)
             else:
                 rv[k] = d
         if not direct_match and perms_struct.get("*"):
-            d = permissions_apply_additive(v, perms_struct.get("*"))
+            d = _permissions_apply_additive(v, perms_struct.get("*"))
             if dict_valid(d) and dict_valid(rv.get(k)):
                 rv[k].update(d)
             else:
@@ -388,7 +2406,7 @@ def permissions_apply_additive(data, perms_struct):
 #############################################################################
 
 
-def permissions_apply_subtractive(data, perms_struct, debug=False):
+def _permissions_apply_subtractive(data, perms_struct, debug=False):
     if not dict_valid(data):
         raise Exception("Wanted a dict or dict-like object got %s" % type(data))
 
@@ -401,60 +2419,20 @@ def permissions_apply_subtractive(data, perms_struct, debug=False):
             if not p or (dict_valid(data[k]) and not any(data[k])):
                 del data[k]
             elif type(data[k]) == dict and type(p) == dict:
-                permissions_apply_subtractive(data.get(k), p, debug=debug)
+                _permissions_apply_subtractive(data.get(k), p, debug=debug)
 
         elif k == "*":
             for n, v in list(data.items()):
                 if not p or (dict_valid(data[n]) and not any(data[n])):
                     del data[n]
                 elif dict_valid(p) and dict_valid(v):
-                    permissions_apply_subtractive(v, p, debug=debug)
-
-
-#############################################################################
-
-
-def get_perms(d, keys, explicit=False):
-    t = type(d)
-
-    # print "checking for",keys,"in",d,explicit
-
-    if t == int or t == int:
-        if explicit and keys:
-            return PermissionFrame(None)
-        return PermissionFrame(d)
-    if not keys:
-        return PermissionFrame(None)
-
-    r_a = 0
-    r_b = 0
-    k = keys[0]
-    if k in d:
-        r_a = get_perms(d[k], keys[1:], explicit=explicit)
-        if r_a.has_value():
-            return r_a
-
-    if "@%s" % k in d:
-        r_c = get_perms(d["@%s" % k], keys[1:], explicit=explicit)
-        if r_c.has_value():
-            return r_c
-
-    if "*" in d:
-        r_b = get_perms(d["*"], keys[1:], explicit=explicit)
-        if r_b.has_value():
-            return r_b
-
-    return PermissionFrame(None)
-
-
-def perms_struct_has_explicit_rule(d, keys, level):
-    return get_perms(d, keys, explicit=True).check(level)
+                    _permissions_apply_subtractive(v, p, debug=debug)
 
 
 #############################################################################
 
 
-def permissions_apply_ruleset_require_explicit(
+def _permissions_apply_ruleset_require_explicit(
     data, path, perm, perms_struct, full_path=None
 ):
     d = data
@@ -471,7 +2449,7 @@ def permissions_apply_ruleset_require_explicit(
             if not dict_valid(d):
                 return
             for i, j in list(d.items()):
-                permissions_apply_ruleset_require_explicit(
+                _permissions_apply_ruleset_require_explicit(
                     j, keys[a + 1 :], perm, perms_struct, full_path=keys[:a] + [i]
                 )
             return
@@ -494,8 +2472,15 @@ def permissions_apply_ruleset_require_explicit(
 #############################################################################
 
 
-def permissions_apply_list_handler(
-    data, path, handler, perms_struct, ruleset=None, full_path=None, container=None
+def _permissions_apply_list_handler(
+    data,
+    path,
+    handler,
+    perms_struct,
+    ruleset=None,
+    full_path=None,
+    container=None,
+    apply=None,
 ):
 
     d = data
@@ -504,6 +2489,9 @@ def permissions_apply_list_handler(
     if ruleset is None:
         ruleset = {}
 
+    if apply is None:
+        apply = permissions_apply
+
     if type(path) is not list:
         keys = path.split(".")
     else:
@@ -520,7 +2508,7 @@ def permissions_apply_list_handler(
                         _keys = keys[a + 1 :]
                     else:
                         _keys = []
-                    permissions_apply_list_handler(
+                    _permissions_apply_list_handler(
                         j,
                         _keys,
                         handler,
@@ -528,6 +2516,7 @@ def permissions_apply_list_handler(
                         full_path=keys[:a] + [i],
                         container=(d, i),
                         ruleset=ruleset,
+                        apply=apply,
                     )
                 return
             elif type(d) is not list:
@@ -564,9 +2553,7 @@ def permissions_apply_list_handler(
 
             # print final_path, item
 
-            r = permissions_apply(
-                dict_from_namespace(final_path, item), perms_struct, ruleset=rs
-            )
+            r = apply(dict_from_namespace(final_path, item), perms_struct, ruleset=rs)
             r = dict_get_path(r, final_path)
             if r:
                 n.append(r)
@@ -577,88 +2564,475 @@ def permissions_apply_list_handler(
 #############################################################################
 
 
-def permissions_apply(data, perms_struct, path="", debug=False, ruleset=None):
-    if not dict_valid(perms_struct):
-        load_perms(perms_struct)
-        perms_struct = perms_struct._nsp_perms_struct
-    rv = permissions_apply_additive(data, perms_struct)
-
-    if debug:
-        print(json.dumps(rv, indent=2))
+# compiled nsp_ruleset by model class, see model_ruleset
+MODEL_RULESETS = {}
 
-    permissions_apply_subtractive(rv, perms_struct)
 
-    if debug:
-        print(json.dumps(rv, indent=2))
+def model_ruleset(inst, ruleset=None):
+    """
+    Returns the CompiledRuleset applied to the serialized data of inst:
+    the model's nsp_ruleset merged over ruleset
 
-    # apply ruleset
-    if ruleset:
-        for key, perm in list(ruleset.get("require", {}).items()):
-            permissions_apply_ruleset_require_explicit(rv, key, perm, perms_struct)
-        for key, hdl in list(ruleset.get("list-handlers", {}).items()):
-            permissions_apply_list_handler(rv, key, hdl, perms_struct, ruleset=ruleset)
+    The model's nsp_ruleset is compiled once per class, unless it is a
+    property. Rulesets passed in are compiled on every call, pass a
+    CompiledRuleset to permissions_apply_to_serialized_model instead to
+    avoid that.
+    """
 
-    if debug:
-        print(json.dumps(rv, indent=2))
+    cls = type(inst)
+    nsp_ruleset = getattr(inst, "nsp_ruleset", None)
 
-    return rv
+    if ruleset:
+        merged = dict(ruleset)
+        if nsp_ruleset:
+            merged.update(nsp_ruleset)
+        return CompiledRuleset(merged)
 
+    cached = MODEL_RULESETS.get(cls)
+    if cached is not None and cached[0] is nsp_ruleset:
+        return cached[1]
 
-#############################################################################
+    compiled = CompiledRuleset(nsp_ruleset)
+    if not isinstance(getattr(cls, "nsp_ruleset", None), property):
+        MODEL_RULESETS[cls] = (nsp_ruleset, compiled)
+    return compiled
 
 
+@context.instrumented("permissions_apply_to_serialized_model")
 def permissions_apply_to_serialized_model(
     smodel, perms_struct, data=None, ruleset=None
 ):
-    if ruleset is None:
-        ruleset = {}
+    """
+    Applies permissions to the serialized data of a model instance and
+    returns the filtered data
+
+    smodel <Serializer|Model> - serializer or model instance
+
+    perms_struct <dict|CompactStructure|AUTH_USER_MODEL> - same as for
+    permissions_apply
+
+    data <dict> - serialized data, defaults to smodel.data
+
+    ruleset <dict|CompiledRuleset> - rules relative to the instance's
+    namespace, a dict is merged with the model's nsp_ruleset, a
+    CompiledRuleset is used as is
+    """
 
     if hasattr(smodel, "instance"):
         inst = smodel.instance
     else:
         inst = smodel
 
-    namespace_str = obj_to_namespace(inst)
-    namespace = namespace_str.split(".")
-    structure = d = {}
-
-    if hasattr(inst, "nsp_ruleset"):
-        ruleset.update(inst.nsp_ruleset)
-
-    l = len(namespace)
-    i = 0
-    while i < l:
-        k = namespace[i]
-        if i < l - 1:
-            d[k] = {}
-            d = d[k]
-        elif data is None:
-            d[str(k)] = smodel.data
+    if data is None:
+        data = smodel.data
+
+    if not isinstance(ruleset, CompiledRuleset):
+        ruleset = model_ruleset(inst, ruleset)
+
+    perms_struct = resolve_structure(perms_struct)
+
+    namespace = obj_to_namespace(inst).split(".")
+    return PermissionsFilter(perms_struct, ruleset=ruleset, prefix=namespace).apply(
+        data
+    )
+
+
+def namespace_shares_perms(perms_struct, prefix):
+    """
+    Returns whether every namespace prefix + [key] resolves the same in
+    perms_struct for any key but "*", which is the case if rules below
+    prefix only target its wildcard and the fields below it
+    (app.model, app.model.*, app.model.*.field)
+    """
+
+    node = perms_struct
+    for k in prefix:
+        if "*" in node or "@*" in node:
+            return False
+        node = node.get(k)
+        if not dict_valid(node):
+            return True
+
+    for k in node.keys():
+        if k not in ("*", "@*"):
+            return False
+
+    fields = node.get("*")
+    if dict_valid(fields):
+        for v in fields.values():
+            if dict_valid(v):
+                return False
+    return True
+
+
+def serialized_shape(data):
+    """
+    Returns the signature of serialized data that decides which of its
+    fields are visible when the field visibility is shared (see
+    permissions_apply_to_serialized_models)
+    """
+
+    rv = []
+    for k, v in data.items():
+        if not dict_valid(v):
+            rv.append((k, 0))
+        elif any(v):
+            rv.append((k, 2))
         else:
-            d[str(k)] = data
-        i += 1
+            rv.append((k, 1))
+    return tuple(rv)
 
-    # prepare ruleset
-    if ruleset:
-        _ruleset = {}
-        for section, rules in list(ruleset.items()):
-            _ruleset[section] = {}
-            for rule, perms in list(rules.items()):
-                _ruleset[section]["%s.%s" % (namespace_str, rule)] = perms
-        ruleset = _ruleset
 
-    r = permissions_apply(structure, perms_struct, ruleset=ruleset)
+class FieldVisibility(object):
+
+    """
+    Field visibility shared by the instances of a model (instances with
+    namespaces prefix + [id]), use field_visibility to create one
+
+    Read from the permission structure once by following the rules
+    along app.model.* the way the additive and subtractive passes of
+    permissions_apply do: rules of the form app.model, app.model.* and
+    app.model.*.field make fields visible or hidden for every instance,
+    instances targeted by id specific rules need full evaluation.
+
+    prefix <list> - namespace of the model
+
+    visible <set> - fields visible as is on every instance not in ids
+
+    hidden <set> - fields hidden on every instance not in ids
+
+    dependent <set> - fields whose visibility depends on their value,
+    contains "*" if all fields do
+
+    ids <set> - last namespace segments (ids) targeted by id specific
+    rules
+    """
+
+    def __init__(self, perms_struct, prefix, fields, ruleset=None):
+        if not isinstance(ruleset, CompiledRuleset):
+            ruleset = CompiledRuleset(ruleset)
+
+        self.prefix = list(prefix)
+        self.visible = set()
+        self.hidden = set()
+        self.dependent = set()
+        self.ids = set()
+
+        # field -> whether it is kept for each kind of value (see
+        # serialized_shape): not a dict, dict without truthy keys, dict
+        # with truthy keys
+        self.fields = {}
+
+        # a literal "*" field is targeted by the wildcard rules and an
+        # empty field does not keep the instance from being emptied,
+        # either affects the other fields
+        fields = list(fields)
+        if "*" in fields:
+            self.dependent.add("*")
+        if "" in fields:
+            self.dependent.add("")
+
+        # rules reaching into field values or handling lists make the
+        # field depend on its value
+        require = []
+        for keys, perm in ruleset.require:
+            if len(keys) > 1:
+                self.dependent.add(keys[0])
+            elif keys[0] != "*":
+                # rules ending in a wildcard dont remove anything
+                require.append((keys[0], perm))
+        for keys, handler, rs in ruleset.handlers:
+            self.dependent.add(keys[0])
+
+        # rule nodes the subtractive pass reaches along the instance
+        # namespace, a falsy rule on the way removes the instance
+        denied = False
+        nodes = [perms_struct]
+        for k in self.prefix + ["*"]:
+            reached = []
+            for node in nodes:
+                if k == "*":
+                    for key in node.keys():
+                        if key[:1] == "@":
+                            key = key[1:]
+                        if key != "*":
+                            self.ids.add(key)
+                for key in set([k, "@%s" % k, "*", "@*"]):
+                    p = node.get(key)
+                    if dict_valid(p):
+                        reached.append(p)
+                    elif p is not None and not p:
+                        denied = True
+            nodes = reached
+
+        # rules below the fields reach into their values
+        for node in nodes:
+            for k, v in node.items():
+                if dict_valid(v):
+                    self.dependent.add(k)
+
+        if "*" in self.dependent:
+            return
+
+        # True, False or None if the additive pass keeps all or none of
+        # the fields, the rule node deciding which ones otherwise
+        kept = self.additive(perms_struct, 0)
+
+        for f in fields:
+            if f in self.dependent:
+                continue
+
+            rules = [
+                node[k]
+                for node in nodes
+                for k in (f, "@%s" % f, "*", "@*")
+                if k in node
+            ]
+
+            if dict_valid(kept):
+                keep = any([kept.get(k) for k in (f, "@%s" % f, "*")])
+            else:
+                keep = bool(kept)
+            keep = keep and not denied and all(rules)
+
+            # a literal "*" resolves like any id without rules of its own
+            # when rules need to be explicit
+            for k, perm in require:
+                if k == f and keep:
+                    keep = perms_struct_has_explicit_rule(
+                        perms_struct, self.prefix + ["*", f], perm
+                    )
+
+            # dicts without truthy keys are removed by any rule on the field
+            self.fields[f] = (keep, keep and not rules, keep)
+            if self.fields[f] == (True, True, True):
+                self.visible.add(f)
+            elif self.fields[f] == (False, False, False):
+                self.hidden.add(f)
+            else:
+                self.dependent.add(f)
+
+    def additive(self, node, depth):
+        """
+        Returns what the additive pass keeps of the namespace of an
+        instance without id specific rules when applying the rule node at
+        depth: True if all of it, None if not even the segment at depth,
+        False if nothing below it, the rule node of the fields if that
+        decides
+        """
+
+        if not dict_valid(node):
+            return True
+        if depth > len(self.prefix):
+            return node
+
+        # rules are applied in this order, each one replacing what the
+        # ones before it kept if it keeps anything itself
+        if depth < len(self.prefix):
+            k = self.prefix[depth]
+            rules = [node.get(k), node.get("@%s" % k)]
+            if not rules[0] or dict_valid(rules[0]):
+                rules.append(node.get("*"))
+        else:
+            rules = [node.get("*")]
+
+        kept = [self.additive(p, depth + 1) for p in rules if p]
+        if not kept:
+            return None
+        rv = kept[0]
+        for r in kept[1:]:
+            if r is not None:
+                rv = r
+        if rv is None:
+            return False
+        return rv
+
+    def applies(self, namespace):
+        """
+        Returns whether the visibility applies to the instance with the
+        namespace (split into segments)
+        """
+
+        return (
+            len(namespace) == len(self.prefix) + 1
+            and namespace[-1] not in self.ids
+            and namespace[-1] not in ("", "*")
+            and namespace[:-1] == self.prefix
+        )
+
+    def apply(self, data):
+        """
+        Returns data without its hidden fields, or None if that depends
+        on more than the fields and the kind of their values
+        """
+
+        fields = self.fields
+        rv = {}
+        for k, v in data.items():
+            kinds = fields.get(k)
+            if kinds is None:
+                return None
+            if not dict_valid(v):
+                keep = kinds[0]
+            elif any(v):
+                keep = kinds[2]
+            else:
+                keep = kinds[1]
+            if keep is None:
+                return None
+            if keep:
+                rv[k] = v
+        return rv
+
+
+def field_visibility(perms_struct, model, fields=None, ruleset=None):
+    """
+    Returns the FieldVisibility for the instances of a model
+
+    perms_struct <dict|CompactStructure|AUTH_USER_MODEL> - same as for
+    permissions_apply
+
+    model <Model> - model class, instances need to have namespaces of
+    the form app.model.<id>
+
+    fields <list> - field names, defaults to the model's fields
+
+    ruleset <dict|CompiledRuleset> - same as for
+    permissions_apply_to_serialized_model
+    """
+
+    perms_struct = resolve_structure(perms_struct)
+
+    if fields is None:
+        fields = [f.name for f in model._meta.get_fields()]
+
+    if not isinstance(ruleset, CompiledRuleset):
+        nsp_ruleset = getattr(model, "nsp_ruleset", None)
+        if dict_valid(nsp_ruleset):
+            ruleset = dict(ruleset or {})
+            ruleset.update(nsp_ruleset)
 
-    for k in namespace:
-        r = r.get(k, {})
+    prefix = [model._meta.app_label.lower(), model._meta.model_name.lower()]
+    return FieldVisibility(perms_struct, prefix, fields, ruleset=ruleset)
 
-    return r
+
+@context.instrumented("permissions_apply_to_serialized_models")
+def permissions_apply_to_serialized_models(instances, perms_struct, data, ruleset=None):
+    """
+    Same as permissions_apply_to_serialized_model for many instances at
+    once, returns a list holding the filtered data of each instance
+
+    Instances of a model whose rules only target the model and its
+    fields (app.model, app.model.*.field) see the same fields, the
+    visible fields are resolved once per set of serialized fields and
+    applied to the data of the other instances as is. Models with id
+    specific rules use the FieldVisibility of the model for the instances
+    it applies to.
+
+    instances <list> - model instances
+
+    perms_struct <dict|CompactStructure|AUTH_USER_MODEL> - same as for
+    permissions_apply
+
+    data <list> - serialized data of each instance
+
+    ruleset <dict|CompiledRuleset> - same as for
+    permissions_apply_to_serialized_model
+    """
+
+    perms_struct = resolve_structure(perms_struct)
+
+    # explicit perms and wildcard rules are cached on the base filter
+    # and shared by all instances
+    base = PermissionsFilter(perms_struct)
+    rulesets = {}
+    shared = {}
+    masks = {}
+    visibility = {}
+
+    rv = []
+    for inst, row in zip(instances, data):
+        cls = type(inst)
+        compiled = rulesets.get(cls)
+        if compiled is None:
+            if isinstance(ruleset, CompiledRuleset):
+                compiled = ruleset
+            else:
+                compiled = model_ruleset(inst, ruleset)
+            if not isinstance(getattr(cls, "nsp_ruleset", None), property):
+                rulesets[cls] = compiled
+
+        namespace = obj_to_namespace(inst).split(".")
+
+        def apply(row):
+            return PermissionsFilter(
+                perms_struct, ruleset=compiled, prefix=namespace, parent=base
+            ).apply(row)
+
+        if cls not in rulesets or not dict_valid(row) or namespace[-1] in ("", "*"):
+            rv.append(apply(row))
+            continue
+
+        prefix = tuple(namespace[:-1])
+        key = (id(compiled), prefix)
+        shares = shared.get(key)
+        if shares is None:
+            shares = shared[key] = (
+                not compiled.handlers
+                and all(
+                    [len(keys) == 1 and keys[0] != "*" for keys, p in compiled.require]
+                )
+                and namespace_shares_perms(perms_struct, prefix)
+            )
+        if not shares:
+            vis = visibility.get(key)
+            if vis is None:
+                vis = visibility[key] = FieldVisibility(
+                    perms_struct, prefix, row.keys(), ruleset=compiled
+                )
+            r = None
+            if vis.applies(namespace):
+                r = vis.apply(row)
+            rv.append(apply(row) if r is None else r)
+            continue
+
+        key = (id(compiled), prefix, serialized_shape(row))
+        mask = masks.get(key)
+        if mask is None:
+            r = apply(row)
+            rv.append(r)
+            # only usable if fields are either kept as is or removed
+            for k, v in r.items():
+                if v is not row[k]:
+                    masks[key] = False
+                    break
+            else:
+                masks[key] = list(r.keys())
+        elif mask is False:
+            rv.append(apply(row))
+        else:
+            rv.append(dict([(k, row[k]) for k in mask]))
+
+    return rv
 
 
 #############################################################################
 
 
-def perms_structure(perms):
+@context.instrumented("perms_structure")
+def perms_structure(perms, annotate=False):
+    """
+    Returns the permission structure for a permissions dict as returned
+    by load_perms, rules nested by their namespace segments
+
+    annotate <bool=False> - if true, the deny rules below all nodes (see
+    structure_denies) are looked up ahead of time and kept for the
+    structure (see structure_annotations), permissions_apply uses them to
+    skip subtrees that it would otherwise descend into only to find that
+    nothing changes
+    """
+
+    context.stat("rules", len(perms))
     perms_wc = {"__ps": True}
     for ns, p in list(perms.items()):
         pieces = ns.split(".")
@@ -680,4 +3054,87 @@ def perms_structure(perms):
                     a["@%s" % k] = p
             n += 1
 
+    if annotate:
+        annotate_structure(perms_wc)
+
+    return perms_wc
+
+
+def perms_structure_layer(struct, perms):
+    """
+    Returns a new permission structure with the rules in perms layered over
+    the rules in struct, replacing rules that target the same namespace.
+
+    Only dicts along the namespace paths of the layered rules are copied,
+    everything else is shared with struct, which is left untouched.
+    """
+
+    if not perms:
+        return struct
+
+    context.stat("rules", len(perms))
+    perms_wc = dict(struct)
+    owned = set([id(perms_wc)])
+    for ns, p in list(perms.items()):
+        pieces = ns.split(".")
+        a = perms_wc
+        n = 0
+        l = len(pieces)
+        for k in pieces:
+            if n < l - 1:
+                if k not in a:
+                    a[k] = {}
+                    owned.add(id(a[k]))
+                elif type(a[k]) != dict:
+                    a["@%s" % k] = a[k]
+                    a[k] = {}
+                    owned.add(id(a[k]))
+                elif id(a[k]) not in owned:
+                    a[k] = dict(a[k])
+                    owned.add(id(a[k]))
+                a = a[k]
+            else:
+                if k in a and type(a[k]) == dict:
+                    a["@%s" % k] = p
+                else:
+                    a[k] = p
+            n += 1
+
     return perms_wc
+
+
+# nested structures built for compact structures, see expanded_structure
+EXPANDED_STRUCTURES_SIZE = 32
+
+_expanded_structures = LRUCache(EXPANDED_STRUCTURES_SIZE)
+
+
+def expanded_structure(struct):
+    """
+    Returns the nested dict structure holding the rules of a
+    CompactStructure, the same perms_structure builds from them
+
+    Expanded structures are cached by the contents of the CompactStructure,
+    so equal copies (e.g. unpickled from a cache) share them. They are only
+    built again once they have been evicted.
+    """
+
+    rv = _expanded_structures.get(struct)
+    if rv is None:
+        rv = perms_structure(dict([(".".join(keys), p) for keys, p in struct.rules()]))
+        _expanded_structures.set(struct, rv)
+    return rv
+
+
+def resolve_structure(perms_struct):
+    """
+    Returns the nested dict structure for anything that is valid to be
+    passed as perms_struct to permissions_apply
+    """
+
+    if isinstance(perms_struct, CompactStructure):
+        return expanded_structure(perms_struct)
+    if not dict_valid(perms_struct):
+        load_perms(perms_struct)
+        return resolve_structure(perms_struct._nsp_perms_struct)
+    return perms_struct
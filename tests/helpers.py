@@ -0,0 +1,64 @@
+"""
+Random namespaces, permissions, data and rulesets for the randomized
+equivalence tests
+"""
+
+SEGMENTS = ["a", "b", "c", "1", "2", "*"]
+
+KEYS = ["a", "b", "c", "1", "2", "*", ""]
+
+
+def random_keys(rnd, max_depth, segments=SEGMENTS):
+    return [rnd.choice(segments) for i in range(rnd.randint(1, max_depth))]
+
+
+def random_path(rnd, max_depth, segments=SEGMENTS):
+    return ".".join(random_keys(rnd, max_depth, segments))
+
+
+def random_perms(rnd, count, levels=(0, 1, 3), segments=SEGMENTS):
+    return dict(
+        [(random_path(rnd, 4, segments), rnd.choice(levels)) for i in range(count)]
+    )
+
+
+def random_data(rnd, depth):
+    data = {}
+    for k in rnd.sample(KEYS, rnd.randint(0, 5)):
+        r = rnd.random()
+        if depth > 0 and r < 0.5:
+            data[k] = random_data(rnd, depth - 1)
+        elif r < 0.6:
+            data[k] = [
+                {"a": rnd.choice(["1", "2", "a"]), "b": "x"}
+                for i in range(rnd.randint(0, 3))
+            ]
+        else:
+            data[k] = "v%d" % rnd.randint(0, 9)
+    return data
+
+
+def namespace_builder(**kwargs):
+    return str(kwargs.get("a", kwargs.get("obj")))
+
+
+def random_ruleset(rnd):
+    ruleset = {}
+    if rnd.random() < 0.6:
+        ruleset["require"] = dict(
+            [
+                (random_path(rnd, 4), rnd.choice([0x01, 0x02]))
+                for i in range(rnd.randint(1, 4))
+            ]
+        )
+    if rnd.random() < 0.5:
+        ruleset["list-handlers"] = dict(
+            [
+                (
+                    random_path(rnd, 3),
+                    {"namespace": namespace_builder, "absolute": rnd.random() < 0.2},
+                )
+                for i in range(rnd.randint(1, 3))
+            ]
+        )
+    return ruleset or None
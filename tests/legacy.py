@@ -0,0 +1,55 @@
+"""
+Multi pass implementation of util.permissions_apply, kept as the test
+oracle for PermissionsFilter: the additive and subtractive passes and the
+ruleset are applied one after another, modifying the data in place.
+"""
+
+import json
+
+from django_namespace_perms.util import (
+    _permissions_apply_additive,
+    _permissions_apply_list_handler,
+    _permissions_apply_ruleset_require_explicit,
+    _permissions_apply_subtractive,
+    resolve_structure,
+)
+
+
+###############################################################################
+
+
+def permissions_apply_legacy(data, perms_struct, path="", debug=False, ruleset=None):
+    """
+    Same output as util.permissions_apply, but slower and it may modify
+    data
+    """
+
+    perms_struct = resolve_structure(perms_struct)
+    rv = _permissions_apply_additive(data, perms_struct)
+
+    if debug:
+        print(json.dumps(rv, indent=2))
+
+    _permissions_apply_subtractive(rv, perms_struct)
+
+    if debug:
+        print(json.dumps(rv, indent=2))
+
+    # apply ruleset
+    if ruleset:
+        for key, perm in list(ruleset.get("require", {}).items()):
+            _permissions_apply_ruleset_require_explicit(rv, key, perm, perms_struct)
+        for key, hdl in list(ruleset.get("list-handlers", {}).items()):
+            _permissions_apply_list_handler(
+                rv,
+                key,
+                hdl,
+                perms_struct,
+                ruleset=ruleset,
+                apply=permissions_apply_legacy,
+            )
+
+    if debug:
+        print(json.dumps(rv, indent=2))
+
+    return rv
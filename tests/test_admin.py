@@ -0,0 +1,94 @@
+import time
+
+from django.contrib.auth.models import User, Group
+from django.test import TestCase, override_settings
+
+from django_namespace_perms import admin, cache, constants, util
+from django_namespace_perms.models import GroupPermission
+
+
+###############################################################################
+
+
+@override_settings(NSP_CACHE="lru")
+class GroupMembershipTestCase(TestCase):
+    def setUp(self):
+        cache._lru = None
+        self.users = [
+            User.objects.create_user(username="member%d" % i) for i in range(7)
+        ]
+        self.groups = [Group.objects.create(name="members %d" % i) for i in range(2)]
+        self.users[0].groups.add(self.groups[0])
+        GroupPermission.objects.create(
+            group=self.groups[1], namespace="a", permissions=constants.PERM_READ
+        )
+
+    def members(self, group):
+        return sorted(group.user_set.values_list("id", flat=True))
+
+    def test_assign(self):
+        ids = sorted([user.id for user in self.users])
+        # cached before the assignment
+        util.load_perms(User.objects.get(id=ids[-1]))
+
+        steps = []
+        admin.group_membership(
+            [group.id for group in self.groups],
+            batch_size=3,
+            progress=lambda done, total: steps.append((done, total)),
+        )
+        for group in self.groups:
+            self.assertEqual(self.members(group), ids)
+        self.assertEqual(steps[0], (0, 14))
+        self.assertEqual(steps[-1], (14, 14))
+
+        # caches were invalidated
+        self.assertEqual(util.load_perms(User.objects.get(id=ids[-1])), {"a": 1})
+
+    def test_assign_existing(self):
+        # memberships that exist already are not inserted again
+        admin.group_membership([self.groups[0].id], batch_size=3)
+        admin.group_membership([self.groups[0].id], batch_size=3)
+        ids = sorted([user.id for user in self.users])
+        self.assertEqual(self.members(self.groups[0]), ids)
+
+    def test_revoke(self):
+        admin.group_membership([self.groups[0].id], batch_size=3)
+        admin.group_membership([self.groups[0].id], assign=False, batch_size=3)
+        self.assertEqual(self.members(self.groups[0]), [])
+
+    def test_queries(self):
+        # queries depend on the number of batches, not users
+        with self.assertNumQueries(2 + 2 * 3):
+            admin.group_membership([self.groups[1].id], batch_size=3)
+
+
+class BackgroundTaskTestCase(TestCase):
+    def wait(self, task_id):
+        for i in range(100):
+            if admin.TASKS[task_id]["finished"]:
+                return admin.TASKS[task_id]
+            time.sleep(0.01)
+        self.fail("task did not finish")
+
+    def test_run_in_background(self):
+        def func(total, progress=None):
+            progress(total, total)
+
+        task = self.wait(admin.run_in_background(func, 3))
+        self.assertEqual((task["done"], task["total"], task["error"]), (3, 3, None))
+
+        def fail(progress=None):
+            raise ValueError("failed")
+
+        self.assertEqual(self.wait(admin.run_in_background(fail))["error"], "failed")
+
+    def test_prune(self):
+        task_id = admin.run_in_background(lambda progress=None: None)
+        self.wait(task_id)
+        admin.prune_tasks()
+        self.assertIn(task_id, admin.TASKS)
+
+        admin.TASKS[task_id]["finished_at"] -= admin.TASKS_TIMEOUT + 1
+        admin.prune_tasks()
+        self.assertNotIn(task_id, admin.TASKS)
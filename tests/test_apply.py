@@ -0,0 +1,294 @@
+import copy
+import json
+import pickle
+import random
+
+from django.contrib.auth.models import Group
+from django.test import TestCase
+
+from django_namespace_perms import util, constants
+
+from .helpers import (
+    KEYS,
+    namespace_builder,
+    random_data,
+    random_path,
+    random_perms,
+    random_ruleset,
+)
+from .legacy import permissions_apply_legacy
+
+
+###############################################################################
+
+
+class PermissionsApplyTestCase(TestCase):
+    def assert_equivalent(self, data, perms_struct, ruleset=None):
+        before = json.dumps(data, sort_keys=True)
+        expected = permissions_apply_legacy(
+            copy.deepcopy(data), perms_struct, ruleset=ruleset
+        )
+        result = util.permissions_apply(data, perms_struct, ruleset=ruleset)
+        self.assertEqual(result, expected)
+
+        # data is left untouched
+        self.assertEqual(json.dumps(data, sort_keys=True), before)
+
+    def test_equivalence_random(self):
+        rnd = random.Random(1)
+        for i in range(500):
+            perms_struct = util.perms_structure(random_perms(rnd, rnd.randint(1, 12)))
+            self.assert_equivalent(
+                random_data(rnd, 4), perms_struct, ruleset=random_ruleset(rnd)
+            )
+
+    def test_shared_subtrees(self):
+        perms_struct = util.perms_structure(
+            {"a": constants.PERM_READ, "b.c": constants.PERM_READ}
+        )
+        data = {"a": {"x": {"y": 1}}, "b": {"c": {"z": 2}, "d": 3}}
+        result = util.permissions_apply(data, perms_struct)
+        self.assertEqual(result, {"a": {"x": {"y": 1}}, "b": {"c": {"z": 2}}})
+
+        # granted subtrees are not copied
+        self.assertIs(result["a"], data["a"])
+        self.assertIs(result["b"]["c"], data["b"]["c"])
+
+    def test_equivalence_annotated(self):
+        rnd = random.Random(4)
+        for i in range(300):
+            perms = dict(
+                [
+                    (
+                        random_path(rnd, 4),
+                        rnd.choice([1, 3] if rnd.random() < 0.8 else [0]),
+                    )
+                    for j in range(rnd.randint(1, 8))
+                ]
+            )
+            data = random_data(rnd, 4)
+            data[rnd.choice(KEYS)] = rnd.choice([{}, {"a": {}}, {"": 1}])
+            self.assert_equivalent(
+                data,
+                util.perms_structure(perms, annotate=rnd.random() < 0.5),
+                ruleset=random_ruleset(rnd) if rnd.random() < 0.3 else None,
+            )
+
+    def test_pruned_subtrees(self):
+        perms_struct = util.perms_structure(
+            {"a": constants.PERM_READ, "a.*.b": constants.PERM_READ}, annotate=True
+        )
+        data = {"a": {"x": {"b": {"c": 1}}, "y": {"b": 2}}}
+        result = util.permissions_apply(data, perms_struct)
+        self.assertEqual(result, data)
+        self.assertIs(result["a"]["x"], data["a"]["x"])
+
+        # empty values are still removed
+        data = {"a": {"x": {"b": {}}, "y": {"b": 2}}}
+        self.assertEqual(
+            util.permissions_apply(data, perms_struct), {"a": {"x": {}, "y": {"b": 2}}}
+        )
+
+    def test_structure_denies(self):
+        perms_struct = util.perms_structure(
+            {"a.b": 1, "a.c.*": 1, "d": 3, "d.e": 0}, annotate=True
+        )
+        annotations = util.structure_annotations(perms_struct)
+        self.assertIsInstance(annotations, util.StructureAnnotations)
+        self.assertEqual(annotations.get(perms_struct["a"]), False)
+        self.assertEqual(util.structure_denies(perms_struct["d"]), True)
+        self.assertEqual(util.structure_denies(perms_struct), True)
+
+        # annotations are kept apart from the structure
+        self.assertEqual(perms_struct["__ps"], True)
+        json.dumps(perms_struct)
+
+        # copies are not annotated
+        copied = pickle.loads(pickle.dumps(perms_struct))
+        self.assertEqual(util.structure_annotations(copied), None)
+        self.assertEqual(util.structure_annotations(dict(perms_struct)), None)
+        self.assertEqual(
+            util.permissions_apply({"d": {"e": 1, "f": 2}}, copied), {"d": {"f": 2}}
+        )
+
+    def test_not_a_dict(self):
+        perms_struct = util.perms_structure({"a": constants.PERM_READ})
+        with self.assertRaises(Exception):
+            util.permissions_apply(["a"], perms_struct)
+        self.assertEqual(util.permissions_apply(["a"], {}), {})
+
+    def test_deprecated(self):
+        perms_struct = util.perms_structure({"a": constants.PERM_READ, "a.b": 0})
+        data = {"a": {"b": 1, "c": 2}, "d": 3}
+        with self.assertWarns(DeprecationWarning):
+            rv = util.permissions_apply_additive(data, perms_struct)
+        with self.assertWarns(DeprecationWarning):
+            util.permissions_apply_subtractive(rv, perms_struct)
+        self.assertEqual(rv, util.permissions_apply(data, perms_struct))
+
+
+###############################################################################
+
+
+class Serialized(object):
+
+    nsp_namespace = ""
+
+    nsp_ruleset = {"require": {"b": 0x01}}
+
+    def __init__(self, namespace, data):
+        self.nsp_namespace = namespace
+        self.data = data
+
+
+def apply_to_serialized_model_legacy(inst, perms_struct, ruleset):
+    ruleset = dict(ruleset or {})
+    ruleset.update(inst.nsp_ruleset)
+    namespace = util.obj_to_namespace(inst)
+    ruleset = dict(
+        [
+            (
+                section,
+                dict([("%s.%s" % (namespace, rule), v) for rule, v in rules.items()]),
+            )
+            for section, rules in ruleset.items()
+        ]
+    )
+    r = permissions_apply_legacy(
+        util.dict_from_namespace(namespace.split("."), copy.deepcopy(inst.data)),
+        perms_struct,
+        ruleset=ruleset,
+    )
+    for k in namespace.split("."):
+        r = r.get(k, {})
+    return r
+
+
+class SerializedModelTestCase(TestCase):
+    def test_equivalence_random(self):
+        rnd = random.Random(2)
+        for i in range(300):
+            perms_struct = util.perms_structure(random_perms(rnd, rnd.randint(1, 12)))
+            inst = Serialized(
+                ".".join([rnd.choice(KEYS[:-2]) for j in range(rnd.randint(1, 3))]),
+                random_data(rnd, 3),
+            )
+            ruleset = random_ruleset(rnd)
+            self.assertEqual(
+                util.permissions_apply_to_serialized_model(
+                    inst, perms_struct, ruleset=ruleset
+                ),
+                apply_to_serialized_model_legacy(inst, perms_struct, ruleset),
+            )
+
+    def test_ruleset_compiled_once(self):
+        perms_struct = util.perms_structure(
+            {"a.b": constants.PERM_READ, "a.b.a": constants.PERM_READ}
+        )
+        for name in ("b", "c"):
+            inst = Serialized("a.%s" % name, {"a": 1, "b": 2})
+            result = util.permissions_apply_to_serialized_model(inst, perms_struct)
+            self.assertEqual(result, {"a": 1} if name == "b" else {})
+
+        compiled = util.MODEL_RULESETS[Serialized][1]
+        self.assertIs(util.model_ruleset(inst), compiled)
+        self.assertEqual(compiled.require, [(["b"], 0x01)])
+
+    def test_ruleset_not_modified(self):
+        perms_struct = util.perms_structure({"a": constants.PERM_READ})
+        ruleset = {"require": {"a": 0x01}}
+        inst = Serialized("a", {"a": 1, "b": 2})
+        util.permissions_apply_to_serialized_model(inst, perms_struct, ruleset=ruleset)
+        self.assertEqual(ruleset, {"require": {"a": 0x01}})
+
+    def test_many_random(self):
+        rnd = random.Random(3)
+        for i in range(200):
+            perms = dict(
+                [
+                    (
+                        rnd.choice(
+                            [
+                                "a",
+                                "a.b",
+                                "a.b.*",
+                                "a.b.*.a",
+                                "a.b.*.b",
+                                "a.*",
+                                "a.b.2.a",
+                            ]
+                        ),
+                        rnd.choice([0, 1, 3]),
+                    )
+                    for j in range(rnd.randint(1, 5))
+                ]
+            )
+            perms_struct = util.perms_structure(perms)
+            keys = rnd.sample(KEYS, rnd.randint(0, 5))
+            instances = [
+                Serialized(
+                    "a.b.%d" % rnd.randint(1, 3),
+                    dict([(k, rnd.choice(["v", {}, {"c": 1}])) for k in keys]),
+                )
+                for j in range(rnd.randint(1, 6))
+            ]
+            self.assertEqual(
+                util.permissions_apply_to_serialized_models(
+                    instances, perms_struct, [inst.data for inst in instances]
+                ),
+                [
+                    util.permissions_apply_to_serialized_model(inst, perms_struct)
+                    for inst in instances
+                ],
+            )
+
+
+class FieldVisibilityTestCase(TestCase):
+    def visibility(self, perms, ruleset=None):
+        return util.field_visibility(
+            util.perms_structure(perms), Group, fields=["id", "name"], ruleset=ruleset
+        )
+
+    def test_fields(self):
+        vis = self.visibility(
+            {"auth.group": constants.PERM_READ, "auth.group.*.id": constants.PERM_DENY}
+        )
+        self.assertEqual(vis.visible, {"name"})
+        self.assertEqual(vis.hidden, {"id"})
+        self.assertEqual(vis.dependent, set())
+        self.assertEqual(vis.apply({"id": 1, "name": "a"}), {"name": "a"})
+        self.assertEqual(vis.apply({"id": 1, "other": "a"}), None)
+
+    def test_ids(self):
+        vis = self.visibility(
+            {"auth.group": constants.PERM_READ, "auth.*.2.name": constants.PERM_DENY}
+        )
+        self.assertEqual(vis.ids, {"2"})
+        self.assertEqual(vis.visible, {"id", "name"})
+        self.assertTrue(vis.applies(["auth", "group", "1"]))
+        self.assertFalse(vis.applies(["auth", "group", "2"]))
+        self.assertFalse(vis.applies(["auth", "user", "1"]))
+
+    def test_dependent(self):
+        vis = self.visibility(
+            {
+                "auth.group": constants.PERM_READ,
+                "auth.group.*.name.a": constants.PERM_DENY,
+            },
+            ruleset={"list-handlers": {"id": {"namespace": namespace_builder}}},
+        )
+        self.assertEqual(vis.dependent, {"id", "name"})
+        self.assertEqual(vis.apply({"name": "a"}), None)
+
+    def test_require(self):
+        vis = self.visibility(
+            {"auth.group": constants.PERM_READ, "auth.group.*.id": constants.PERM_READ},
+            ruleset={
+                "require": {"id": constants.PERM_READ, "name": constants.PERM_READ}
+            },
+        )
+        self.assertEqual(vis.hidden, {"name"})
+        # empty dicts are removed by the rule on the field
+        self.assertEqual(vis.fields["id"], (True, False, True))
+        self.assertEqual(vis.apply({"id": 1, "name": "a"}), {"id": 1})
+        self.assertEqual(vis.apply({"id": {}, "name": "a"}), {})
@@ -0,0 +1,153 @@
+import asyncio
+from unittest import mock
+
+from asgiref.sync import async_to_sync
+from django.contrib.auth.models import Group, User
+from django.core.exceptions import ImproperlyConfigured
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+from rest_framework.views import APIView
+
+from django_namespace_perms import cache, context, constants, util
+from django_namespace_perms.middleware import PermissionContextMiddleware
+from django_namespace_perms.models import GroupPermission, UserPermission
+from django_namespace_perms.rest import AsyncBasePermission
+
+
+###############################################################################
+
+
+class AsyncTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="async_user")
+        UserPermission.objects.create(
+            user=self.user, namespace="a", permissions=constants.PERM_READ
+        )
+
+    def tearDown(self):
+        context.deactivate()
+
+    def test_aload_perms(self):
+        user = User.objects.get(id=self.user.id)
+        perms = async_to_sync(util.aload_perms)(user)
+        self.assertEqual(perms, {"a": constants.PERM_READ})
+        self.assertIs(user._nsp_perms, perms)
+
+        # loaded perms are not loaded again
+        with self.assertNumQueries(0):
+            self.assertIs(async_to_sync(util.aload_perms)(user), perms)
+
+    @override_settings(NSP_CACHE="lru")
+    def test_aload_perms_cached(self):
+        cache._lru = None
+        group = Group.objects.create(name="async_group")
+        self.user.groups.add(group)
+        GroupPermission.objects.create(
+            group=group, namespace="g", permissions=constants.PERM_WRITE
+        )
+
+        user = User.objects.get(id=self.user.id)
+        perms = async_to_sync(util.aload_perms)(user)
+        self.assertEqual(perms, {"a": constants.PERM_READ, "g": constants.PERM_WRITE})
+        self.assertEqual(perms, util.load_perms(User.objects.get(id=self.user.id)))
+
+        # cached layers are used without leaving the event loop
+        ctx = context.PermissionContext(metrics=True)
+        context.activate(ctx)
+        user = User(id=self.user.id, username=self.user.username)
+        with self.assertNumQueries(0):
+            with mock.patch("asgiref.sync.sync_to_async") as sync_to_async:
+                self.assertEqual(async_to_sync(util.aload_perms)(user), perms)
+        self.assertEqual(sync_to_async.call_count, 0)
+        self.assertEqual(ctx.stats["cache_hits"], 2)
+
+    def test_ahas_perms(self):
+        user = User.objects.get(id=self.user.id)
+        self.assertEqual(
+            async_to_sync(util.ahas_perms)(user, "a.b", constants.PERM_READ), True
+        )
+        self.assertEqual(
+            async_to_sync(util.ahas_perms)(user, "a.b", constants.PERM_WRITE), False
+        )
+        self.assertEqual(
+            async_to_sync(util.ahas_perms_many)(
+                user, ["a", "b", "a.c"], constants.PERM_READ
+            ),
+            [True, False, True],
+        )
+        self.assertEqual(
+            async_to_sync(util.ahas_perms)(
+                {"a": constants.PERM_READ}, "a", constants.PERM_READ
+            ),
+            True,
+        )
+
+    def test_context(self):
+        ctx = context.PermissionContext(metrics=True)
+        context.activate(ctx)
+
+        async def check():
+            for i in range(3):
+                user = User(id=self.user.id, username=self.user.username)
+                await util.ahas_perms(user, "a", constants.PERM_READ)
+
+        async_to_sync(check)()
+        self.assertEqual(ctx.counters["loads"], 1)
+        self.assertEqual(ctx.stats["context_hits"], 2)
+        self.assertEqual(ctx.report()["calls"]["ahas_perms"]["count"], 3)
+
+    def test_permission_class(self):
+        request = RequestFactory().get("/")
+        request.user = User.objects.get(id=self.user.id)
+        permission = AsyncBasePermission()
+        permission.debug = mock.Mock()
+
+        ctx = context.PermissionContext(metrics=True)
+        context.activate(ctx)
+        self.assertEqual(
+            async_to_sync(permission.has_object_permission)(request, None, "a.b"),
+            True,
+        )
+        self.assertEqual(
+            async_to_sync(permission.has_object_permission)(request, None, "b"),
+            False,
+        )
+
+        # the sync permission class is not run (and measured) along with it
+        calls = ctx.report()["calls"]
+        self.assertEqual(
+            calls["rest.AsyncBasePermission.has_object_permission"]["count"], 2
+        )
+        self.assertNotIn("rest.BasePermission.has_object_permission", calls)
+        self.assertEqual(permission.debug.call_count, 0)
+
+    def test_permission_class_sync_view(self):
+        request = RequestFactory().get("/")
+        request.user = User.objects.get(id=self.user.id)
+        permission = AsyncBasePermission()
+        self.assertTrue(asyncio.iscoroutinefunction(permission.has_permission))
+        self.assertTrue(asyncio.iscoroutinefunction(permission.has_object_permission))
+
+        # a sync view does not get a (truthy) coroutine
+        view = APIView()
+        view.get_permissions = lambda: [permission]
+        with self.assertRaises(ImproperlyConfigured):
+            view.check_permissions(request)
+        with self.assertRaises(ImproperlyConfigured):
+            view.check_object_permissions(request, "b")
+
+    def test_middleware(self):
+        async def view(request):
+            user = User(id=self.user.id, username=self.user.username)
+            await util.ahas_perms(user, "a", constants.PERM_READ)
+            await util.ahas_perms(user, "a.b", constants.PERM_READ)
+            self.assertIs(context.current(), request.nsp_context)
+            return HttpResponse("ok")
+
+        middleware = PermissionContextMiddleware(view)
+        self.assertTrue(asyncio.iscoroutinefunction(middleware))
+
+        request = RequestFactory().get("/")
+        async_to_sync(middleware)(request)
+        self.assertEqual(request.nsp_context.counters["loads"], 1)
+        self.assertEqual(context.current(), None)
@@ -0,0 +1,112 @@
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+
+from django_namespace_perms import util, constants
+from django_namespace_perms.auth.backends import NSPBackend
+from django_namespace_perms.models import UserPermission
+
+
+###############################################################################
+
+
+class NSPBackendTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="backend_user")
+        UserPermission.objects.create(
+            user=self.user, namespace="app.model", permissions=constants.PERM_READ
+        )
+        UserPermission.objects.create(
+            user=self.user,
+            namespace="app.model.change",
+            permissions=constants.PERM_WRITE,
+        )
+        self.backend = NSPBackend()
+
+    def test_permcode_memoized(self):
+        rv = util.permcode_to_namespace("app.add_model")
+        self.assertIs(util.permcode_to_namespace("app.add_model"), rv)
+        with override_settings(NSP_MODE="crud"):
+            self.assertEqual(
+                util.permcode_to_namespace("app.add_model"),
+                ("app.model.add", constants.PERM_CREATE),
+            )
+        self.assertEqual(
+            util.permcode_to_namespace("app.add_model"),
+            ("app.model.add", constants.PERM_WRITE),
+        )
+
+    def test_has_perms_batch(self):
+        perm_list = [
+            "app.view_model",
+            "app.add_model",
+            "app.change_model",
+            "app.delete_model",
+            "other.view_model",
+        ]
+        expected = [True, False, True, False, False]
+        self.assertEqual(self.backend.has_perms_batch(self.user, perm_list), expected)
+        self.assertEqual(
+            [self.backend.has_perm(self.user, perm) for perm in perm_list], expected
+        )
+        self.assertEqual(self.backend.has_perms_batch(self.user, []), [])
+
+        self.user.is_superuser = True
+        self.assertEqual(
+            self.backend.has_perms_batch(self.user, perm_list),
+            [True for perm in perm_list],
+        )
+
+    def test_has_perms_batch_write_ops(self):
+        UserPermission.objects.create(
+            user=self.user,
+            namespace="app.model.publish",
+            permissions=constants.PERM_WRITE,
+        )
+
+        class Model(object):
+            def nsp_write_ops(self):
+                return ["publish"]
+
+        perm_list = ["app.publish_model", "app.view_model", "app.change_model"]
+        user = User.objects.get(id=self.user.id)
+        for obj, expected in (
+            (None, [False, True, True]),
+            (Model(), [True, True, True]),
+        ):
+            self.assertEqual(
+                self.backend.has_perms_batch(user, perm_list, obj), expected
+            )
+            self.assertEqual(
+                [self.backend.has_perm(user, perm, obj) for perm in perm_list], expected
+            )
+
+    def test_permcode_bounded(self):
+        for i in range(util.PERMCODES_SIZE + 1):
+            util.permcode_to_namespace("app.view_model%d" % i)
+        self.assertLessEqual(len(util.PERMCODES), util.PERMCODES_SIZE)
+
+    def test_has_perms_batch_load_perms(self):
+        class Backend(NSPBackend):
+            def load_perms(self, user_obj):
+                return {"app.model.add": constants.PERM_WRITE}
+
+        self.assertEqual(
+            Backend().has_perms_batch(self.user, ["app.add_model", "app.view_model"]),
+            [True, False],
+        )
+
+    def test_has_module_perms(self):
+        self.assertEqual(self.backend.has_module_perms(self.user, "app"), True)
+        self.assertEqual(self.backend.has_module_perms(self.user, "other"), False)
+
+    def test_has_module_perms_nsp_namespace(self):
+        class Module(object):
+            def nsp_namespace(self):
+                return "app"
+
+        class Broken(object):
+            nsp_namespace = "app"
+
+        self.assertEqual(self.backend.has_module_perms(self.user, Module()), True)
+        with self.assertRaises(Exception):
+            self.backend.has_module_perms(self.user, Broken())
@@ -0,0 +1,330 @@
+import random
+import threading
+import time
+from unittest import mock
+
+from django.contrib.auth.models import AnonymousUser, User, Group
+from django.core.exceptions import ImproperlyConfigured
+from django.db import transaction
+from django.test import TransactionTestCase, override_settings
+
+from django_namespace_perms import util, constants, cache
+from django_namespace_perms.models import UserPermission, GroupPermission
+from django_namespace_perms.query import users_with_perms
+from django_namespace_perms.structure import CompactStructure
+
+from .helpers import random_data, random_perms
+
+
+###############################################################################
+
+
+@override_settings(NSP_CACHE="lru")
+class CacheTestCase(TransactionTestCase):
+    def setUp(self):
+        cache._lru = None
+        self.user = User.objects.create_user(username="cache_user")
+        self.group = Group.objects.create(name="cache_group")
+        self.user.groups.add(self.group)
+        UserPermission.objects.create(
+            user=self.user, namespace="a.b", permissions=constants.PERM_READ
+        )
+        GroupPermission.objects.create(
+            group=self.group, namespace="g", permissions=constants.PERM_READ
+        )
+
+    def load(self):
+        # fresh user object, like on a new request
+        return util.load_perms(User.objects.get(id=self.user.id))
+
+    def load_cached(self):
+        # fresh user object without fetching it from the database
+        user = User(id=self.user.id, username=self.user.username)
+        return util.load_perms(user)
+
+    def test_lru_eviction(self):
+        lru = cache.LRUCache(max_size=2)
+        lru.set("a", 1)
+        lru.set("b", 2)
+        lru.get("a")
+        lru.set("c", 3)
+        self.assertEqual(lru.get("a"), 1)
+        self.assertEqual(lru.get("b"), None)
+        self.assertEqual(lru.get("c"), 3)
+
+    def test_lru_timeout(self):
+        lru = cache.LRUCache()
+        lru.set("a", 1, 10)
+        lru.set("b", 2)
+        lru.set("c", 3, 0)
+        now = time.monotonic()
+        with mock.patch.object(cache.time, "monotonic", return_value=now + 11):
+            self.assertEqual(lru.get("a"), None)
+            self.assertEqual(lru.get("b"), 2)
+            self.assertEqual(lru.get("c"), None)
+        self.assertNotIn("a", lru.data)
+
+    def test_single_flight(self):
+        backend = cache.LRUCache()
+        calls = []
+        started = threading.Event()
+        release = threading.Event()
+        results = []
+
+        def load():
+            calls.append(1)
+            started.set()
+            release.wait(5)
+            return {"a": 1}
+
+        def run():
+            results.append(cache.get_or_load(backend, "key", load))
+
+        threads = [threading.Thread(target=run) for i in range(8)]
+        threads[0].start()
+        started.wait(5)
+        for thread in threads[1:]:
+            thread.start()
+        # give the others time to queue up behind the first load
+        time.sleep(0.05)
+        release.set()
+        for thread in threads:
+            thread.join(5)
+
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(len(results), 8)
+        for result in results:
+            self.assertIs(result, results[0])
+        self.assertEqual(cache._flights.calls, {})
+
+    def test_single_flight_error(self):
+        flights = cache.SingleFlight()
+
+        def fail():
+            raise ValueError()
+
+        with self.assertRaises(ValueError):
+            flights.do("key", fail)
+        self.assertEqual(flights.do("key", lambda: 1), 1)
+
+    def test_load_perms_cached(self):
+        self.assertEqual(self.load(), {"a.b": 1, "g": 1})
+        user = User.objects.get(id=self.user.id)
+        with self.assertNumQueries(0):
+            util.load_perms(user)
+        self.assertEqual(user._nsp_perms_struct["a"]["b"], constants.PERM_READ)
+
+    @override_settings(NSP_CACHE_TIMEOUT=10)
+    def test_load_perms_timeout(self):
+        self.load()
+        with self.assertNumQueries(0):
+            self.load_cached()
+        now = time.monotonic()
+        with mock.patch.object(cache.time, "monotonic", return_value=now + 11):
+            with self.assertNumQueries(3):
+                self.load_cached()
+
+    def test_invalidate_user_permission(self):
+        self.load()
+        perm = UserPermission.objects.create(
+            user=self.user, namespace="c", permissions=constants.PERM_WRITE
+        )
+        self.assertEqual(self.load()["c"], constants.PERM_WRITE)
+        perm.delete()
+        self.assertNotIn("c", self.load())
+
+    def test_invalidate_group_permission(self):
+        self.load()
+        perm = GroupPermission.objects.create(
+            group=self.group, namespace="h", permissions=constants.PERM_READ
+        )
+        self.assertIn("h", self.load())
+        perm.delete()
+        self.assertNotIn("h", self.load())
+
+    def test_invalidate_group_membership(self):
+        self.load()
+        self.user.groups.remove(self.group)
+        self.assertNotIn("g", self.load())
+        self.group.user_set.add(self.user)
+        self.assertIn("g", self.load())
+        self.group.user_set.clear()
+        self.assertNotIn("g", self.load())
+
+    def test_invalidate_guest_group_rename(self):
+        guest = Group.objects.create(name=util.guest_group_name())
+        GroupPermission.objects.create(
+            group=guest, namespace="guest", permissions=constants.PERM_READ
+        )
+        self.assertIn("guest", util.load_perms(AnonymousUser()))
+
+        guest.name = "former_guest"
+        guest.save()
+        self.assertEqual(util.load_perms(AnonymousUser()), {})
+
+    def test_rollback(self):
+        self.load()
+        with self.assertRaises(ValueError):
+            with transaction.atomic():
+                GroupPermission.objects.create(
+                    group=self.group, namespace="secret", permissions=15
+                )
+                UserPermission.objects.create(
+                    user=self.user, namespace="mine", permissions=15
+                )
+                self.assertEqual(
+                    self.load(), {"a.b": 1, "g": 1, "secret": 15, "mine": 15}
+                )
+                raise ValueError()
+        self.assertEqual(self.load(), {"a.b": 1, "g": 1})
+
+    def test_savepoint_rollback(self):
+        with transaction.atomic():
+            UserPermission.objects.create(user=self.user, namespace="c", permissions=1)
+            self.assertEqual(self.load(), {"a.b": 1, "c": 1, "g": 1})
+            try:
+                with transaction.atomic():
+                    UserPermission.objects.create(
+                        user=self.user, namespace="d", permissions=1
+                    )
+                    self.assertEqual(self.load(), {"a.b": 1, "c": 1, "d": 1, "g": 1})
+                    raise ValueError()
+            except ValueError:
+                pass
+            self.assertEqual(self.load(), {"a.b": 1, "c": 1, "g": 1})
+        self.assertEqual(self.load(), {"a.b": 1, "c": 1, "g": 1})
+        with self.assertNumQueries(0):
+            self.load_cached()
+
+    def test_commit_bumps_version(self):
+        key = cache.version_key(cache.user_scope(self.user.id))
+        backend = cache.get_backend()
+        with transaction.atomic():
+            UserPermission.objects.create(user=self.user, namespace="c", permissions=1)
+            version = backend.get(key)
+            # layers loaded in the transaction are not shared yet
+            self.load()
+            self.assertEqual(len([k for k in backend.data if k.startswith("nsp:user:")]), 0)
+        self.assertNotEqual(backend.get(key), version)
+
+    def test_group_layer_shared(self):
+        GroupPermission.objects.create(
+            group=self.group, namespace="s.t", permissions=constants.PERM_READ
+        )
+        other = User.objects.create_user(username="cache_user_2")
+        other.groups.add(self.group)
+        util.load_perms(other)
+        user = User.objects.get(id=self.user.id)
+        util.load_perms(user)
+
+        # other has no rules of their own and gets the shared group layer
+        group_permdict, group_struct = util.load_group_layer(
+            (self.group.id,), cache.get_backend()
+        )
+        self.assertIsInstance(group_struct, CompactStructure)
+        self.assertIs(other._nsp_perms_struct, group_struct)
+        self.assertIs(util.perms_matcher(other), group_struct)
+        self.assertIs(
+            user._nsp_perms_struct["s"], util.expanded_structure(group_struct)["s"]
+        )
+        self.assertEqual(group_permdict, {"g": 1, "s.t": 1})
+        self.assertEqual(
+            util.permissions_apply({"s": {"t": 1, "u": 2}, "x": 3}, other),
+            {"s": {"t": 1}},
+        )
+        self.assertEqual(
+            user._nsp_perms_struct, util.perms_structure(user._nsp_perms)
+        )
+
+    def test_group_layer_not_modified(self):
+        other = User.objects.create_user(username="cache_user_2")
+        other.groups.add(self.group)
+        third = User.objects.create_user(username="cache_user_3")
+        third.groups.add(self.group)
+
+        perms = util.load_perms(other)
+        perms["secret"] = constants.PERM_CRUD
+        self.assertEqual(util.load_perms(third), {"g": constants.PERM_READ})
+        self.assertEqual(
+            util.load_group_layer((self.group.id,), cache.get_backend())[0],
+            {"g": constants.PERM_READ},
+        )
+
+    def test_equivalence_uncached(self):
+        rnd = random.Random(1)
+        other = Group.objects.create(name="cache_group_2")
+        self.user.groups.add(other)
+        for i in range(40):
+            UserPermission.objects.all().delete()
+            GroupPermission.objects.all().delete()
+            for group in (self.group, other):
+                for ns, p in random_perms(rnd, rnd.randint(0, 5)).items():
+                    GroupPermission.objects.create(
+                        group=group, namespace=ns, permissions=p
+                    )
+            for ns, p in random_perms(rnd, rnd.randint(0, 3)).items():
+                UserPermission.objects.create(
+                    user=self.user, namespace=ns, permissions=p
+                )
+            manual = random_perms(rnd, rnd.randint(0, 3))
+            data = random_data(rnd, 3)
+
+            results = []
+            for name in ("lru", None):
+                with override_settings(NSP_CACHE=name):
+                    user = User.objects.get(id=self.user.id)
+                    user.nsp_manual = manual
+                    results.append(
+                        (
+                            list(util.load_perms(user).items()),
+                            util.permissions_apply(data, user),
+                        )
+                    )
+            self.assertEqual(results[0], results[1])
+
+    def test_group_rule_order(self):
+        # conflicting group rules resolve by GroupPermission id, not by group
+        other = Group.objects.create(name="cache_group_2")
+        self.user.groups.add(other)
+        GroupPermission.objects.create(group=other, namespace="c", permissions=0)
+        GroupPermission.objects.create(
+            group=self.group, namespace="c", permissions=constants.PERM_READ
+        )
+        for name in ("lru", None):
+            with override_settings(NSP_CACHE=name):
+                user = User.objects.get(id=self.user.id)
+                self.assertEqual(util.load_perms(user)["c"], constants.PERM_READ)
+        user = User.objects.get(id=self.user.id)
+        self.assertEqual(util.load_perms_bulk([user])[0]["c"], constants.PERM_READ)
+        self.assertEqual(list(users_with_perms("c", constants.PERM_READ)), [self.user])
+
+    def test_nsp_manual_order(self):
+        GroupPermission.objects.create(group=self.group, namespace="*.*", permissions=0)
+        UserPermission.objects.all().delete()
+        GroupPermission.objects.filter(namespace="g").delete()
+        data = {"b": {"b": {"2": "x"}}}
+        for name in ("lru", None):
+            with override_settings(NSP_CACHE=name):
+                user = User.objects.get(id=self.user.id)
+                user.nsp_manual = {"b.b": 3}
+                self.assertEqual(util.permissions_apply(data, user), {"b": {}})
+
+    def test_nsp_manual(self):
+        user = User.objects.get(id=self.user.id)
+        user.nsp_manual = {"g": constants.PERM_WRITE, "m": constants.PERM_WRITE}
+        self.assertEqual(
+            util.load_perms(user),
+            {"a.b": constants.PERM_READ, "g": constants.PERM_READ, "m": 2},
+        )
+
+    @override_settings(NSP_CACHE="missing")
+    def test_unknown_alias(self):
+        with self.assertRaises(ImproperlyConfigured):
+            cache.get_backend()
+
+    @override_settings(NSP_CACHE=None)
+    def test_disabled(self):
+        self.assertEqual(cache.get_backend(), None)
+        self.load()
+        with self.assertNumQueries(2):
+            util.load_perms(User.objects.get(id=self.user.id))
@@ -0,0 +1,57 @@
+import random
+
+from django.test import TestCase
+
+from django_namespace_perms import util
+
+from . import test_nsp
+from .helpers import random_path, random_perms
+
+
+###############################################################################
+
+
+SEGMENTS = ["a", "b", "ab", "1", "*", "a*", "*b", "", "+"]
+
+
+class CheckPermsTestCase(TestCase):
+    def test_equivalence_fixture(self):
+        perms = dict(test_nsp.NSPTestCase.perms)
+        for ns in list(perms.keys()) + ["a.b.c.d", "x.y.z.c", "e.a", "a.*"]:
+            for ambiguous in (False, True):
+                self.assertEqual(
+                    util.check_perms(perms, ns, ambiguous=ambiguous),
+                    util.check_perms_legacy(perms, ns, ambiguous=ambiguous),
+                )
+
+    def test_equivalence_random(self):
+        rnd = random.Random(1)
+        for i in range(300):
+            perms = random_perms(
+                rnd, rnd.randint(0, 12), levels=(0, 1, 2, 3), segments=SEGMENTS
+            )
+            for j in range(10):
+                ns = random_path(rnd, 5, SEGMENTS)
+                ambiguous = rnd.random() < 0.5
+                self.assertEqual(
+                    util.check_perms(perms, ns, ambiguous=ambiguous),
+                    util.check_perms_legacy(perms, ns, ambiguous=ambiguous),
+                    "%s %s ambiguous=%s" % (perms, ns, ambiguous),
+                )
+
+    def test_automaton_cached(self):
+        perms = {"a.*": 1, "a.b": 3}
+        automaton = util.perms_automaton(perms)
+        self.assertIs(util.perms_automaton(perms), automaton)
+        self.assertIsNot(util.perms_automaton(dict(perms)), automaton)
+        self.assertEqual(util.check_perms(perms, "a.c"), 1)
+
+        updated = dict(perms)
+        updated["a.c"] = 0
+        self.assertEqual(util.check_perms(updated, "a.c"), 0)
+        self.assertEqual(util.check_perms(perms, "a.c"), 1)
+
+        # changes made to a dict after it was compiled are seen
+        perms["a.c"] = 0
+        self.assertEqual(util.check_perms(perms, "a.c"), 0)
+        self.assertIsNot(util.perms_automaton(perms), automaton)
@@ -0,0 +1,140 @@
+from unittest import mock
+
+from django.contrib.auth.models import User
+from django.http import HttpResponse
+from django.test import RequestFactory, TestCase, override_settings
+
+from django_namespace_perms import context, constants, util
+from django_namespace_perms.auth.backends import NSPBackend
+from django_namespace_perms.middleware import (
+    PermissionContextMiddleware,
+    format_metrics,
+)
+from django_namespace_perms.models import UserPermission
+
+
+###############################################################################
+
+
+class PermissionContextTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="context_user")
+        UserPermission.objects.create(
+            user=self.user, namespace="a", permissions=constants.PERM_READ
+        )
+
+    def tearDown(self):
+        context.deactivate()
+
+    def test_load_perms_keeps_struct(self):
+        user = User.objects.get(id=self.user.id)
+        util.load_perms(user)
+        struct = user._nsp_perms_struct
+        util.has_perms(user, "a", constants.PERM_READ)
+        matcher = user._nsp_perms_matcher
+        with self.assertNumQueries(0):
+            util.load_perms(user)
+        self.assertIs(user._nsp_perms_struct, struct)
+        self.assertIs(util.perms_matcher(user), matcher)
+
+        # replaced perms are built again
+        user._nsp_perms = {"b": constants.PERM_READ}
+        self.assertEqual(util.has_perms(user, "b", constants.PERM_READ), True)
+        self.assertEqual(util.has_perms(user, "a", constants.PERM_READ), False)
+
+    @override_settings(NSP_CONTEXT_HEADER=True)
+    def test_middleware(self):
+        backend = NSPBackend()
+
+        def view(request):
+            # different objects for the same user share the context
+            for i in range(3):
+                user = User.objects.get(id=self.user.id)
+                self.assertEqual(util.has_perms(user, "a.b", constants.PERM_READ), True)
+                self.assertEqual(backend.has_perm(user, "a.view_b"), True)
+            return HttpResponse("ok")
+
+        request = RequestFactory().get("/")
+        response = PermissionContextMiddleware(view)(request)
+        self.assertEqual(
+            request.nsp_context.counters, {"loads": 1, "builds": 1, "compiles": 1}
+        )
+        self.assertEqual(response["X-NSP-Perms"], "builds=1; compiles=1; loads=1")
+        self.assertEqual(context.current(), None)
+
+    def test_invalidate(self):
+        context.activate(context.PermissionContext())
+        util.load_perms(User.objects.get(id=self.user.id))
+        UserPermission.objects.create(
+            user=self.user, namespace="c", permissions=constants.PERM_READ
+        )
+        self.assertIn("c", util.load_perms(User.objects.get(id=self.user.id)))
+        self.assertEqual(context.current().counters["loads"], 2)
+
+
+REPORTED = []
+
+
+def sink(request, metrics):
+    REPORTED.append((request, metrics))
+
+
+class MetricsTestCase(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username="metrics_user")
+        UserPermission.objects.create(
+            user=self.user, namespace="a", permissions=constants.PERM_READ
+        )
+        del REPORTED[:]
+
+    def view(self, request):
+        for i in range(2):
+            user = User.objects.get(id=self.user.id)
+            util.has_perms(user, "a.b", constants.PERM_READ)
+        util.permissions_apply({"a": 1, "b": 2}, user)
+        return HttpResponse("ok")
+
+    @override_settings(NSP_METRICS=True, NSP_METRICS_SINK="tests.test_context.sink")
+    def test_sink(self):
+        request = RequestFactory().get("/")
+        PermissionContextMiddleware(self.view)(request)
+        self.assertEqual(len(REPORTED), 1)
+        self.assertIs(REPORTED[0][0], request)
+
+        metrics = REPORTED[0][1]
+        self.assertEqual(metrics["counters"]["loads"], 1)
+        self.assertEqual(metrics["stats"], {"context_hits": 1, "rules": 1})
+        self.assertEqual(metrics["calls"]["has_perms"]["count"], 2)
+        self.assertEqual(metrics["calls"]["load_perms"]["count"], 3)
+        self.assertEqual(metrics["calls"]["permissions_apply"]["count"], 1)
+        self.assertEqual(metrics["calls"]["perms_structure"]["count"], 1)
+        self.assertGreater(metrics["calls"]["has_perms"]["time"], 0)
+
+        self.assertIn("context_hits=1", format_metrics(metrics))
+        self.assertIn("has_perms=2/", format_metrics(metrics))
+
+    @override_settings(NSP_METRICS=True, NSP_METRICS_SINK="tests.test_context.sink")
+    def test_sink_resolved_once(self):
+        middleware = PermissionContextMiddleware(self.view)
+        self.assertIs(middleware.sink, sink)
+        with mock.patch("django_namespace_perms.middleware.import_string") as resolve:
+            for i in range(2):
+                middleware(RequestFactory().get("/"))
+        self.assertEqual(resolve.call_count, 0)
+        self.assertEqual(len(REPORTED), 2)
+
+    @override_settings(NSP_METRICS=True)
+    def test_logging(self):
+        request = RequestFactory().get("/path")
+        with self.assertLogs("django_namespace_perms.middleware", "INFO") as logs:
+            PermissionContextMiddleware(self.view)(request)
+        self.assertIn(
+            "NSP metrics GET /path builds=1 compiles=1 loads=1", logs.output[0]
+        )
+
+    def test_disabled(self):
+        request = RequestFactory().get("/")
+        PermissionContextMiddleware(self.view)(request)
+        self.assertEqual(request.nsp_context.calls, {})
+        self.assertEqual(request.nsp_context.stats, {})
+        self.assertEqual(request.nsp_context.counters["loads"], 1)
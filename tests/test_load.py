@@ -0,0 +1,67 @@
+from django.contrib.auth.models import AnonymousUser, User, Group
+from django.test import TestCase
+
+from django_namespace_perms import util, constants
+from django_namespace_perms.models import UserPermission, GroupPermission
+
+
+###############################################################################
+
+
+class LoadPermsTestCase(TestCase):
+    def setUp(self):
+        self.groups = [Group.objects.create(name="group %d" % i) for i in range(3)]
+        self.guest = Group.objects.create(name=util.guest_group_name())
+        self.users = []
+        for i in range(4):
+            user = User.objects.create_user(username="load_user_%d" % i)
+            user.groups.add(*self.groups[: i % 3 + 1])
+            UserPermission.objects.create(
+                user=user, namespace="u.%d" % i, permissions=constants.PERM_READ
+            )
+            UserPermission.objects.create(
+                user=user, namespace="g", permissions=constants.PERM_WRITE
+            )
+            self.users.append(user)
+
+        for i, group in enumerate(self.groups):
+            GroupPermission.objects.create(
+                group=group, namespace="g", permissions=constants.PERM_READ
+            )
+            GroupPermission.objects.create(
+                group=group, namespace="g.%d" % i, permissions=i
+            )
+        GroupPermission.objects.create(
+            group=self.guest, namespace="guest", permissions=constants.PERM_READ
+        )
+
+    def fresh(self):
+        users = [User.objects.get(id=user.id) for user in self.users]
+        return users + [AnonymousUser()]
+
+    def test_single_query(self):
+        user = self.fresh()[1]
+        with self.assertNumQueries(1):
+            perms = util.load_perms(user)
+        self.assertEqual(
+            perms,
+            {"u.1": 1, "g": constants.PERM_WRITE, "g.0": 0, "g.1": 1},
+        )
+
+        with self.assertNumQueries(1):
+            perms = util.load_perms(AnonymousUser())
+        self.assertEqual(perms, {"guest": constants.PERM_READ})
+
+    def test_bulk(self):
+        expected = [util.load_perms(user) for user in self.fresh()]
+        users = self.fresh()
+        with self.assertNumQueries(2):
+            perms = util.load_perms_bulk(users)
+        self.assertEqual(perms, expected)
+        for user, permdict in zip(users, perms):
+            self.assertIs(user._nsp_perms, permdict)
+            self.assertEqual(user._nsp_perms_struct, util.perms_structure(permdict))
+
+    def test_bulk_empty(self):
+        with self.assertNumQueries(0):
+            self.assertEqual(util.load_perms_bulk([]), [])
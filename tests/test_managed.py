@@ -0,0 +1,118 @@
+from django.contrib.auth.models import User, Group
+from django.db import transaction
+from django.db.models.signals import post_save, pre_delete
+from django.test import TestCase, TransactionTestCase
+
+from django_namespace_perms import constants, models
+from django_namespace_perms.models import UserGroup, UserPermission
+
+
+###############################################################################
+
+
+class ManagedPermsMixin(object):
+
+    defer = False
+
+    def setUp(self):
+        UserGroup.nsp_managed = ("user", constants.PERM_READ)
+        models.managed_perms(UserGroup, defer=self.defer)
+        self.users = [
+            User.objects.create_user(username="managed%d" % i) for i in range(3)
+        ]
+        self.group = Group.objects.create(name="managed")
+
+    def tearDown(self):
+        for func in (models.managed_perms_create, models.managed_perms_create_deferred):
+            post_save.disconnect(func, sender=UserGroup)
+        for func in (models.managed_perms_remove, models.managed_perms_remove_deferred):
+            pre_delete.disconnect(func, sender=UserGroup)
+        del UserGroup.nsp_managed
+
+    def rules(self):
+        return sorted(
+            UserPermission.objects.filter(
+                namespace__startswith="django_namespace_perms.usergroup."
+            ).values_list("user_id", "namespace")
+        )
+
+    def expected(self, instances):
+        return sorted(
+            [
+                (inst.user_id, "django_namespace_perms.usergroup.%d" % inst.id)
+                for inst in instances
+            ]
+        )
+
+
+class ManagedPermsTestCase(ManagedPermsMixin, TestCase):
+    def test_signals(self):
+        inst = UserGroup.objects.create(user=self.users[0], group=self.group)
+        self.assertEqual(self.rules(), self.expected([inst]))
+        inst.delete()
+        self.assertEqual(self.rules(), [])
+
+    def test_bulk(self):
+        instances = [
+            UserGroup(id=i + 1, user=user, group=self.group)
+            for i, user in enumerate(self.users)
+        ]
+        UserGroup.objects.bulk_create(instances)
+        with self.assertNumQueries(1):
+            models.managed_perms_bulk_create(instances)
+        self.assertEqual(self.rules(), self.expected(instances))
+
+        models.managed_perms_bulk_remove(instances[:2])
+        self.assertEqual(self.rules(), self.expected(instances[2:]))
+
+
+class ManagedPermsDeferredTestCase(ManagedPermsMixin, TransactionTestCase):
+
+    defer = True
+
+    def test_deferred(self):
+        with transaction.atomic():
+            instances = [
+                UserGroup.objects.create(user=user, group=self.group)
+                for user in self.users
+            ]
+            instances[0].delete()
+            self.assertEqual(self.rules(), [])
+
+            # rolled back changes are dropped along with their savepoint
+            try:
+                with transaction.atomic():
+                    UserGroup.objects.create(user=self.users[0], group=self.group)
+                    raise ValueError()
+            except ValueError:
+                pass
+
+        self.assertEqual(self.rules(), self.expected(instances[1:]))
+
+        # outside of transactions changes are applied right away
+        instances[1].delete()
+        self.assertEqual(self.rules(), self.expected(instances[2:]))
+
+    def test_deferred_order(self):
+        with transaction.atomic():
+            inst = UserGroup.objects.create(user=self.users[0], group=self.group)
+            inst_id = inst.id
+            with transaction.atomic():
+                inst.delete()
+            inst = UserGroup.objects.create(
+                id=inst_id, user=self.users[0], group=self.group
+            )
+        self.assertEqual(self.rules(), self.expected([inst]))
+
+    def test_deferred_rollback(self):
+        try:
+            with transaction.atomic():
+                UserGroup.objects.create(user=self.users[0], group=self.group)
+                raise ValueError()
+        except ValueError:
+            pass
+
+        # the queue of the rolled back transaction is not reused
+        with transaction.atomic():
+            inst = UserGroup.objects.create(user=self.users[1], group=self.group)
+        self.assertEqual(self.rules(), self.expected([inst]))
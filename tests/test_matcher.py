@@ -0,0 +1,133 @@
+import random
+
+from django.contrib.auth.models import User
+from django.test import TestCase
+
+from django_namespace_perms import util, constants
+from django_namespace_perms.matcher import compile_perms, NamespaceMatcher
+from django_namespace_perms.models import UserPermission
+
+from . import test_nsp
+from .helpers import random_keys, random_perms
+
+
+###############################################################################
+
+
+class MatcherTestCase(TestCase):
+    def assert_equivalent(self, perms, namespaces):
+        struct = util.perms_structure(perms)
+        matchers = [compile_perms(perms), compile_perms(struct)]
+        for keys in namespaces:
+            for explicit in (False, True):
+                expected = util.get_perms(struct, keys, explicit=explicit).value
+                for matcher in matchers:
+                    self.assertEqual(
+                        matcher.get(keys, explicit=explicit),
+                        expected,
+                        "%s explicit=%s" % (".".join(keys), explicit),
+                    )
+
+    def test_equivalence_fixture(self):
+        perms = dict(test_nsp.NSPTestCase.perms)
+        namespaces = []
+        for ns in perms:
+            keys = ns.split(".")
+            for i in range(1, len(keys) + 1):
+                namespaces.append(keys[:i])
+                namespaces.append(keys[:i] + ["zzz"])
+                namespaces.append(keys[:i] + ["*", "c"])
+        namespaces.extend([["x", "y", "z"], ["x", "y", "z", "c"], ["l", "o", "3"]])
+        self.assert_equivalent(perms, namespaces)
+
+    def test_equivalence_random(self):
+        rnd = random.Random(1)
+        for i in range(50):
+            perms = random_perms(rnd, rnd.randint(1, 30), levels=(0, 1, 2, 3))
+            namespaces = [random_keys(rnd, 5) for j in range(50)]
+            self.assert_equivalent(perms, namespaces)
+
+    def test_get_many_random(self):
+        rnd = random.Random(2)
+        for i in range(50):
+            perms = random_perms(rnd, rnd.randint(1, 30), levels=(0, 1, 2, 3))
+            matcher = compile_perms(perms)
+            namespaces = [random_keys(rnd, 5) for j in range(50)]
+            flags = [rnd.choice([False, True]) for keys in namespaces]
+            self.assertEqual(
+                matcher.get_many(namespaces, explicit=flags),
+                [
+                    matcher.get(keys, explicit=explicit)
+                    for keys, explicit in zip(namespaces, flags)
+                ],
+            )
+
+    def test_check_ambiguous_random(self):
+        rnd = random.Random(3)
+        for i in range(50):
+            perms = random_perms(rnd, rnd.randint(1, 30), levels=(0, 1, 2, 3))
+            matcher = compile_perms(perms)
+            for j in range(50):
+                keys = random_keys(rnd, 4)
+                level = rnd.choice([1, 2, 3])
+
+                # a rule at or below the namespace grants level
+                expected = matcher.check(keys, level) or any(
+                    (p & level) == level
+                    and len(rule) >= len(keys)
+                    and all(k in ("*", r) or r == "*" for k, r in zip(keys, rule))
+                    for rule, p in [(ns.split("."), p) for ns, p in perms.items()]
+                )
+                self.assertEqual(matcher.check_ambiguous(keys, level), expected)
+
+    def test_check_ambiguous(self):
+        perms = {"a": 0, "a.b.c": 1, "x.*.y": 3, "z.c": 1, "z.d": 2}
+        matcher = compile_perms(perms)
+        self.assertEqual(matcher.check("a.b", constants.PERM_READ), False)
+        self.assertEqual(matcher.check_ambiguous("a", constants.PERM_READ), True)
+        self.assertEqual(matcher.check_ambiguous("a.b", constants.PERM_READ), True)
+        self.assertEqual(matcher.check_ambiguous("a.b", constants.PERM_WRITE), False)
+        self.assertEqual(matcher.check_ambiguous("a.c", constants.PERM_READ), False)
+        self.assertEqual(matcher.check_ambiguous("x.b", constants.PERM_WRITE), True)
+        self.assertEqual(matcher.check_ambiguous("*.b", constants.PERM_READ), True)
+        self.assertEqual(matcher.check_ambiguous("z", 3), False)
+
+        self.assertEqual(
+            util.has_perms(perms, "a.b", constants.PERM_READ, ambiguous=True), True
+        )
+        self.assertEqual(
+            util.has_perms(
+                util.perms_structure(perms), "a.b", constants.PERM_READ, ambiguous=True
+            ),
+            True,
+        )
+
+    def test_compile(self):
+        matcher = compile_perms(test_nsp.NSPTestCase.perms)
+        self.assertIsInstance(matcher, NamespaceMatcher)
+        self.assertIs(compile_perms(matcher), matcher)
+        self.assertEqual(matcher.get("a.b.c"), 3)
+        self.assertEqual(matcher.get([]), None)
+        self.assertEqual(matcher.check("a.b.c", constants.PERM_WRITE), True)
+        self.assertEqual(matcher.check("a.b.d", constants.PERM_READ), False)
+        self.assertEqual(matcher.check("zzz", constants.PERM_DENY), False)
+
+    def test_has_perms_matcher(self):
+        matcher = compile_perms(test_nsp.NSPTestCase.perms)
+        self.assertEqual(util.has_perms(matcher, "a.b", constants.PERM_READ), True)
+        self.assertEqual(
+            util.has_perms(matcher, "e.a.a", constants.PERM_READ, explicit=True),
+            False,
+        )
+
+    def test_has_perms_user(self):
+        user = User.objects.create_user(username="matcher_user")
+        UserPermission.objects.create(
+            user=user, namespace="a.b", permissions=constants.PERM_READ
+        )
+        self.assertEqual(util.has_perms(user, "a.b.c", constants.PERM_READ), True)
+        self.assertIsInstance(user._nsp_perms_matcher, NamespaceMatcher)
+        with self.assertNumQueries(0):
+            self.assertEqual(
+                util.has_perms(user, "a.b", constants.PERM_WRITE), False
+            )
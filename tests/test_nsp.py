@@ -29,6 +29,30 @@ class ModelTestB(models.Model):
     deniedField = models.CharField(max_length=255)
 
 
+class ModelTestE(models.Model):
+    class Meta:
+        managed = False
+        app_label = "tests"
+
+    name = models.CharField(max_length=255)
+
+    @property
+    def nsp_namespace(self):
+        return "test.%s" % self.name
+
+
+class ModelTestF(models.Model):
+    class Meta:
+        managed = False
+        app_label = "tests"
+
+    nsp_namespace_memoize = True
+
+    @property
+    def nsp_namespace(self):
+        return "test.django_namespace_perms.modeltestf.1"
+
+
 class ModelTestC(models.Model):
     class Meta:
         managed = False
@@ -125,6 +149,50 @@ class NSPTestCase(TestCase):
         namespace = util.obj_to_namespace(obj)
         self.assertEqual(namespace, "tests.modeltestb.1")
 
+    def test_namespace_memoized(self):
+        obj = ModelTestF()
+        obj.id = 1
+        self.assertEqual(
+            util.obj_to_namespace(obj), "test.django_namespace_perms.modeltestf.1"
+        )
+        self.assertEqual(
+            obj._nsp_namespace, (1, "test.django_namespace_perms.modeltestf.1")
+        )
+
+        # memo is keyed by id
+        obj._nsp_namespace = (1, "memoized")
+        self.assertEqual(util.obj_to_namespace(obj), "memoized")
+        obj.id = 2
+        self.assertEqual(
+            util.obj_to_namespace(obj), "test.django_namespace_perms.modeltestf.1"
+        )
+
+        # not memoized by default
+        obj = ModelTestE(name="A")
+        obj.id = 1
+        self.assertEqual(util.obj_to_namespace(obj), "test.a")
+        obj.name = "B"
+        self.assertEqual(util.obj_to_namespace(obj), "test.b")
+
+    def test_namespace_strategies(self):
+        obj = ModelTestB()
+        obj.id = "ABC"
+        field = ModelTestB._meta.get_field("allowedField")
+        for value in [obj, [obj, "Field"], field, "A.B", ModelTestB, 1]:
+            self.assertEqual(
+                util.obj_to_namespace(value), util.obj_to_namespace_generic(value)
+            )
+
+    def test_namespace_strategies_bounded(self):
+        size = util.NAMESPACE_STRATEGIES_SIZE
+        util.NAMESPACE_STRATEGIES_SIZE = 2
+        try:
+            for cls in [type("Cls%d" % i, (object,), {}) for i in range(5)]:
+                util.obj_to_namespace(cls())
+                self.assertLessEqual(len(util.NAMESPACE_STRATEGIES), 2)
+        finally:
+            util.NAMESPACE_STRATEGIES_SIZE = size
+
     def test_namespace_classmethods(self):
         self.assertEqual(
             util.obj_to_namespace(ModelTestC), "test.django_namespace_perms"
@@ -153,6 +221,32 @@ class NSPTestCase(TestCase):
             False,
         )
 
+    def test_has_perms_many(self):
+        objs = []
+        for i in range(1, 4):
+            obj = ModelTestB()
+            obj.id = i
+            objs.append(obj)
+        self.assertEqual(
+            util.has_perms_many(self.perms, objs, constants.PERM_WRITE),
+            [True, False, False],
+        )
+        self.assertEqual(
+            util.has_perms_many(
+                self.perms,
+                [[objs[1], "allowedfield"], [objs[1], "deniedfield"], "a.b.c", "a.b.d"],
+                "read",
+            ),
+            [True, False, True, False],
+        )
+        self.assertEqual(
+            util.has_perms_many(
+                self.perms, ["e.a.a", "e.a.b"], constants.PERM_READ, explicit=True
+            ),
+            [False, True],
+        )
+        self.assertEqual(util.has_perms_many(self.perms, [], constants.PERM_READ), [])
+
     def test_permcode_to_namespace_view(self):
         label, flag = util.permcode_to_namespace("app.view_model")
         self.assertEqual("app.model.view", label)
@@ -414,6 +508,30 @@ class NSPTestCase(TestCase):
 
         self.assertEqual(expected, result)
 
+    def test_perms_structure_layer(self):
+        base = {k: v for k, v in list(self.perms.items()) if not k.startswith("x")}
+        layer = {
+            "a.b": constants.PERM_WRITE,
+            "a.b.c.d": constants.PERM_READ,
+            "a.100.1": constants.PERM_DENY,
+            "g": constants.PERM_DENY,
+            "x.*.z": constants.PERM_READ,
+            "new.ns": constants.PERM_READ,
+        }
+        base_struct = util.perms_structure(base)
+        expected_base = json.dumps(base_struct, sort_keys=True)
+
+        merged = dict(base)
+        merged.update(layer)
+        self.assertEqual(
+            util.perms_structure_layer(base_struct, layer),
+            util.perms_structure(merged),
+        )
+
+        # base structure is left untouched
+        self.assertEqual(json.dumps(base_struct, sort_keys=True), expected_base)
+        self.assertIs(util.perms_structure_layer(base_struct, {}), base_struct)
+
     def test_performance(self):
         def mkdataset(depth=3):
             depth = depth - 1
@@ -0,0 +1,184 @@
+import random
+from unittest import mock
+
+from django.contrib.auth.models import User, Group
+from django.test import TestCase
+
+from django_namespace_perms import query, util, constants
+from django_namespace_perms.models import GroupPermission, UserPermission
+from django_namespace_perms.query import (
+    nsp_filter,
+    NSPQuerySet,
+    groups_with_perms,
+    namespace_patterns,
+    users_with_perms,
+)
+
+
+###############################################################################
+
+
+class NSPFilterTestCase(TestCase):
+    def setUp(self):
+        self.groups = [Group.objects.create(name="group %d" % i) for i in range(5)]
+        self.ids = [group.id for group in self.groups]
+
+    def assert_filter(self, perms, level=constants.PERM_READ):
+        qset = nsp_filter(Group.objects.all(), perms, level)
+        expected = [
+            group.id
+            for group, ok in zip(
+                self.groups, util.has_perms_many(perms, self.groups, level)
+            )
+            if ok
+        ]
+        self.assertEqual(sorted(qset.values_list("id", flat=True)), expected)
+        return qset
+
+    def test_all(self):
+        qset = self.assert_filter({"auth": constants.PERM_READ})
+        self.assertNotIn("WHERE", str(qset.query))
+        self.assertEqual(qset.count(), 5)
+
+    def test_none(self):
+        qset = self.assert_filter({"auth.user": constants.PERM_READ})
+        self.assertEqual(qset.count(), 0)
+
+    def test_exclude(self):
+        qset = self.assert_filter(
+            {
+                "auth.group": constants.PERM_READ,
+                "auth.group.%d" % self.ids[1]: constants.PERM_DENY,
+            }
+        )
+        self.assertEqual(qset.count(), 4)
+
+    def test_include(self):
+        qset = self.assert_filter(
+            {
+                "auth.group.%d" % self.ids[0]: constants.PERM_READ,
+                "auth.*.%d" % self.ids[2]: constants.PERM_READ,
+                "auth.group.%d.name" % self.ids[3]: constants.PERM_READ,
+                "auth.group.abc": constants.PERM_READ,
+            }
+        )
+        self.assertEqual(qset.count(), 2)
+
+    def test_level(self):
+        perms = {
+            "auth.group": constants.PERM_READ,
+            "auth.group.%d" % self.ids[4]: constants.PERM_READ | constants.PERM_WRITE,
+        }
+        self.assertEqual(self.assert_filter(perms, constants.PERM_WRITE).count(), 1)
+
+    def test_superuser(self):
+        user = User(username="super", is_superuser=True)
+        self.assertEqual(nsp_filter(Group.objects.all(), user, "read").count(), 5)
+
+    def test_queryset(self):
+        qset = NSPQuerySet(model=Group).nsp_filter(
+            {"auth.group.%d" % self.ids[0]: constants.PERM_READ}, "read"
+        )
+        self.assertEqual(list(qset), [self.groups[0]])
+
+
+class NamespaceFilterTestCase(TestCase):
+    def test_under(self):
+        group = Group.objects.create(name="under")
+        for namespace in [
+            "a",
+            "a.b",
+            "a.b.c",
+            "a.b.c.d",
+            "a.b.%",
+            "a.bc",
+            "a.b-c",
+            "a.b_c",
+            "a.c",
+        ]:
+            GroupPermission.objects.create(
+                group=group, namespace=namespace, permissions=constants.PERM_READ
+            )
+        qset = GroupPermission.objects.filter(group=group).under("a.B")
+        self.assertEqual(
+            sorted(qset.values_list("namespace", flat=True)),
+            ["a.b", "a.b.%", "a.b.c", "a.b.c.d"],
+        )
+
+
+class ReverseLookupTestCase(TestCase):
+    def setUp(self):
+        rnd = random.Random(1)
+        segments = ["a", "b", "*"]
+
+        def rule():
+            return ".".join([rnd.choice(segments) for i in range(rnd.randint(1, 4))])
+
+        self.groups = [Group.objects.create(name="reverse %d" % i) for i in range(4)]
+        for group in self.groups:
+            for i in range(rnd.randint(0, 6)):
+                GroupPermission.objects.create(
+                    group=group, namespace=rule(), permissions=rnd.choice([0, 1, 3])
+                )
+
+        self.users = [User.objects.create_user(username="rev%d" % i) for i in range(8)]
+        for user in self.users:
+            user.groups.add(*rnd.sample(self.groups, rnd.randint(0, 2)))
+            for i in range(rnd.randint(0, 4)):
+                UserPermission.objects.create(
+                    user=user, namespace=rule(), permissions=rnd.choice([0, 1, 3])
+                )
+
+        self.namespaces = [rule() for i in range(30)]
+
+    def test_users_with_perms(self):
+        for namespace in self.namespaces:
+            for level in (constants.PERM_READ, constants.PERM_WRITE):
+                expected = [
+                    user.id
+                    for user in self.users
+                    if util.has_perms(User.objects.get(id=user.id), namespace, level)
+                ]
+                self.assertEqual(
+                    sorted(
+                        users_with_perms(namespace, level).values_list("id", flat=True)
+                    ),
+                    expected,
+                    namespace,
+                )
+
+    def test_groups_with_perms(self):
+        for namespace in self.namespaces:
+            expected = [
+                group.id
+                for group in self.groups
+                if util.has_perms(
+                    dict(
+                        GroupPermission.objects.filter(group=group).values_list(
+                            "namespace", "permissions"
+                        )
+                    ),
+                    namespace,
+                    "read",
+                )
+            ]
+            self.assertEqual(
+                sorted(
+                    groups_with_perms(namespace, "read").values_list("id", flat=True)
+                ),
+                expected,
+                namespace,
+            )
+
+    def test_patterns_depth(self):
+        self.assertEqual(len(namespace_patterns(["a"] * 10)), 2 ** 11 - 2)
+        self.assertEqual(len(namespace_patterns(["a"] * 20, 5)), 62)
+        # deeper namespaces are matched by the rules under their first
+        # segments
+        with mock.patch.object(query, "NAMESPACE_PATTERNS_DEPTH", 1):
+            self.test_users_with_perms()
+            self.test_groups_with_perms()
+
+    def test_superuser(self):
+        user = User.objects.create_superuser("rev_admin", "a@b.c", "x")
+        self.assertIn(user, users_with_perms("zzz", constants.PERM_WRITE))
@@ -0,0 +1,65 @@
+from django.contrib.auth.models import User, Group
+from django.test import TestCase
+
+from django_namespace_perms import constants
+from django_namespace_perms.models import UserPermission
+from django_namespace_perms.rest import (
+    PermissionedModelSerializer,
+    PermissionedListSerializer,
+)
+
+
+###############################################################################
+
+
+class GroupSerializer(PermissionedModelSerializer):
+    class Meta:
+        model = Group
+        fields = ["id", "name"]
+
+
+class PermissionedListSerializerTestCase(TestCase):
+    def setUp(self):
+        self.groups = [Group.objects.create(name="group %d" % i) for i in range(5)]
+        self.user = User.objects.create_user(username="list_user")
+
+    def grant(self, namespace, perms):
+        UserPermission.objects.create(
+            user=self.user, namespace=namespace, permissions=perms
+        )
+
+    def assert_list(self, expected):
+        serializer = GroupSerializer(
+            Group.objects.order_by("id"), many=True, context={"user": self.user}
+        )
+        self.assertIsInstance(serializer, PermissionedListSerializer)
+        data = serializer.data
+        self.assertEqual(
+            data,
+            [
+                GroupSerializer(group, context={"user": self.user}).data
+                for group in self.groups
+            ],
+        )
+        self.assertEqual(data, expected)
+
+    def test_fields(self):
+        self.grant("auth.group", constants.PERM_READ)
+        self.grant("auth.group.*.id", constants.PERM_DENY)
+        self.assert_list([{"name": group.name} for group in self.groups])
+
+    def test_instances(self):
+        self.grant("auth.group", constants.PERM_READ)
+        self.grant("auth.group.%d" % self.groups[1].id, constants.PERM_DENY)
+        self.assert_list(
+            [
+                {"id": group.id, "name": group.name} if i != 1 else {}
+                for i, group in enumerate(self.groups)
+            ]
+        )
+
+    def test_superuser(self):
+        self.user.is_superuser = True
+        self.assert_list(
+            [{"id": group.id, "name": group.name} for group in self.groups]
+        )
@@ -0,0 +1,145 @@
+import pickle
+import random
+
+from django.contrib.auth.models import Group
+from django.test import TestCase
+
+from django_namespace_perms import util, constants
+from django_namespace_perms.matcher import compile_perms
+from django_namespace_perms.query import nsp_filter
+from django_namespace_perms.structure import CompactStructure, compact_structure
+
+from .helpers import random_data, random_keys, random_perms, random_ruleset
+
+
+###############################################################################
+
+
+class CompactStructureTestCase(TestCase):
+    def test_equivalence_random(self):
+        rnd = random.Random(1)
+        for i in range(300):
+            perms = random_perms(rnd, rnd.randint(1, 12), levels=(0, 1, 2, 3))
+            perms_struct = util.perms_structure(perms)
+            struct = compact_structure(perms)
+            matcher = compile_perms(perms)
+
+            self.assertEqual(
+                sorted([(".".join(keys), p) for keys, p in struct.rules()]),
+                sorted(perms.items()),
+            )
+
+            for j in range(20):
+                keys = random_keys(rnd, 5)
+                explicit = rnd.random() < 0.3
+                self.assertEqual(
+                    util.get_perms(struct, keys, explicit=explicit).value,
+                    util.get_perms(perms_struct, keys, explicit=explicit).value,
+                )
+                self.assertEqual(
+                    struct.check_ambiguous(keys, constants.PERM_READ),
+                    matcher.check_ambiguous(keys, constants.PERM_READ),
+                )
+
+    def test_has_perms(self):
+        struct = compact_structure(
+            {"a": constants.PERM_READ, "a.b": constants.PERM_DENY, "c.*.d": 3}
+        )
+        self.assertEqual(util.has_perms(struct, "a.c", constants.PERM_READ), True)
+        self.assertEqual(util.has_perms(struct, "a.b", constants.PERM_READ), False)
+        self.assertEqual(util.has_perms(struct, "c.x.d", constants.PERM_WRITE), True)
+        self.assertEqual(
+            util.has_perms(struct, "c", constants.PERM_WRITE, ambiguous=True), True
+        )
+        self.assertEqual(
+            util.has_perms_many(struct, ["a", "a.b.c", "c.1.d"], constants.PERM_READ),
+            [True, False, True],
+        )
+
+    def test_permissions_apply(self):
+        rnd = random.Random(2)
+        for i in range(100):
+            perms = random_perms(rnd, rnd.randint(1, 12), levels=(0, 1, 2, 3))
+            data = random_data(rnd, 4)
+            ruleset = random_ruleset(rnd)
+            self.assertEqual(
+                util.permissions_apply(data, compact_structure(perms), ruleset=ruleset),
+                util.permissions_apply(
+                    data, util.perms_structure(perms), ruleset=ruleset
+                ),
+            )
+
+    def test_rule_order(self):
+        perms = {
+            "1.1.a.a": 15,
+            "a.*": 3,
+            "1": 0,
+            "c.*.c.1": 1,
+            "*.a": 15,
+            "b": 15,
+            "*.*": 0,
+        }
+        struct = compact_structure(perms)
+        self.assertEqual(
+            [(".".join(keys), p) for keys, p in struct.rules()], list(perms.items())
+        )
+
+        data = {"a": {"a": "v"}, "b": {"a": "v"}}
+        self.assertEqual(util.permissions_apply(data, struct), {"a": {}})
+        self.assertEqual(
+            util.permissions_apply(
+                data, compact_structure(util.perms_structure(perms))
+            ),
+            {"a": {}},
+        )
+
+    def test_from_structure(self):
+        perms = {"a": 1, "a.b": 0, "a.*.c": 3, "*": 2}
+        struct = compact_structure(util.perms_structure(perms))
+        self.assertEqual(
+            sorted([(".".join(keys), p) for keys, p in struct.rules()]),
+            sorted(perms.items()),
+        )
+        self.assertIs(compact_structure(struct), struct)
+
+    def test_compact(self):
+        struct = compact_structure({"a.b.c": 1, "a.b.d": 255, "a.x": 0})
+        self.assertEqual(struct.segments, ("a", "b", "c", "d", "x"))
+        self.assertEqual(len(struct), 6)
+        self.assertEqual(struct.values.typecode, "q")
+
+        struct = compact_structure({"a.b.c": 1, "a.b.d": 3, "a.x": 0})
+        self.assertEqual(struct.nbytes(), 6 * 2 + 6 + 7 * 2 + 3 * 2)
+        self.assertEqual(struct.node_keys(1), ["b", "x"])
+
+    def test_immutable_and_pickle(self):
+        struct = compact_structure({"a.b": 1, "a.*": 3})
+        with self.assertRaises(AttributeError):
+            struct.values = None
+
+        copied = pickle.loads(pickle.dumps(struct))
+        self.assertIsInstance(copied, CompactStructure)
+        self.assertEqual(list(copied.rules()), list(struct.rules()))
+        self.assertEqual(copied.get("a.c"), 3)
+        self.assertEqual(copied.wildcard, struct.wildcard)
+        with self.assertRaises(AttributeError):
+            copied.ids = {}
+
+        # copies compare equal and share the expanded structure
+        self.assertEqual(copied, struct)
+        self.assertEqual(hash(copied), hash(struct))
+        self.assertNotEqual(copied, compact_structure({"a.b": 1, "a.*": 1}))
+        self.assertIs(util.expanded_structure(copied), util.expanded_structure(struct))
+
+    def test_nsp_filter(self):
+        groups = [Group.objects.create(name="group %d" % i) for i in range(3)]
+        struct = compact_structure(
+            {
+                "auth.group": constants.PERM_READ,
+                "auth.group.%d" % groups[1].id: constants.PERM_DENY,
+            }
+        )
+        qset = nsp_filter(Group.objects.all(), struct, constants.PERM_READ)
+        self.assertEqual(
+            sorted(qset.values_list("id", flat=True)), [groups[0].id, groups[2].id]
+        )